@@ -200,13 +200,15 @@ function HomeContent() {
     setError('')
     
     try {
-      // Get video base64 or URL
-      let videoInput: { video_base64?: string; video_url?: string } = {}
+      // Point the backend at the stored video; video_url is only for third-party videos
+      let videoInput: { asset_id?: string; video_storage_path?: string; video_base64?: string } = {}
       
-      if (videoData.video_base64) {
+      if (videoData.asset_id) {
+        videoInput.asset_id = videoData.asset_id
+      } else if (videoData.storage_path) {
+        videoInput.video_storage_path = videoData.storage_path
+      } else if (videoData.video_base64) {
         videoInput.video_base64 = videoData.video_base64
-      } else if (videoData.video_url) {
-        videoInput.video_url = videoData.video_url
       } else {
         throw new Error('No video data available')
       }
@@ -271,15 +273,26 @@ function HomeContent() {
       
       const data = await response.json()
       
-      // Download the processed video
-      if (data.video_base64) {
+      // Download the processed video (served from storage via a short-lived URL;
+      // inline base64 is only present when requested)
+      let blob: Blob | null = null
+      if (data.video_url) {
+        const videoResponse = await fetch(data.video_url)
+        if (!videoResponse.ok) {
+          throw new Error('Failed to download processed video')
+        }
+        blob = await videoResponse.blob()
+      } else if (data.video_base64) {
         const byteCharacters = atob(data.video_base64)
         const byteNumbers = new Array(byteCharacters.length)
         for (let i = 0; i < byteCharacters.length; i++) {
           byteNumbers[i] = byteCharacters.charCodeAt(i)
         }
         const byteArray = new Uint8Array(byteNumbers)
-        const blob = new Blob([byteArray], { type: data.mime_type || 'video/mp4' })
+        blob = new Blob([byteArray], { type: data.mime_type || 'video/mp4' })
+      }
+      
+      if (blob) {
         const url = URL.createObjectURL(blob)
         const a = document.createElement('a')
         a.href = url
@@ -0,0 +1,126 @@
+"""Import-time (cold start) benchmark for each Cloud Functions entry point.
+
+Runs every entry point in a fresh interpreter under `python -X importtime`,
+repeats a few times and reports the fastest run, so the numbers are stable
+enough to compare between commits.
+
+Usage (from backend/, with the functions venv active):
+    python benchmarks/import_time.py
+    python benchmarks/import_time.py --runs 5 --top 15
+    python benchmarks/import_time.py --json import_time.json
+    python benchmarks/import_time.py --budget functions=300 --budget video=400
+
+With --budget, exits non-zero when an entry point's total import time (ms)
+exceeds its budget, so it can gate CI.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+SHARED_DIR = BACKEND_DIR / "functions"
+
+# entry point -> (codebase directory, modules imported on a cold request).
+# Handler entries add the dependencies those handlers import lazily.
+ENTRY_POINTS = {
+    "functions": ("functions", ["main"]),
+    "video": ("video", ["main"]),
+    "video.generate_ad": ("video", ["main", "openai"]),
+    "video.add_text_overlay": ("video", ["main", "overlay.ffmpeg_engine"]),
+}
+
+
+def parse_importtime(stderr):
+    """Parse `-X importtime` output into (total_us, {module: cumulative_us})
+
+    Only the entry modules and their direct imports are kept, which is the
+    level where a stray heavy top-level import shows up.
+    """
+    total_us = 0
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        try:
+            self_us, cumulative_us, name = [part.strip() for part in line.split(":", 1)[1].split("|", 2)]
+            self_us = int(self_us)
+            cumulative_us = int(cumulative_us)
+        except ValueError:
+            continue
+        total_us += self_us
+        # Each nesting level indents the module name by two more spaces
+        raw_name = line.rsplit("|", 1)[1]
+        depth = (len(raw_name) - len(raw_name.lstrip()) - 1) // 2
+        if depth <= 1:
+            modules[name] = modules.get(name, 0) + cumulative_us
+    return total_us, modules
+
+
+def measure(codebase, modules):
+    env = dict(os.environ)
+    # The video codebase gets grokads from ../functions at deploy time; point
+    # at the original so the benchmark does not depend on sync-shared.sh
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [str(SHARED_DIR), env.get("PYTHONPATH")]))
+    code = "; ".join(f"import {module}" for module in modules)
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=BACKEND_DIR / codebase,
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {modules} in {codebase}/ failed:\n{result.stderr[-2000:]}")
+    return parse_importtime(result.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=3, help="runs per entry point (fastest is reported)")
+    parser.add_argument("--top", type=int, default=10, help="slowest imports to list")
+    parser.add_argument("--json", dest="json_path", help="also write the report to this file")
+    parser.add_argument("--budget", action="append", default=[], metavar="ENTRY=MS",
+                        help="fail if ENTRY's total import time exceeds MS")
+    parser.add_argument("entry_points", nargs="*", help=f"subset of: {', '.join(ENTRY_POINTS)}")
+    args = parser.parse_args()
+
+    budgets = {}
+    for budget in args.budget:
+        name, _, ms = budget.partition("=")
+        budgets[name] = float(ms)
+
+    report = {}
+    for name in args.entry_points or ENTRY_POINTS:
+        codebase, modules = ENTRY_POINTS[name]
+        runs = [measure(codebase, modules) for _ in range(max(1, args.runs))]
+        total_us, modules_us = min(runs, key=lambda run: run[0])
+        slowest = sorted(modules_us.items(), key=lambda item: item[1], reverse=True)[:args.top]
+        report[name] = {
+            "total_ms": round(total_us / 1000, 1),
+            "runs_ms": [round(run[0] / 1000, 1) for run in runs],
+            "slowest_imports_ms": {module: round(us / 1000, 1) for module, us in slowest},
+        }
+
+        print(f"\n{name}  ({codebase}/: import {', '.join(modules)})")
+        print(f"  total: {report[name]['total_ms']:.1f} ms  (runs: {report[name]['runs_ms']})")
+        for module, ms in report[name]["slowest_imports_ms"].items():
+            print(f"  {ms:9.1f} ms  {module}")
+
+    if args.json_path:
+        Path(args.json_path).write_text(json.dumps(report, indent=2))
+
+    failed = [
+        f"{name}: {report[name]['total_ms']:.1f} ms > {limit:.1f} ms"
+        for name, limit in budgets.items()
+        if name in report and report[name]["total_ms"] > limit
+    ]
+    if failed:
+        print("\n❌ Import-time budget exceeded:\n  " + "\n  ".join(failed))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+"""Benchmark the add_text_overlay rendering engines (ffmpeg vs MoviePy).
+
+Renders the same text layers onto a test clip with each engine, in a fresh
+interpreter per run, and reports the fastest wall time and the CPU time
+(user + sys, including ffmpeg subprocesses) per clip. With --compare, the
+outputs are also decoded at a few timestamps and the mean absolute pixel
+difference between engines is printed, to check that placement matches.
+
+Usage (from backend/, with the video venv active):
+    python benchmarks/overlay_render.py
+    python benchmarks/overlay_render.py --runs 5 --duration 4 --size 720x1280
+    python benchmarks/overlay_render.py --compare
+    python benchmarks/overlay_render.py --layers 5
+    python benchmarks/overlay_render.py --input clip.mp4 --engines ffmpeg
+    python benchmarks/overlay_render.py --json overlay_render.json
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+VIDEO_DIR = BACKEND_DIR / "video"
+
+DEFAULT_LAYER = {
+    "text": "Limited drop - 50% off",
+    "position_x": 60,
+    "position_y": 200,
+    "font_size": 64,
+    "font_color": "white",
+    "font_path": None,
+    "stroke_color": "black",
+    "stroke_width": 3,
+    "start_time": 0.5,
+    "duration": 2.5,
+    "alignment": "center",
+}
+
+RENDER_SNIPPET = """
+import json, sys
+sys.path.insert(0, {video_dir!r})
+from overlay import render_overlay
+render_overlay({input!r}, {output!r}, json.loads({layers!r}), engine={engine!r})
+"""
+
+
+def ffmpeg_binary():
+    sys.path.insert(0, str(VIDEO_DIR))
+    from overlay.ffmpeg_engine import ffmpeg_binary as find
+    return find()
+
+
+def make_test_clip(path, duration, size):
+    """A synthetic clip with moving video and a sine-wave audio track"""
+    subprocess.run([
+        ffmpeg_binary(), "-hide_banner", "-loglevel", "error", "-y",
+        "-f", "lavfi", "-i", f"testsrc2=size={size}:rate=30:duration={duration}",
+        "-f", "lavfi", "-i", f"sine=frequency=440:duration={duration}",
+        "-c:v", "libx264", "-pix_fmt", "yuv420p", "-c:a", "aac", "-shortest", path,
+    ], check=True)
+
+
+def make_layers(count):
+    """`count` copies of DEFAULT_LAYER stacked down the frame, with staggered time windows"""
+    return [
+        dict(DEFAULT_LAYER, text=f"{DEFAULT_LAYER['text']} #{index + 1}", position_y=DEFAULT_LAYER["position_y"] + 90 * index,
+             start_time=DEFAULT_LAYER["start_time"] + 0.25 * index)
+        for index in range(count)
+    ] if count > 1 else [DEFAULT_LAYER]
+
+
+def run_engine(engine, input_path, output_path, layers):
+    """Render once in a fresh interpreter; returns (wall_sec, cpu_sec)"""
+    snippet = RENDER_SNIPPET.format(
+        video_dir=str(VIDEO_DIR), input=input_path, output=output_path, layers=json.dumps(layers), engine=engine
+    )
+    before = resource.getrusage(resource.RUSAGE_CHILDREN)
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, "-c", snippet], capture_output=True, text=True)
+    wall = time.perf_counter() - start
+    after = resource.getrusage(resource.RUSAGE_CHILDREN)
+    if result.returncode != 0:
+        raise RuntimeError(f"{engine} render failed:\n{result.stderr}")
+    if "falling back to MoviePy" in result.stdout:
+        raise RuntimeError("ffmpeg engine fell back to MoviePy:\n" + result.stdout)
+    cpu = (after.ru_utime - before.ru_utime) + (after.ru_stime - before.ru_stime)
+    return wall, cpu
+
+
+def decode_frame(path, timestamp, size):
+    width, height = (int(v) for v in size.split("x"))
+    raw = subprocess.run([
+        ffmpeg_binary(), "-hide_banner", "-loglevel", "error", "-ss", str(timestamp), "-i", path,
+        "-frames:v", "1", "-f", "rawvideo", "-pix_fmt", "rgb24", "-",
+    ], check=True, capture_output=True).stdout
+    return raw[:width * height * 3]
+
+
+def mean_abs_diff(a, b):
+    import numpy as np
+    return float(np.abs(np.frombuffer(a, np.uint8).astype(int) - np.frombuffer(b, np.uint8).astype(int)).mean())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=3, help="runs per engine (default 3)")
+    parser.add_argument("--input", help="clip to render onto (default: a generated test clip)")
+    parser.add_argument("--duration", type=float, default=4, help="generated clip length in seconds (default 4)")
+    parser.add_argument("--size", default="720x1280", help="generated clip size (default 720x1280)")
+    parser.add_argument("--layers", type=int, default=1, help="text layers per render (default 1)")
+    parser.add_argument("--engines", default="ffmpeg,moviepy", help="comma-separated engines to compare")
+    parser.add_argument("--compare", action="store_true", help="report pixel differences between engine outputs")
+    parser.add_argument("--json", metavar="PATH", help="also write the results as JSON")
+    args = parser.parse_args()
+
+    engines = [e.strip() for e in args.engines.split(",") if e.strip()]
+    workdir = tempfile.mkdtemp(prefix="overlay-bench-")
+    input_path = args.input or os.path.join(workdir, "input.mp4")
+    if not args.input:
+        make_test_clip(input_path, args.duration, args.size)
+
+    layers = make_layers(args.layers)
+    results = {}
+    outputs = {}
+    for engine in engines:
+        output_path = os.path.join(workdir, f"{engine}.mp4")
+        runs = [run_engine(engine, input_path, output_path, layers) for _ in range(args.runs)]
+        outputs[engine] = output_path
+        results[engine] = {
+            "wall_sec": round(min(wall for wall, _ in runs), 3),
+            "cpu_sec": round(min(cpu for _, cpu in runs), 3),
+            "size_bytes": os.path.getsize(output_path),
+        }
+
+    print(f"{'engine':<10} {'wall (s)':>10} {'cpu (s)':>10} {'size (KB)':>10}")
+    for engine, result in results.items():
+        print(f"{engine:<10} {result['wall_sec']:>10.3f} {result['cpu_sec']:>10.3f} {result['size_bytes'] / 1024:>10.0f}")
+
+    if args.compare and len(engines) >= 2 and not args.input:
+        base, other = engines[0], engines[1]
+        diffs = {}
+        for timestamp in (0.25, 1.0, 2.0, 3.5):
+            if timestamp < args.duration:
+                diffs[str(timestamp)] = round(mean_abs_diff(
+                    decode_frame(outputs[base], timestamp, args.size),
+                    decode_frame(outputs[other], timestamp, args.size),
+                ), 3)
+        results["pixel_diff"] = {"engines": [base, other], "mean_abs_diff_by_time": diffs}
+        print(f"mean |{base} - {other}| per channel (0-255), by timestamp: {diffs}")
+
+    if args.json:
+        Path(args.json).write_text(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
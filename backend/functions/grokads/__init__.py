@@ -0,0 +1 @@
+"""Shared helpers for the GrokAds Cloud Functions."""
@@ -0,0 +1,49 @@
+"""Lazy Firebase Admin initialisation.
+
+firebase_admin (and the Google Cloud clients behind it) is only imported and
+initialised the first time a handler actually needs it, instead of at module
+import time for every function.
+"""
+import os
+import threading
+
+_app = None
+_lock = threading.Lock()
+
+
+def get_app():
+    """Return the default Firebase app, initialising it on first use"""
+    global _app
+    if _app is None:
+        with _lock:
+            if _app is None:
+                import firebase_admin
+                try:
+                    _app = firebase_admin.get_app()
+                except ValueError:
+                    _app = firebase_admin.initialize_app()
+    return _app
+
+
+_db = None
+_bucket = None
+
+
+def get_firestore():
+    """Return a shared Firestore client"""
+    global _db
+    if _db is None:
+        get_app()
+        from firebase_admin import firestore
+        _db = firestore.client()
+    return _db
+
+
+def get_bucket():
+    """Return the default Cloud Storage bucket (STORAGE_BUCKET overrides it)"""
+    global _bucket
+    if _bucket is None:
+        get_app()
+        from firebase_admin import storage
+        _bucket = storage.bucket(os.getenv("STORAGE_BUCKET") or None)
+    return _bucket
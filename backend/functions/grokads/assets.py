@@ -0,0 +1,151 @@
+"""Content-addressed store for generated and processed media.
+
+Every stored media file is an asset whose id is the SHA-256 of its bytes.
+Its metadata is one document in the `assets` collection:
+
+    storage_path     where the bytes live in media storage
+    content_type     MIME type
+    size_bytes       file size
+    producer         the handler that made it (generate_ad, add_text_overlay, ...)
+    source_prompt    the prompt it was generated from, if any
+    width, height    frame size in pixels, if known
+    duration         length in seconds, if known
+    parent_asset_id  the asset it was derived from, if any
+    created_at       first time the content was stored
+
+Identical content is stored once: local files are hashed before upload and
+not uploaded again if the asset exists; streamed content is hashed while it
+is written, and the new copy is deleted if the asset already existed.
+
+Handlers accept an `asset_id` instead of re-uploading media, and get_asset
+serves assets with HTTP Range support. Metadata never changes once written,
+so it is also cached in process.
+"""
+import hashlib
+import mimetypes
+import re
+import time
+
+from grokads import storage
+from grokads.admin import get_firestore
+from grokads.cache import LRUCache
+
+COLLECTION = "assets"
+METADATA_FIELDS = ("producer", "source_prompt", "width", "height", "duration", "parent_asset_id")
+
+_ASSET_ID = re.compile(r"^[0-9a-f]{64}$")
+_memory = LRUCache(1024)
+
+
+def is_asset_id(value):
+    return isinstance(value, str) and bool(_ASSET_ID.match(value))
+
+
+def asset_path(asset_id, content_type):
+    """Storage path of content stored under its content address"""
+    extension = mimetypes.guess_extension(content_type) or ""
+    return f"assets/{asset_id[:2]}/{asset_id}{extension}"
+
+
+def _doc(asset_id):
+    return get_firestore().collection(COLLECTION).document(asset_id)
+
+
+def get(asset_id):
+    """Asset metadata (with "asset_id"), or None if unknown"""
+    if not is_asset_id(asset_id):
+        return None
+    asset = _memory.get(asset_id)
+    if asset is None:
+        snapshot = _doc(asset_id).get()
+        if not snapshot.exists:
+            return None
+        asset = {"asset_id": asset_id, **snapshot.to_dict()}
+        _memory.set(asset_id, asset)
+    return asset
+
+
+def _register(asset_id, storage_path, content_type, size_bytes, metadata):
+    """Create the asset document; returns (asset, created)"""
+    from google.api_core import exceptions
+
+    fields = {
+        "storage_path": storage_path,
+        "content_type": content_type,
+        "size_bytes": size_bytes,
+        "created_at": time.time(),
+        **{name: metadata.get(name) for name in METADATA_FIELDS},
+    }
+    try:
+        _doc(asset_id).create(fields)
+    except exceptions.AlreadyExists:
+        return get(asset_id), False
+    asset = {"asset_id": asset_id, **fields}
+    _memory.set(asset_id, asset)
+    return asset, True
+
+
+def file_digest(local_path):
+    digest = hashlib.sha256()
+    with open(local_path, "rb") as f:
+        for chunk in iter(lambda: f.read(storage.CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def put_file(local_path, content_type, **metadata):
+    """Store a local file as an asset (uploaded only if new); returns the asset
+
+    `metadata` may hold any of METADATA_FIELDS.
+    """
+    asset_id = file_digest(local_path)
+    existing = get(asset_id)
+    if existing is not None:
+        print(f"Asset {asset_id} already stored, skipping upload")
+        return existing
+
+    storage_path = asset_path(asset_id, content_type)
+    size_bytes = storage.save_file(storage_path, local_path, content_type)
+    asset, _ = _register(asset_id, storage_path, content_type, size_bytes, metadata)
+    return asset
+
+
+def put_bytes(data, content_type, **metadata):
+    """Store an in-memory payload as an asset (uploaded only if new); returns the asset"""
+    asset_id = hashlib.sha256(data).hexdigest()
+    existing = get(asset_id)
+    if existing is not None:
+        return existing
+
+    storage_path = storage.put_bytes(asset_path(asset_id, content_type), data, content_type)
+    asset, _ = _register(asset_id, storage_path, content_type, len(data), metadata)
+    return asset
+
+
+def put_stream(storage_path, chunks, content_type, **metadata):
+    """Stream chunks to `storage_path`, hashing as they go, and register the asset
+
+    If the content was already stored, the new copy is deleted and the
+    existing asset is returned.
+    """
+    digest = hashlib.sha256()
+
+    def hashed_chunks():
+        for chunk in chunks:
+            digest.update(chunk)
+            yield chunk
+
+    size_bytes = storage.save_stream(storage_path, hashed_chunks(), content_type)
+    asset, created = _register(digest.hexdigest(), storage_path, content_type, size_bytes, metadata)
+    if not created and asset["storage_path"] != storage_path:
+        print(f"Asset {asset['asset_id']} already stored at {asset['storage_path']}, removing duplicate")
+        storage.delete(storage_path)
+    return asset
+
+
+def response_fields(asset):
+    """Fields describing an asset in API responses"""
+    return {
+        "asset_id": asset["asset_id"],
+        **{name: asset.get(name) for name in ("width", "height", "duration", "parent_asset_id") if asset.get(name) is not None},
+    }
@@ -0,0 +1,735 @@
+"""Campaign storage and the resumable, checkpointed campaign pipeline.
+
+A campaign is built in stages that depend on each other:
+
+    strategy -> variants -> images        (one image per variant)
+                        \\-> predictions  (one score per variant)
+
+Stages whose dependencies are done run concurrently, so images and
+predictions overlap, and each fans out per variant with bounded
+concurrency. Stages run on a pool of their own: they wait for their
+fan-out tasks on the shared grokads.concurrency pool, and must never hold
+its threads while doing so. Every stage writes its output to Firestore as it finishes
+(images after each variant), so a run that fails or runs out of time is
+resumed from the last checkpoint instead of starting over: finished stages
+are skipped and a partly done images stage only generates the missing ones.
+build_campaign stores its strategy and variants the same way, as an already
+completed campaign, after the response (save_in_background).
+
+Campaigns belong to the uid of the caller's verified Firebase ID token
+(request_owner); build_campaign without one stores nothing, and the other
+endpoints answer 401.
+
+Storage is normalised so list views never download variant payloads:
+
+    campaigns/{id}                   summary and pipeline state
+        owner, source, product, target_audience, goals, status,
+        variant_count, top_engagement_score, created_at, updated_at,
+        params, stages {name: {status, started_at, completed_at, done,
+        total, error}}, strategy, lease_until, runs
+    campaigns/{id}/variants/{nnn}    one variant: its copy and prompts,
+        index, image (grokads.images reference), engagement_score
+    campaigns/{id}/predictions/{nnn} the full prediction for variant nnn
+
+owner, campaign_id and created_at are copied onto variants and predictions
+so collection-group queries can filter on them. The composite indexes for
+the list queries are declared in firestore.indexes.json; listings page with
+opaque cursors and read only SUMMARY_FIELDS / VARIANT_LIST_FIELDS.
+
+Configuration (environment variables):
+    CAMPAIGN_RUN_BUDGET_SEC      - time a run may start new work for (default and
+                                   maximum: MAX_RUN_BUDGET_SEC, 450)
+    CAMPAIGN_IMAGE_CONCURRENCY   - concurrent image generations (default 4)
+    CAMPAIGN_IMAGE_MODEL         - xAI image model (default grok-imagine-v0p9)
+"""
+import base64
+import binascii
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+from grokads import concurrency, images, predictions, token_budget, upstream
+from grokads.admin import get_app, get_firestore
+from grokads.variants import generate_variants_sharded
+
+COLLECTION = "campaigns"
+VARIANTS = "variants"
+PREDICTIONS = "predictions"
+IMAGE_CONCURRENCY = int(os.getenv("CAMPAIGN_IMAGE_CONCURRENCY", "4"))
+IMAGE_MODEL = os.getenv("CAMPAIGN_IMAGE_MODEL", "grok-imagine-v0p9")
+# run_campaign's function timeout
+RUN_TIMEOUT_SEC = 540
+# Work started before a run's deadline may finish this much later (the lease
+# covers it)
+OVERRUN_SEC = 60
+# Left after the overrun for the final checkpoint and the response
+FINISH_MARGIN_SEC = 30
+MAX_RUN_BUDGET_SEC = RUN_TIMEOUT_SEC - OVERRUN_SEC - FINISH_MARGIN_SEC
+RUN_BUDGET_SEC = min(float(os.getenv("CAMPAIGN_RUN_BUDGET_SEC", str(MAX_RUN_BUDGET_SEC))), MAX_RUN_BUDGET_SEC)
+
+# Stage name -> stages it depends on, in run order
+STAGES = {
+    "strategy": (),
+    "variants": ("strategy",),
+    "images": ("variants",),
+    "predictions": ("variants",),
+}
+DONE_STATUSES = ("completed", "skipped")
+TERMINAL_STATUSES = ("completed", "incomplete", "failed")
+MAX_WAIT_SEC = 50
+POLL_INTERVAL_SEC = 1.0
+
+_stage_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="campaign-stages")
+
+# Variant fields sent for scoring (not the generation prompts)
+AD_FIELDS = ("headline", "copy", "cta", "visual_style", "emotion", "angle")
+
+# Projections for list views
+SUMMARY_FIELDS = ("owner", "source", "product", "target_audience", "goals", "status", "variant_count",
+                  "top_engagement_score", "created_at", "updated_at")
+VARIANT_LIST_FIELDS = ("campaign_id", "index", "headline", "copy", "cta", "emotion", "angle",
+                       "engagement_score", "image.asset_id", "image.renditions.thumbnail")
+# Sort orders: name -> field (always descending)
+CAMPAIGN_ORDERS = {"created_at": "created_at", "engagement_score": "top_engagement_score"}
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+
+class StageError(Exception):
+    """A stage failed; the campaign can be resumed"""
+
+
+def strategy_prompt(product, target_audience, budget, goals):
+    return f"""You are an expert advertising strategist. Create a comprehensive ad campaign strategy for:
+
+Product/Service: {product}
+Target Audience: {target_audience}
+Budget: {budget}
+Goals: {', '.join(goals)}
+
+Provide a detailed campaign strategy with:
+1. Campaign overview and positioning
+2. Key messaging pillars (3-5)
+3. Target audience insights
+4. Channel recommendations
+5. Budget allocation suggestions
+6. Success metrics
+
+Format your response as a JSON object with these exact keys:
+{{
+  "overview": "Campaign overview text",
+  "positioning": "Brand positioning statement",
+  "messaging_pillars": ["pillar1", "pillar2", "pillar3"],
+  "audience_insights": "Detailed audience insights",
+  "channels": ["channel1", "channel2"],
+  "budget_allocation": {{"channel1": "percentage", "channel2": "percentage"}},
+  "success_metrics": ["metric1", "metric2"]
+}}"""
+
+
+def variants_prompt(product, target_audience, strategy, count, angle_hint):
+    prompt = f"""Generate {count} unique ad variants for this campaign:
+
+Product: {product}
+Target Audience: {target_audience}
+Strategy: {json.dumps(strategy, indent=2)}
+
+For each variant, create:
+- A catchy headline
+- Compelling ad copy (2-3 sentences)
+- Call-to-action
+- Suggested visual style
+- Target emotion/angle
+- Image generation prompt (detailed description for creating an ad image, 1-2 sentences)
+- Video generation prompt (detailed description for creating a short video ad, 1-2 sentences)
+
+Format as JSON object with "variants" array:
+{{
+  "variants": [
+    {{
+      "headline": "string",
+      "copy": "string",
+      "cta": "string",
+      "visual_style": "string",
+      "emotion": "string",
+      "angle": "string",
+      "image_prompt": "detailed prompt for image generation",
+      "video_prompt": "detailed prompt for video generation"
+    }}
+  ]
+}}"""
+    if angle_hint:
+        prompt += f"\n\nCreative direction for this batch: {angle_hint}"
+    return prompt
+
+
+def default_variants(product, count):
+    """Generic variants for when the model returned none"""
+    return [
+        {
+            "headline": f"Ad Variant {i+1} for {product}",
+            "copy": f"Discover {product} - the solution you've been looking for.",
+            "cta": "Learn More",
+            "visual_style": "Modern and clean",
+            "emotion": "Excitement",
+            "angle": "Problem-solution",
+            "image_prompt": f"Create an engaging advertisement image showcasing {product} with a modern, clean aesthetic that conveys excitement and solves problems",
+            "video_prompt": f"Create a short, dynamic video advertisement featuring {product} that demonstrates its value and creates excitement, with modern visuals and clear messaging"
+        }
+        for i in range(count)
+    ]
+
+
+def fill_variant_prompts(variants, product):
+    """Give every variant an image and video prompt"""
+    for variant in variants:
+        if "image_prompt" not in variant or not variant.get("image_prompt"):
+            variant["image_prompt"] = f"Create an engaging advertisement image for {product}: {variant.get('headline', '')}. Style: {variant.get('visual_style', 'modern')}. Emotion: {variant.get('emotion', 'excitement')}"
+        if "video_prompt" not in variant or not variant.get("video_prompt"):
+            variant["video_prompt"] = f"Create a short video advertisement for {product}: {variant.get('headline', '')}. Show {variant.get('angle', 'value proposition')}. Style: {variant.get('visual_style', 'dynamic')}. Emotion: {variant.get('emotion', 'excitement')}"
+    return variants
+
+
+
+
+def _doc(campaign_id):
+    return get_firestore().collection(COLLECTION).document(campaign_id)
+
+
+def _variant_doc(campaign_id, index):
+    return _doc(campaign_id).collection(VARIANTS).document(f"{index:03d}")
+
+
+def _prediction_doc(campaign_id, index):
+    return _doc(campaign_id).collection(PREDICTIONS).document(f"{index:03d}")
+
+
+def request_owner(req, required=True):
+    """Owner of the campaigns a request creates or lists
+
+    The uid of the verified Firebase ID token sent as `Authorization: Bearer
+    <token>`; nothing the client sends otherwise is trusted. Raises
+    PermissionError (a 401) for an invalid token, or a missing one when
+    `required`; returns None without a token otherwise.
+    """
+    header = req.headers.get("Authorization", "")
+    if not header.startswith("Bearer "):
+        if required:
+            raise PermissionError("Sign in required: send a Firebase ID token as 'Authorization: Bearer <token>'")
+        return None
+    get_app()
+    from firebase_admin import auth
+    try:
+        return auth.verify_id_token(header[len("Bearer "):])["uid"]
+    except Exception as token_error:
+        raise PermissionError(f"Invalid ID token: {token_error}")
+
+
+def build_params(data):
+    """Campaign parameters from a request body; raises ValueError (a 400)"""
+    if not data.get("product"):
+        raise ValueError("Missing 'product' in request body")
+    stages = data.get("stages", list(STAGES))
+    if not isinstance(stages, list) or any(name not in STAGES for name in stages):
+        raise ValueError(f"'stages' must be a list of: {', '.join(STAGES)}")
+    try:
+        num_variants = int(data.get("num_variants", 10))
+    except (TypeError, ValueError):
+        raise ValueError("'num_variants' must be a number")
+    return {
+        "product": data["product"],
+        "target_audience": data.get("target_audience", "General audience"),
+        "budget": data.get("budget", "Medium"),
+        "goals": data.get("goals", ["awareness", "conversions"]),
+        "num_variants": min(max(1, num_variants), 50),
+        "channel": data.get("channel", "social_media"),
+        # strategy and variants are needed by everything else
+        "stages": [name for name in STAGES if name in stages or name in ("strategy", "variants")],
+    }
+
+
+def _summary(params, owner, source, now):
+    return {
+        "owner": owner,
+        "source": source,
+        "product": params["product"],
+        "target_audience": params["target_audience"],
+        "goals": params["goals"],
+        "variant_count": 0,
+        "top_engagement_score": None,
+        "params": params,
+        "strategy": None,
+        "lease_until": None,
+        "runs": 0,
+        "created_at": now,
+        "updated_at": now,
+    }
+
+
+def create_campaign(params, owner):
+    """Create a queued pipeline campaign and return its id"""
+    campaign_id = uuid.uuid4().hex
+    _doc(campaign_id).set({
+        **_summary(params, owner, "pipeline", time.time()),
+        "status": "queued",
+        "stages": {
+            name: {"status": "pending" if name in params["stages"] else "skipped"}
+            for name in STAGES
+        },
+    })
+    return campaign_id
+
+
+def save_campaign(params, strategy, variants, owner, campaign_id=None):
+    """Store a campaign built in one request (build_campaign); returns its id"""
+    campaign_id = campaign_id or uuid.uuid4().hex
+    now = time.time()
+    batch = get_firestore().batch()
+    batch.set(_doc(campaign_id), {
+        **_summary(params, owner, "build_campaign", now),
+        "status": "completed",
+        "stages": {
+            name: {"status": "completed" if name in ("strategy", "variants") else "skipped"}
+            for name in STAGES
+        },
+        "strategy": strategy,
+        "variant_count": len(variants),
+    })
+    _write_variants(batch, {"id": campaign_id, "owner": owner, "created_at": now}, variants)
+    batch.commit()
+    return campaign_id
+
+
+def save_in_background(params, strategy, variants, owner):
+    """save_campaign without delaying the response (best effort); returns the campaign id"""
+    campaign_id = uuid.uuid4().hex
+
+    def save():
+        try:
+            save_campaign(params, strategy, variants, owner, campaign_id)
+        except Exception as store_error:
+            print(f"Failed to store campaign {campaign_id}: {str(store_error)}")
+
+    concurrency.submit(save)
+    return campaign_id
+
+
+def get_campaign(campaign_id):
+    snapshot = _doc(campaign_id).get()
+    if not snapshot.exists:
+        return None
+    return {"id": campaign_id, **snapshot.to_dict()}
+
+
+def load_variants(campaign_id):
+    """The campaign's variant documents, in variant order"""
+    return [snapshot.to_dict() for snapshot in _doc(campaign_id).collection(VARIANTS).order_by("index").stream()]
+
+
+def load_predictions(campaign_id):
+    """The campaign's prediction documents, in variant order"""
+    return [snapshot.to_dict() for snapshot in _doc(campaign_id).collection(PREDICTIONS).order_by("index").stream()]
+
+
+def _update(campaign_id, fields):
+    fields["updated_at"] = time.time()
+    _doc(campaign_id).update(fields)
+
+
+def _write_variants(batch, campaign, variants):
+    for index, variant in enumerate(variants):
+        batch.set(_variant_doc(campaign["id"], index), {
+            **variant,
+            "index": index,
+            "campaign_id": campaign["id"],
+            "owner": campaign["owner"],
+            "created_at": campaign["created_at"],
+            "image": None,
+            "engagement_score": None,
+        })
+
+
+def claim_run(campaign_id, budget_sec):
+    """Take the run lease; returns the campaign, or None if another run holds it
+
+    The lease outlives the run budget, so a run that was killed mid-stage
+    (instance timeout) frees the campaign once it expires.
+    """
+    from google.cloud import firestore
+
+    db = get_firestore()
+    doc_ref = _doc(campaign_id)
+
+    @firestore.transactional
+    def claim(transaction):
+        snapshot = doc_ref.get(transaction=transaction)
+        if not snapshot.exists:
+            return None
+        campaign = snapshot.to_dict()
+        now = time.time()
+        if campaign.get("status") == "running" and (campaign.get("lease_until") or 0) > now:
+            return None
+        fields = {
+            "status": "running",
+            "lease_until": now + budget_sec + OVERRUN_SEC,
+            "runs": campaign.get("runs", 0) + 1,
+            "updated_at": now,
+        }
+        transaction.update(doc_ref, fields)
+        return {"id": campaign_id, **campaign, **fields}
+
+    return claim(db.transaction())
+
+
+def _run_strategy(campaign, api_key, deadline):
+    params = campaign["params"]
+    response = upstream.grok_chat(
+        strategy_prompt(params["product"], params["target_audience"], params["budget"], params["goals"]),
+        temperature=0.7,
+        max_tokens=token_budget.plan("strategy"),
+        timeout=60,
+        api_key=api_key
+    )
+    token_budget.observe("strategy", response)
+    if response.status_code != 200:
+        raise StageError(f"Strategy generation failed: {response.text}")
+    try:
+        strategy = json.loads(upstream.chat_content(response))
+    except ValueError:
+        raise StageError("Failed to parse strategy")
+    _update(campaign["id"], {"strategy": strategy, "stages.strategy.done": 1, "stages.strategy.total": 1})
+    return "completed"
+
+
+def _run_variants(campaign, api_key, deadline):
+    params = campaign["params"]
+    sharded = generate_variants_sharded(
+        lambda count, angle_hint: variants_prompt(
+            params["product"], params["target_audience"], campaign["strategy"], count, angle_hint
+        ),
+        params["num_variants"],
+        temperature=0.9,
+        budget="campaign_variants",
+        timeout=60,
+        api_key=api_key
+    )
+    variants = sharded["variants"][:params["num_variants"]]
+    if not variants:
+        error = sharded["error"] or {}
+        raise StageError(f"Variant generation failed: {error.get('text', 'no variants returned')}")
+    fill_variant_prompts(variants, params["product"])
+
+    batch = get_firestore().batch()
+    _write_variants(batch, campaign, variants)
+    batch.update(_doc(campaign["id"]), {
+        "variant_count": len(variants),
+        "stages.variants.done": len(variants),
+        "stages.variants.total": len(variants),
+        "updated_at": time.time(),
+    })
+    batch.commit()
+    return "completed"
+
+
+def _generate_image(campaign, variant, api_key, options):
+    response = upstream.xai_images({
+        "prompt": variant["image_prompt"],
+        "model": IMAGE_MODEL,
+        "n": 1,
+        "response_format": "b64_json"
+    }, api_key, timeout=60)
+    if response.status_code != 200:
+        raise StageError(f"xAI Image API error {response.status_code}: {response.text[:200]}")
+    items = response.json().get("data") or []
+    if not items:
+        raise StageError("xAI Image API returned no image")
+    image = images.process_item(items[0], options, variant["image_prompt"])
+    _variant_doc(campaign["id"], variant["index"]).update({"image": image})
+    return image
+
+
+def _run_images(campaign, api_key, deadline):
+    variants = load_variants(campaign["id"])
+    pending = [variant for variant in variants if not variant.get("image")]
+    _update(campaign["id"], {"stages.images.total": len(variants)})
+    options = images.build_options(True)
+    limit = threading.BoundedSemaphore(max(1, IMAGE_CONCURRENCY))
+
+    # The slot is taken before submitting, so queued images don't hold pool threads
+    futures = {}
+    for variant in pending:
+        if not limit.acquire(timeout=max(0, deadline - time.time())):
+            break
+        future = concurrency.submit(_generate_image, campaign, variant, api_key, options)
+        future.add_done_callback(lambda _: limit.release())
+        futures[variant["index"]] = future
+
+    done = len(variants) - len(pending)
+    errors = []
+    for index, future in futures.items():
+        try:
+            future.result(timeout=max(0, deadline + OVERRUN_SEC - time.time()))
+            done += 1
+        except FutureTimeoutError:
+            # Still running; it checkpoints its image when done, or the next run retries it
+            print(f"Campaign {campaign['id']} image {index} did not finish before the deadline")
+        except Exception as image_error:
+            print(f"Campaign {campaign['id']} image {index} failed: {image_error}")
+            errors.append(f"variant {index}: {image_error}")
+    _update(campaign["id"], {"stages.images.done": done})
+
+    if errors:
+        raise StageError(f"{len(errors)} of {len(variants)} images failed; first error: {errors[0]}")
+    return "completed" if done == len(variants) else "incomplete"
+
+
+def _run_predictions(campaign, api_key, deadline):
+    params = campaign["params"]
+    variants = load_variants(campaign["id"])
+    ads = [{field: variant.get(field) for field in AD_FIELDS} for variant in variants]
+    results = predictions.predict_batch(ads, params["target_audience"], params["channel"], params["budget"], api_key,
+                                        timeout=max(1, deadline + OVERRUN_SEC - time.time()))
+
+    batch = get_firestore().batch()
+    scores = []
+    for variant, result in zip(variants, results):
+        score = result["prediction"].get("engagement_score")
+        scores.append(score)
+        batch.set(_prediction_doc(campaign["id"], variant["index"]), {
+            **result,
+            "index": variant["index"],
+            "campaign_id": campaign["id"],
+            "owner": campaign["owner"],
+            "created_at": campaign["created_at"],
+        })
+        batch.update(_variant_doc(campaign["id"], variant["index"]), {"engagement_score": score})
+    batch.update(_doc(campaign["id"]), {
+        "top_engagement_score": max((score for score in scores if score is not None), default=None),
+        "stages.predictions.done": len(results),
+        "stages.predictions.total": len(ads),
+        "updated_at": time.time(),
+    })
+    batch.commit()
+    return "completed"
+
+
+_STAGE_RUNNERS = {
+    "strategy": _run_strategy,
+    "variants": _run_variants,
+    "images": _run_images,
+    "predictions": _run_predictions,
+}
+
+
+def _run_stage(name, campaign, api_key, deadline):
+    """Run one stage and record its outcome; returns the stage status"""
+    started_at = time.time()
+    _update(campaign["id"], {f"stages.{name}.status": "running", f"stages.{name}.started_at": started_at,
+                             f"stages.{name}.error": None})
+    try:
+        status = _STAGE_RUNNERS[name](campaign, api_key, deadline)
+        error = None
+    except Exception as stage_error:
+        status, error = "failed", str(stage_error)
+        print(f"Campaign {campaign['id']} stage {name} failed: {error}")
+    fields = {f"stages.{name}.status": status, f"stages.{name}.error": error}
+    if status == "completed":
+        fields[f"stages.{name}.completed_at"] = time.time()
+    _update(campaign["id"], fields)
+    print(f"Campaign {campaign['id']} stage {name}: {status} in {time.time() - started_at:.1f}s")
+    return status
+
+
+def ready_stages(campaign):
+    """Stages not done yet whose dependencies are all done"""
+    stages = campaign["stages"]
+    return [
+        name for name, dependencies in STAGES.items()
+        if stages[name]["status"] not in DONE_STATUSES
+        and all(stages[dependency]["status"] in DONE_STATUSES for dependency in dependencies)
+    ]
+
+
+def run(campaign_id, api_key=None, budget_sec=None):
+    """Run (or resume) a campaign until it is done, a stage fails, or the budget is spent
+
+    Returns the campaign, or None if another run holds its lease.
+    """
+    budget_sec = min(budget_sec or RUN_BUDGET_SEC, MAX_RUN_BUDGET_SEC)
+    campaign = claim_run(campaign_id, budget_sec)
+    if campaign is None:
+        return None
+    deadline = time.time() + budget_sec
+
+    while True:
+        ready = ready_stages(campaign)
+        if not ready or time.time() >= deadline:
+            break
+        futures = {name: concurrency.submit_to(_stage_executor, _run_stage, name, campaign, api_key, deadline)
+                   for name in ready}
+        statuses = {}
+        for name, future in futures.items():
+            try:
+                statuses[name] = future.result(timeout=max(0, deadline + OVERRUN_SEC - time.time()))
+            except FutureTimeoutError:
+                print(f"Campaign {campaign_id} stage {name} still running at the deadline")
+                statuses[name] = "incomplete"
+        campaign = get_campaign(campaign_id)
+        if any(status != "completed" for status in statuses.values()):
+            break
+
+    stage_statuses = [stage["status"] for stage in campaign["stages"].values()]
+    if all(status in DONE_STATUSES for status in stage_statuses):
+        status = "completed"
+    elif "failed" in stage_statuses:
+        status = "failed"
+    else:
+        status = "incomplete"
+    _update(campaign_id, {"status": status, "lease_until": None})
+    return get_campaign(campaign_id)
+
+
+def wait_for_campaign(campaign_id, since=None, timeout=25):
+    """Long-poll a campaign (see jobs.wait_for_job)"""
+    deadline = time.time() + min(max(0, timeout), MAX_WAIT_SEC)
+    while True:
+        campaign = get_campaign(campaign_id)
+        if campaign is None:
+            return None
+        if since is None or campaign["updated_at"] > since or campaign["status"] in TERMINAL_STATUSES:
+            return campaign
+        if time.time() >= deadline:
+            return campaign
+        time.sleep(POLL_INTERVAL_SEC)
+
+
+def progress(campaign):
+    """Overall progress, 0-100: each active stage weighs the same"""
+    stages = [stage for stage in campaign["stages"].values() if stage["status"] != "skipped"]
+    if not stages:
+        return 100
+    total = 0.0
+    for stage in stages:
+        if stage["status"] == "completed":
+            total += 1
+        elif stage.get("total"):
+            total += min(stage.get("done", 0) / stage["total"], 1)
+    return round(100 * total / len(stages))
+
+
+def public_view(campaign, variants=None, predictions_by_variant=None):
+    """The campaign fields that are returned to clients
+
+    `variants` and `predictions_by_variant` (from load_variants /
+    load_predictions) are only read for the detail view.
+    """
+    variants = variants or []
+    predictions_by_index = {prediction["index"]: prediction for prediction in predictions_by_variant or []}
+    internal = ("index", "campaign_id", "owner", "created_at", "image", "engagement_score")
+    return {
+        "campaign_id": campaign["id"],
+        "owner": campaign.get("owner"),
+        "source": campaign.get("source"),
+        "status": campaign.get("status"),
+        "progress": progress(campaign),
+        "params": campaign.get("params"),
+        "stages": campaign.get("stages"),
+        "strategy": campaign.get("strategy"),
+        "variants": [{key: value for key, value in variant.items() if key not in internal} for variant in variants],
+        "images": [variant.get("image") for variant in variants],
+        "predictions": [predictions_by_index.get(variant["index"]) for variant in variants]
+        if predictions_by_index else None,
+        "top_engagement_score": campaign.get("top_engagement_score"),
+        "runs": campaign.get("runs", 0),
+        "created_at": campaign.get("created_at"),
+        "updated_at": campaign.get("updated_at"),
+    }
+
+
+def detail_view(campaign):
+    """public_view with the variants, images (fresh URLs) and predictions"""
+    variants = load_variants(campaign["id"])
+    for variant in variants:
+        if variant.get("image"):
+            images.refresh_urls(variant["image"])
+    return public_view(campaign, variants, load_predictions(campaign["id"]))
+
+
+def encode_cursor(snapshot):
+    """Opaque page cursor: the path of the last document of the page"""
+    return base64.urlsafe_b64encode(snapshot.reference.path.encode("utf-8")).decode("ascii")
+
+
+def _cursor_snapshot(cursor, order_field):
+    """The document a cursor points at; raises ValueError for a bad cursor (a 400)"""
+    try:
+        path = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8")
+    except (ValueError, binascii.Error, UnicodeError):
+        raise ValueError("Invalid 'cursor'")
+    if not path.startswith(f"{COLLECTION}/") or ".." in path:
+        raise ValueError("Invalid 'cursor'")
+    snapshot = get_firestore().document(path).get(field_paths=[order_field])
+    if not snapshot.exists:
+        raise ValueError("'cursor' points at a deleted document")
+    return snapshot
+
+
+def _page(query, order_field, limit, cursor):
+    """Run a descending, cursor-paged query; returns (snapshots, next_cursor)"""
+    query = query.order_by(order_field, direction="DESCENDING")
+    if cursor:
+        query = query.start_after(_cursor_snapshot(cursor, order_field))
+    snapshots = list(query.limit(limit + 1).stream())
+    next_cursor = encode_cursor(snapshots[limit - 1]) if len(snapshots) > limit else None
+    return snapshots[:limit], next_cursor
+
+
+def page_size(value):
+    """Page size from a `limit` query argument; raises ValueError (a 400)"""
+    try:
+        limit = int(value) if value else DEFAULT_PAGE_SIZE
+    except ValueError:
+        raise ValueError("'limit' must be a number")
+    return min(max(1, limit), MAX_PAGE_SIZE)
+
+
+def list_campaigns(owner, goal=None, order="created_at", limit=DEFAULT_PAGE_SIZE, cursor=None):
+    """One page of the owner's campaign summaries, newest (or best scoring) first
+
+    Returns (campaigns, next_cursor). By engagement_score, campaigns
+    without predictions come last.
+    """
+    if order not in CAMPAIGN_ORDERS:
+        raise ValueError(f"'order' must be one of: {', '.join(CAMPAIGN_ORDERS)}")
+    order_field = CAMPAIGN_ORDERS[order]
+
+    from google.cloud.firestore_v1.base_query import FieldFilter
+
+    query = get_firestore().collection(COLLECTION).where(filter=FieldFilter("owner", "==", owner))
+    if goal:
+        query = query.where(filter=FieldFilter("goals", "array_contains", goal))
+    query = query.select(list(SUMMARY_FIELDS))
+    snapshots, next_cursor = _page(query, order_field, limit, cursor)
+    return [{"campaign_id": snapshot.id, **snapshot.to_dict()} for snapshot in snapshots], next_cursor
+
+
+def list_variants(owner, campaign_id=None, limit=DEFAULT_PAGE_SIZE, cursor=None):
+    """One page of variants by predicted engagement score, best first
+
+    Within one campaign when `campaign_id` is given, otherwise across all of
+    the owner's campaigns (a collection-group query). Returns (variants,
+    next_cursor); only VARIANT_LIST_FIELDS are read.
+    """
+    from google.cloud.firestore_v1.base_query import FieldFilter
+
+    db = get_firestore()
+    if campaign_id:
+        query = db.collection(COLLECTION).document(campaign_id).collection(VARIANTS)
+    else:
+        query = db.collection_group(VARIANTS)
+    query = query.where(filter=FieldFilter("owner", "==", owner)).select(list(VARIANT_LIST_FIELDS))
+    snapshots, next_cursor = _page(query, "engagement_score", limit, cursor)
+    return [snapshot.to_dict() for snapshot in snapshots], next_cursor
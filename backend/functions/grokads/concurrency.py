@@ -0,0 +1,51 @@
+"""Shared thread pool for fanning out independent upstream calls.
+
+Upstream calls are I/O bound, so a module-level thread pool (reused across
+requests on a warm instance) lets a handler overlap them instead of paying
+for each round trip in sequence.
+
+Configuration (environment variables):
+    FANOUT_MAX_WORKERS - size of the shared pool (default 32)
+"""
+import contextvars
+import os
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+from grokads import metrics
+
+FANOUT_MAX_WORKERS = int(os.getenv("FANOUT_MAX_WORKERS", "32"))
+
+_executor = ThreadPoolExecutor(max_workers=FANOUT_MAX_WORKERS, thread_name_prefix="fanout")
+
+
+def submit(fn, *args, **kwargs):
+    """Run `fn` on the shared pool and return its Future
+
+    The task runs in a copy of the caller's context, so per-request state
+    (grokads.metrics) follows it into the pool thread. Tasks on this pool
+    must not wait for other tasks on it: a pool full of waiting parents
+    never gets to their children. Run such parents with submit_to on an
+    executor of their own.
+    """
+    return submit_to(_executor, fn, *args, **kwargs)
+
+
+def submit_to(executor, fn, *args, **kwargs):
+    """Like submit, but on `executor`"""
+    return executor.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+def result_or_default(future, timeout, default, label="task"):
+    """Wait up to `timeout` seconds for `future`; on timeout or error return `default`
+
+    A slow or failing side task never blocks or fails the response it feeds.
+    """
+    try:
+        return future.result(timeout=timeout)
+    except FutureTimeoutError:
+        print(f"{label} did not finish within {timeout}s, continuing without it")
+        future.cancel()
+    except Exception as task_error:
+        print(f"{label} failed: {str(task_error)}")
+    metrics.record_fallback(label.lower())
+    return default
@@ -0,0 +1,187 @@
+"""Post-processing for generated images: thumbnails and compressed renditions.
+
+generate_image with "postprocess" set fetches (url) or decodes (b64_json)
+every returned image concurrently on the shared fan-out pool, then resizes
+and re-encodes each one on a small pool of its own. Pillow releases the GIL
+while it resizes and encodes, so those threads use every core of the
+instance. The original and each rendition are stored as assets
+(grokads.assets) and each item of the response is reduced to references:
+
+    {"asset_id": ..., "url": ..., "width": ..., "height": ...,
+     "renditions": {"thumbnail": {"asset_id", "url", "mime_type",
+                                  "size_bytes", "width", "height", ...}, ...}}
+
+Renditions:
+    thumbnail  - WebP, longest side IMAGE_THUMBNAIL_SIZE, for image grids
+    webp       - full-size WebP
+    avif       - full-size AVIF (smaller than WebP but slower to encode)
+
+"postprocess" is either true (default renditions) or an object with any of
+"formats" (list of rendition names), "thumbnail_size" and "include_base64"
+(keep the upstream b64_json in the response; off by default).
+
+Pillow is imported on first use, so handlers that never post-process don't
+pay for it at cold start.
+
+Configuration (environment variables):
+    IMAGE_FORMATS          - default renditions, comma-separated (default "thumbnail,webp")
+    IMAGE_THUMBNAIL_SIZE   - thumbnail bounding box in pixels (default 256)
+    IMAGE_WEBP_QUALITY     - WebP quality, 1-100 (default 80)
+    IMAGE_AVIF_QUALITY     - AVIF quality, 1-100 (default 60)
+    IMAGE_WORKERS          - resize/encode threads (default: CPU count)
+"""
+import base64
+import binascii
+import io
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from grokads import assets, concurrency, metrics, storage, upstream
+
+FORMATS = ("thumbnail", "webp", "avif")
+DEFAULT_FORMATS = [name.strip() for name in os.getenv("IMAGE_FORMATS", "thumbnail,webp").split(",") if name.strip()]
+THUMBNAIL_SIZE = int(os.getenv("IMAGE_THUMBNAIL_SIZE", "256"))
+WEBP_QUALITY = int(os.getenv("IMAGE_WEBP_QUALITY", "80"))
+AVIF_QUALITY = int(os.getenv("IMAGE_AVIF_QUALITY", "60"))
+MAX_THUMBNAIL_SIZE = 2048
+
+# (Pillow format, MIME type, quality) per rendition
+_ENCODINGS = {
+    "thumbnail": ("WEBP", "image/webp", WEBP_QUALITY),
+    "webp": ("WEBP", "image/webp", WEBP_QUALITY),
+    "avif": ("AVIF", "image/avif", AVIF_QUALITY),
+}
+
+_executor = ThreadPoolExecutor(max_workers=int(os.getenv("IMAGE_WORKERS", "0")) or os.cpu_count() or 1,
+                               thread_name_prefix="images")
+
+
+def build_options(value):
+    """Post-processing options from the request's "postprocess" value, or None if off
+
+    Raises ValueError for invalid options (a 400).
+    """
+    if not value:
+        return None
+    if value is True:
+        value = {}
+    if not isinstance(value, dict):
+        raise ValueError("'postprocess' must be true or an object")
+
+    formats = value.get("formats", DEFAULT_FORMATS)
+    if not isinstance(formats, list) or not formats:
+        raise ValueError("'postprocess.formats' must be a non-empty list")
+    unknown = [name for name in formats if name not in FORMATS]
+    if unknown:
+        raise ValueError(f"Unknown image format(s): {', '.join(map(str, unknown))}. Use: {', '.join(FORMATS)}")
+
+    try:
+        thumbnail_size = int(value.get("thumbnail_size", THUMBNAIL_SIZE))
+    except (TypeError, ValueError):
+        raise ValueError("'postprocess.thumbnail_size' must be a number")
+    if not 16 <= thumbnail_size <= MAX_THUMBNAIL_SIZE:
+        raise ValueError(f"'postprocess.thumbnail_size' must be between 16 and {MAX_THUMBNAIL_SIZE}")
+
+    return {
+        "formats": list(dict.fromkeys(formats)),
+        "thumbnail_size": thumbnail_size,
+        "include_base64": bool(value.get("include_base64")),
+    }
+
+
+def _load(item):
+    """The bytes of one upstream image item (decoded or downloaded)"""
+    if item.get("b64_json"):
+        try:
+            return base64.b64decode(item["b64_json"])
+        except (TypeError, binascii.Error):
+            raise ValueError("Image is not valid base64")
+    if item.get("url"):
+        response = upstream.get(item["url"], timeout=30)
+        if response.status_code != 200:
+            raise ValueError(f"Failed to download image: {response.status_code}")
+        return response.content
+    raise ValueError("Image item has neither 'url' nor 'b64_json'")
+
+
+def _encode(image, name, thumbnail_size):
+    """Encode one rendition; returns (bytes, MIME type, width, height)"""
+    image_format, content_type, quality = _ENCODINGS[name]
+    if name == "thumbnail":
+        image = image.copy()
+        # reducing_gap: draft-style integer downscale first, then a cheap final resample
+        image.thumbnail((thumbnail_size, thumbnail_size), reducing_gap=2.0)
+    out = io.BytesIO()
+    image.save(out, image_format, quality=quality)
+    return out.getvalue(), content_type, image.width, image.height
+
+
+def _reference(asset, width, height):
+    info = storage.media_info(asset["storage_path"], asset["content_type"], asset["size_bytes"])
+    return {"asset_id": asset["asset_id"], **info, "width": width, "height": height}
+
+
+def refresh_urls(image):
+    """Mint fresh signed URLs for a stored image reference and its renditions (in place)"""
+    expires_at = int(time.time()) + storage.SIGNED_URL_TTL
+    for reference in [image, *image.get("renditions", {}).values()]:
+        if reference.get("storage_path"):
+            reference["url"] = storage.signed_url(reference["storage_path"])
+            reference["url_expires_at"] = expires_at
+    return image
+
+
+def process_item(item, options, prompt=None):
+    """Store one upstream image and its renditions; returns the compact response item"""
+    from PIL import Image
+
+    data = _load(item)
+    image = Image.open(io.BytesIO(data))
+    image.load()
+    # convert() returns an image without a format, so read it first
+    original_type = Image.MIME.get(image.format or "", "image/png")
+    if image.mode not in ("RGB", "RGBA"):
+        image = image.convert("RGBA" if "transparency" in image.info else "RGB")
+
+    original = assets.put_bytes(data, original_type, producer="generate_image", source_prompt=prompt,
+                                width=image.width, height=image.height)
+    del data
+
+    encoded = {
+        name: _executor.submit(_encode, image, name, options["thumbnail_size"])
+        for name in options["formats"]
+    }
+    renditions = {}
+    for name, future in encoded.items():
+        payload, content_type, width, height = future.result()
+        asset = assets.put_bytes(payload, content_type, producer="generate_image", source_prompt=prompt,
+                                 width=width, height=height, parent_asset_id=original["asset_id"])
+        renditions[name] = _reference(asset, width, height)
+
+    result = {key: value for key, value in item.items() if key not in ("url", "b64_json")}
+    if options["include_base64"] and item.get("b64_json"):
+        result["b64_json"] = item["b64_json"]
+    result.update(_reference(original, image.width, image.height))
+    if item.get("url"):
+        # Keep the upstream URL for clients that already use it
+        result["source_url"] = item["url"]
+    result["renditions"] = renditions
+    return result
+
+
+def process_images(items, options, prompt=None):
+    """Post-process every upstream image item concurrently, keeping order
+
+    An image that fails is returned as it came, with a "postprocess_error".
+    """
+    futures = [concurrency.submit(process_item, item, options, prompt) for item in items]
+    processed = []
+    for item, future in zip(items, futures):
+        try:
+            processed.append(future.result())
+        except Exception as e:
+            print(f"Image post-processing failed: {e}")
+            metrics.record_fallback("image_postprocess")
+            processed.append({**item, "postprocess_error": str(e)})
+    return processed
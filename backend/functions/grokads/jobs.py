@@ -0,0 +1,179 @@
+"""Firestore-backed state for long-running video generation jobs.
+
+A job is one document in the `video_jobs` collection:
+
+    status      queued -> in_progress -> completed | failed
+    lease_until while in_progress, when the worker's claim expires
+    progress    0-100, as reported by the video model
+    params      the submitted request (prompt, ...)
+    result      output metadata once completed
+    error       error message once failed
+    webhook_url optional URL that is POSTed the job when it finishes
+
+Clients submit a job, get its id back immediately, and then long-poll the
+status endpoint instead of holding one connection open for the whole render.
+
+A claim expires after LEASE_SEC (longer than the worker's timeout): a
+redelivered trigger may then claim the job again, and a job whose worker
+was killed is reported as failed instead of staying in_progress forever.
+
+Configuration (environment variables):
+    VIDEO_JOB_WEBHOOK_SECRET - if set, webhook bodies are signed with
+                               HMAC-SHA256 in the X-GrokAds-Signature header
+"""
+import hashlib
+import hmac
+import json
+import os
+import time
+import uuid
+
+from grokads import upstream
+from grokads.admin import get_firestore
+
+COLLECTION = "video_jobs"
+TERMINAL_STATUSES = ("completed", "failed")
+MAX_WAIT_SEC = 50
+POLL_INTERVAL_SEC = 1.0
+# The video worker's timeout is 540 s
+LEASE_SEC = 600
+
+
+def _doc(job_id):
+    return get_firestore().collection(COLLECTION).document(job_id)
+
+
+def webhook_url_error(url):
+    """Why `url` can't be used as a webhook, or None if it can"""
+    return upstream.public_url_error(url)
+
+
+def create_job(kind, params, webhook_url=None):
+    """Create a queued job and return its id"""
+    job_id = uuid.uuid4().hex
+    now = time.time()
+    _doc(job_id).set({
+        "kind": kind,
+        "status": "queued",
+        "progress": 0,
+        "params": params,
+        "result": None,
+        "error": None,
+        "webhook_url": webhook_url,
+        "created_at": now,
+        "updated_at": now,
+    })
+    return job_id
+
+
+def get_job(job_id):
+    snapshot = _doc(job_id).get()
+    if not snapshot.exists:
+        return None
+    return {"id": job_id, **snapshot.to_dict()}
+
+
+def update_job(job_id, **fields):
+    fields["updated_at"] = time.time()
+    _doc(job_id).update(fields)
+
+
+def lease_expired(job, now=None):
+    return job.get("status") == "in_progress" and job.get("lease_until", 0) < (now or time.time())
+
+
+def claim_job(job_id):
+    """Move a queued job (or one whose claim expired) to in_progress; returns
+    the job, or None if it is claimed or finished.
+
+    Firestore triggers are delivered at least once, so the worker claims the
+    job in a transaction before starting any (expensive) generation.
+    """
+    from google.cloud import firestore
+
+    db = get_firestore()
+    doc_ref = _doc(job_id)
+
+    @firestore.transactional
+    def claim(transaction):
+        snapshot = doc_ref.get(transaction=transaction)
+        if not snapshot.exists:
+            return None
+        job = snapshot.to_dict()
+        now = time.time()
+        if job.get("status") != "queued" and not lease_expired(job, now):
+            return None
+        fields = {
+            "status": "in_progress",
+            "lease_until": now + LEASE_SEC,
+            "attempts": job.get("attempts", 0) + 1,
+            "updated_at": now,
+        }
+        transaction.update(doc_ref, fields)
+        return {"id": job_id, **job, **fields}
+
+    return claim(db.transaction())
+
+
+def complete_job(job_id, result):
+    update_job(job_id, status="completed", progress=100, result=result)
+
+
+def fail_job(job_id, error):
+    update_job(job_id, status="failed", error=error)
+
+
+def wait_for_job(job_id, since=None, timeout=25):
+    """Long-poll a job.
+
+    Returns as soon as the job has changed after `since` (an `updated_at`
+    value from a previous response) or is finished, or when `timeout`
+    seconds have passed. Returns None if the job does not exist.
+    """
+    deadline = time.time() + min(max(0, timeout), MAX_WAIT_SEC)
+    while True:
+        job = get_job(job_id)
+        if job is None:
+            return None
+        if lease_expired(job):
+            fail_job(job_id, "Video job worker stopped before finishing")
+            job = get_job(job_id)
+        if since is None or job["updated_at"] > since or job["status"] in TERMINAL_STATUSES:
+            return job
+        if time.time() >= deadline:
+            return job
+        time.sleep(POLL_INTERVAL_SEC)
+
+
+def public_view(job):
+    """The job fields that are returned to clients"""
+    return {
+        "job_id": job["id"],
+        "kind": job.get("kind"),
+        "status": job.get("status"),
+        "progress": job.get("progress", 0),
+        "result": job.get("result"),
+        "error": job.get("error"),
+        "created_at": job.get("created_at"),
+        "updated_at": job.get("updated_at"),
+    }
+
+
+def notify_webhook(job):
+    """POST the finished job to its webhook_url (best effort)"""
+    url = job.get("webhook_url")
+    if not url:
+        return
+    body = json.dumps(public_view(job)).encode("utf-8")
+    headers = {"Content-Type": "application/json"}
+    secret = os.getenv("VIDEO_JOB_WEBHOOK_SECRET")
+    if secret:
+        signature = hmac.new(secret.encode("utf-8"), body, hashlib.sha256).hexdigest()
+        headers["X-GrokAds-Signature"] = f"sha256={signature}"
+    try:
+        # A one-off request: webhook hosts are client-supplied, so they are
+        # re-checked (DNS may have changed) and never get a pooled session
+        response = upstream.request_public("POST", url, data=body, headers=headers, timeout=10)
+        print(f"Webhook for job {job['id']} returned {response.status_code}")
+    except Exception as webhook_error:
+        print(f"Webhook for job {job['id']} failed: {str(webhook_error)}")
@@ -0,0 +1,89 @@
+"""Incremental extraction of objects from a streamed JSON array.
+
+Model output arrives a few characters at a time. `ArrayItemParser` watches
+the stream for the target array (a top-level array, or the array under a
+given key of the top-level object) and returns each element object as soon
+as its closing brace arrives, without waiting for the rest of the document.
+"""
+import json
+
+
+class ArrayItemParser:
+    """Feed text chunks, get back the objects completed by each chunk"""
+
+    def __init__(self, key="variants"):
+        self.key = key
+        self._stack = []
+        self._in_string = False
+        self._escape = False
+        self._reading_key = False
+        self._key_chars = []
+        self._last_key = None
+        self._target_depth = None
+        self._finished = False
+        self._capture = None
+
+    @property
+    def finished(self):
+        """True once the target array has been closed"""
+        return self._finished
+
+    def feed(self, text):
+        items = []
+        for char in text:
+            if self._finished:
+                break
+            if self._capture is not None:
+                self._capture.append(char)
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                    if self._reading_key:
+                        self._reading_key = False
+                        self._last_key = "".join(self._key_chars)
+                elif self._reading_key:
+                    self._key_chars.append(char)
+                continue
+
+            if char == '"':
+                self._in_string = True
+                # Strings directly inside the top-level object may be keys
+                if self._stack == ["{"] and self._capture is None:
+                    self._reading_key = True
+                    self._key_chars = []
+            elif char == "[":
+                at_target = self._target_depth is None and (
+                    not self._stack or (self._stack == ["{"] and self._last_key == self.key)
+                )
+                self._stack.append(char)
+                if at_target:
+                    self._target_depth = len(self._stack)
+            elif char == "{":
+                if self._target_depth is not None and len(self._stack) == self._target_depth and self._capture is None:
+                    self._capture = ["{"]
+                self._stack.append(char)
+            elif char in "}]":
+                if self._stack:
+                    self._stack.pop()
+                if self._target_depth is not None:
+                    if char == "}" and self._capture is not None and len(self._stack) == self._target_depth:
+                        item = self._parse("".join(self._capture))
+                        self._capture = None
+                        if item is not None:
+                            items.append(item)
+                    elif len(self._stack) < self._target_depth:
+                        self._finished = True
+        return items
+
+    @staticmethod
+    def _parse(text):
+        try:
+            item = json.loads(text)
+        except ValueError:
+            return None
+        return item if isinstance(item, dict) else None
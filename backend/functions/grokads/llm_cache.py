@@ -0,0 +1,188 @@
+"""Content-addressed cache for Grok chat completions.
+
+Many calls repeat exactly: the same trend's prompts, the same ad re-scored,
+the same media suggestions retried. A successful completion is stored under
+a hash of everything that determines it (model, messages, temperature,
+max_tokens, response_format), so a repeat is answered in milliseconds
+instead of a full LLM round trip.
+
+Callers opt in per endpoint with `upstream.grok_chat(..., cache="<policy>")`;
+each policy has its own TTL, and a TTL of 0 disables it. `bypass=True`
+skips the lookup but still stores the fresh answer (e.g. for a client that
+sent `Cache-Control: no-cache`).
+
+Backends are tried in order, and a hit in a later one is copied into the
+earlier ones:
+    memory    - LRU per instance, bounded by total bytes
+    firestore - the `grok_cache` collection, shared by all instances. Each
+                entry carries an `expire_at` timestamp, and the TTL policy
+                on that field (firestore.indexes.json) has Firestore delete
+                expired entries; until it does, reads skip them.
+
+Configuration (environment variables):
+    GROK_CACHE_BACKENDS    - comma-separated backends (default "memory", "" disables)
+    GROK_CACHE_MAX_BYTES   - size of the memory backend (default 32 MiB)
+    GROK_CACHE_TTL_<NAME>  - TTL override for a policy, e.g. GROK_CACHE_TTL_PREDICT_PERFORMANCE
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from datetime import datetime, timezone
+
+from grokads.admin import get_firestore
+from grokads.cache import LRUCache
+
+COLLECTION = "grok_cache"
+
+# policy name -> default TTL in seconds
+POLICIES = {
+    "trend_suggestions": 3600,
+    "predict_performance": 86400,
+    "media_suggestions": 3600,
+}
+
+MAX_BYTES = int(os.getenv("GROK_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+BACKEND_NAMES = [b.strip() for b in os.getenv("GROK_CACHE_BACKENDS", "memory").split(",") if b.strip()]
+
+
+def policy_ttl(name):
+    """TTL for a policy in seconds (0 when unknown or disabled)"""
+    override = os.getenv(f"GROK_CACHE_TTL_{name.upper()}")
+    if override is not None:
+        return int(override)
+    return POLICIES.get(name, 0)
+
+
+def cache_key(payload):
+    """Canonical hash of the fields that determine a completion"""
+    material = {field: payload.get(field) for field in ("model", "messages", "temperature", "max_tokens", "response_format")}
+    canonical = json.dumps(material, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class MemoryBackend:
+    name = "memory"
+
+    def __init__(self, max_bytes):
+        self._lru = LRUCache(100000, max_bytes=max_bytes, sizeof=lambda entry: len(entry["body"]))
+
+    def get(self, key):
+        return self._lru.get(key)
+
+    def set(self, key, entry):
+        self._lru.set(key, entry)
+
+
+class FirestoreBackend:
+    name = "firestore"
+
+    def get(self, key):
+        snapshot = get_firestore().collection(COLLECTION).document(key).get()
+        return snapshot.to_dict() if snapshot.exists else None
+
+    def set(self, key, entry):
+        # A timestamp field, for the collection's TTL policy
+        expire_at = datetime.fromtimestamp(entry["expires_at"], timezone.utc)
+        get_firestore().collection(COLLECTION).document(key).set({**entry, "expire_at": expire_at})
+
+
+_BACKEND_TYPES = {
+    "memory": lambda: MemoryBackend(MAX_BYTES),
+    "firestore": FirestoreBackend,
+}
+
+_backends = None
+_backends_lock = threading.Lock()
+
+
+def get_backends():
+    global _backends
+    if _backends is None:
+        with _backends_lock:
+            if _backends is None:
+                _backends = [_BACKEND_TYPES[name]() for name in BACKEND_NAMES if name in _BACKEND_TYPES]
+    return _backends
+
+
+class CachedResponse:
+    """Stands in for a requests.Response on a cache hit"""
+
+    status_code = 200
+
+    def __init__(self, body):
+        self.text = body
+        self.headers = {"Content-Type": "application/json", "X-Grok-Cache": "hit"}
+
+    def json(self):
+        return json.loads(self.text)
+
+
+_stats = {}
+_stats_lock = threading.Lock()
+
+
+def _count(policy, counter):
+    with _stats_lock:
+        counters = _stats.setdefault(policy, {"hits": 0, "misses": 0, "bypassed": 0, "stores": 0, "errors": 0})
+        counters[counter] += 1
+
+
+def stats():
+    """Hit/miss counters per policy since the instance started"""
+    with _stats_lock:
+        return {policy: dict(counters) for policy, counters in _stats.items()}
+
+
+def lookup(policy, payload, bypass=False):
+    """Return a CachedResponse for `payload`, or None on a miss"""
+    if policy_ttl(policy) <= 0 or not get_backends():
+        return None
+    if bypass:
+        _count(policy, "bypassed")
+        return None
+
+    key = cache_key(payload)
+    now = time.time()
+    for index, backend in enumerate(get_backends()):
+        try:
+            entry = backend.get(key)
+        except Exception as cache_error:
+            print(f"Grok cache {backend.name} read failed: {str(cache_error)}")
+            _count(policy, "errors")
+            continue
+        if entry and entry["expires_at"] > now:
+            # Copy the hit into the faster tiers; best effort, the hit is served regardless
+            for earlier in get_backends()[:index]:
+                try:
+                    earlier.set(key, entry)
+                except Exception as cache_error:
+                    print(f"Grok cache {earlier.name} write failed: {str(cache_error)}")
+                    _count(policy, "errors")
+            _count(policy, "hits")
+            return CachedResponse(entry["body"])
+
+    _count(policy, "misses")
+    return None
+
+
+def store(policy, payload, response):
+    """Remember a successful completion for `payload`"""
+    ttl = policy_ttl(policy)
+    if ttl <= 0 or response.status_code != 200:
+        return
+    entry = {"body": response.text, "policy": policy, "expires_at": time.time() + ttl}
+    key = cache_key(payload)
+    for backend in get_backends():
+        try:
+            backend.set(key, entry)
+        except Exception as cache_error:
+            print(f"Grok cache {backend.name} write failed: {str(cache_error)}")
+            _count(policy, "errors")
+    _count(policy, "stores")
+
+
+def bypass_requested(req):
+    """True if the client asked for a fresh answer (Cache-Control: no-cache)"""
+    return "no-cache" in req.headers.get("Cache-Control", "").lower()
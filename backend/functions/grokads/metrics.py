@@ -0,0 +1,395 @@
+"""Request metrics: latency histograms, upstream timings, token usage and fallbacks.
+
+Handlers are wrapped with `instrument`, which times each invocation, records
+it in a per-endpoint latency histogram and writes one structured (JSON) log
+line with the upstream time, tokens and fallbacks spent on that request.
+Cloud Logging turns JSON lines into structured entries, so they can be
+filtered and turned into log-based metrics without parsing text.
+
+Upstream calls report through `observe_upstream` (grokads.upstream does this
+for every call), Grok responses through `record_usage`, and degraded code
+paths through `record_fallback`. The per-request totals live in a context
+variable; grokads.concurrency runs pool tasks in a copy of the caller's
+context, so fanned-out calls count toward the request that started them.
+
+Metrics are kept per instance. Every deployed function runs on its own
+instances, so each instance also flushes its snapshot to
+`metrics/<instance>` at most every METRICS_FLUSH_SEC (and on every
+get_metrics), and get_metrics sums the snapshots into one Prometheus text
+exposition. A snapshot not updated for METRICS_RETENTION_SEC belongs to an
+instance that is gone: it is folded into `metrics/_retired` and deleted, so
+the collection stays small and exported counters never go down.
+get_metrics is off unless METRICS_TOKEN is set.
+
+For streamed responses (NDJSON/SSE, media) the body is produced after the
+handler returns, so their latency runs until the stream is exhausted.
+
+Configuration (environment variables):
+    METRICS_LOG            - "0" to turn off the per-request log line
+    METRICS_FLUSH_SEC      - min seconds between snapshot flushes (default 60, 0 = never)
+    METRICS_RETENTION_SEC  - idle time after which an instance's snapshot is folded into the retired totals (default 86400)
+    METRICS_TOKEN          - bearer token for get_metrics ("Authorization: Bearer <token>"); unset = endpoint off
+"""
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+import uuid
+
+from grokads.admin import get_firestore
+
+COLLECTION = "metrics"
+# Document with the summed snapshots of instances that are gone
+RETIRED_ID = "_retired"
+
+LOG_REQUESTS = os.getenv("METRICS_LOG", "1").lower() not in ("0", "false", "no")
+FLUSH_SEC = float(os.getenv("METRICS_FLUSH_SEC", "60"))
+RETENTION_SEC = float(os.getenv("METRICS_RETENTION_SEC", "86400"))
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+
+INSTANCE_ID = f"{os.getenv('K_SERVICE', 'local')}-{uuid.uuid4().hex[:12]}"
+
+# Seconds; wide enough for a 300 s campaign build and a 10 ms cache hit
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+HELP = {
+    "grokads_requests_total": ("counter", "Handler invocations by endpoint and status"),
+    "grokads_request_duration_seconds": ("histogram", "Handler latency by endpoint"),
+    "grokads_upstream_requests_total": ("counter", "Upstream HTTP calls by host and status"),
+    "grokads_upstream_duration_seconds": ("histogram", "Upstream call latency by host"),
+    "grokads_upstream_retries_total": ("counter", "Upstream calls retried by the rate limiter"),
+    "grokads_tokens_total": ("counter", "Grok tokens used, by endpoint, model and kind (prompt/completion)"),
+    "grokads_fallbacks_total": ("counter", "Requests served through a fallback path, by kind"),
+    "grokads_llm_cache_total": ("counter", "Completion cache lookups and writes, by policy and result"),
+    "grokads_singleflight_total": ("counter", "Coalesced upstream calls, by role"),
+}
+
+_counters = {}
+_histograms = {}
+_lock = threading.Lock()
+_last_flush = {"at": time.time()}
+
+_current = contextvars.ContextVar("grokads_request_metrics", default=None)
+
+
+class _RequestTotals:
+    """What one request spent upstream (updated from pool threads too)"""
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.upstream_sec = {}
+        self.upstream_calls = 0
+        self.tokens = {"prompt": 0, "completion": 0}
+        self.fallbacks = []
+        self.lock = threading.Lock()
+
+
+def _key(name, labels):
+    return name, tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def inc(name, amount=1, **labels):
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + amount
+
+
+def observe(name, value, **labels):
+    """Add `value` (seconds) to a histogram"""
+    key = _key(name, labels)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = {"buckets": [0] * len(LATENCY_BUCKETS), "sum": 0.0, "count": 0}
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if value <= bound:
+                histogram["buckets"][i] += 1
+                break
+        histogram["sum"] += value
+        histogram["count"] += 1
+
+
+def current_endpoint():
+    totals = _current.get()
+    return totals.endpoint if totals else "background"
+
+
+def observe_upstream(host, status, seconds):
+    """Record one upstream call (status is the HTTP status, "error", or a job's final state)"""
+    inc("grokads_upstream_requests_total", host=host, status=status)
+    observe("grokads_upstream_duration_seconds", seconds, host=host)
+    totals = _current.get()
+    if totals is not None:
+        with totals.lock:
+            totals.upstream_sec[host] = totals.upstream_sec.get(host, 0.0) + seconds
+            totals.upstream_calls += 1
+
+
+def record_usage(usage, model):
+    """Record the `usage` block of a Grok response"""
+    if not isinstance(usage, dict):
+        return
+    endpoint = current_endpoint()
+    totals = _current.get()
+    for kind in ("prompt", "completion"):
+        count = usage.get(f"{kind}_tokens")
+        if not isinstance(count, int):
+            continue
+        inc("grokads_tokens_total", count, endpoint=endpoint, model=model, kind=kind)
+        if totals is not None:
+            with totals.lock:
+                totals.tokens[kind] += count
+
+
+def record_fallback(kind):
+    """Count a request that was served through a fallback path"""
+    inc("grokads_fallbacks_total", kind=kind, endpoint=current_endpoint())
+    totals = _current.get()
+    if totals is not None:
+        with totals.lock:
+            totals.fallbacks.append(kind)
+
+
+def _status_of(result):
+    status_code = getattr(result, "status_code", None)
+    return str(status_code) if status_code is not None else "ok"
+
+
+def _log_request(totals, status, seconds):
+    print(json.dumps({
+        "severity": "ERROR" if status == "error" or status.startswith("5") else "INFO",
+        "message": f"{totals.endpoint} {status} in {seconds * 1000:.0f} ms",
+        "metric": "request",
+        "endpoint": totals.endpoint,
+        "status": status,
+        "latency_ms": round(seconds * 1000, 1),
+        "upstream_ms": {host: round(spent * 1000, 1) for host, spent in totals.upstream_sec.items()},
+        "upstream_calls": totals.upstream_calls,
+        "tokens": totals.tokens,
+        "fallbacks": totals.fallbacks,
+        "instance": INSTANCE_ID,
+    }))
+
+
+def _exhaust_then(iterable, context, finish):
+    """Yield from a response body in `context`, calling `finish()` once it is done"""
+    iterator = iter(iterable)
+    try:
+        while True:
+            try:
+                item = context.run(next, iterator)
+            except StopIteration:
+                return
+            yield item
+    finally:
+        close = getattr(iterator, "close", None)
+        if close:
+            close()
+        finish()
+
+
+def instrument(handler):
+    """Decorator: time a handler and record its metrics (put it under the trigger decorator)"""
+    endpoint = handler.__name__
+
+    @functools.wraps(handler)
+    def wrapper(*args, **kwargs):
+        totals = _RequestTotals(endpoint)
+        context = contextvars.copy_context()
+        context.run(_current.set, totals)
+        started = time.perf_counter()
+
+        def finish(status):
+            seconds = time.perf_counter() - started
+            inc("grokads_requests_total", endpoint=endpoint, status=status)
+            observe("grokads_request_duration_seconds", seconds, endpoint=endpoint)
+            if LOG_REQUESTS:
+                _log_request(totals, status, seconds)
+            _maybe_flush()
+
+        try:
+            result = context.run(handler, *args, **kwargs)
+        except BaseException:
+            finish("error")
+            raise
+        status = _status_of(result)
+        if getattr(result, "is_streamed", False):
+            # The body runs in the request's context too, so its upstream calls count
+            result.response = _exhaust_then(result.response, context, lambda: finish(status))
+        else:
+            finish(status)
+        return result
+
+    return wrapper
+
+
+def snapshot():
+    """This instance's metrics: {"counters": [[name, labels, value]], "histograms": [[name, labels, buckets, sum, count]]}"""
+    from grokads import llm_cache, singleflight
+
+    with _lock:
+        counters = [[name, dict(labels), value] for (name, labels), value in _counters.items()]
+        histograms = [
+            [name, dict(labels), list(histogram["buckets"]), histogram["sum"], histogram["count"]]
+            for (name, labels), histogram in _histograms.items()
+        ]
+    # Cache and coalescing counters are kept by their own modules
+    for policy, results in llm_cache.stats().items():
+        counters.extend(["grokads_llm_cache_total", {"policy": policy, "result": result}, value]
+                        for result, value in results.items())
+    counters.extend(["grokads_singleflight_total", {"role": role}, value]
+                    for role, value in singleflight.stats().items())
+    return {"counters": counters, "histograms": histograms}
+
+
+def flush():
+    """Write this instance's snapshot to Firestore"""
+    get_firestore().collection(COLLECTION).document(INSTANCE_ID).set({
+        # Firestore has no nested arrays, so the snapshot is stored as JSON
+        "snapshot": json.dumps(snapshot()),
+        "updated_at": time.time(),
+    })
+
+
+def _maybe_flush():
+    if FLUSH_SEC <= 0:
+        return
+    now = time.time()
+    with _lock:
+        if now - _last_flush["at"] < FLUSH_SEC:
+            return
+        _last_flush["at"] = now
+
+    from grokads import concurrency
+
+    def run():
+        try:
+            flush()
+        except Exception as flush_error:
+            print(f"Metrics flush failed: {str(flush_error)}")
+
+    concurrency.submit(run)
+
+
+def _retire(stale_ids):
+    """Fold the snapshots of instances that are gone into RETIRED_ID and delete them"""
+    from google.cloud import firestore
+
+    db = get_firestore()
+    collection = db.collection(COLLECTION)
+    retired_ref = collection.document(RETIRED_ID)
+    stale_refs = [collection.document(stale_id) for stale_id in stale_ids]
+
+    @firestore.transactional
+    def retire_in_transaction(transaction):
+        retired = retired_ref.get(transaction=transaction)
+        snapshots = [json.loads(retired.to_dict()["snapshot"])] if retired.exists else []
+        # Read again inside the transaction, so a concurrent collect can't fold one twice
+        stale = [ref for ref in stale_refs if ref.get(transaction=transaction).exists]
+        if not stale:
+            return
+        snapshots.extend(json.loads(ref.get(transaction=transaction).to_dict()["snapshot"]) for ref in stale)
+        transaction.set(retired_ref, {"snapshot": json.dumps(_as_snapshot(*_merge(snapshots))),
+                                      "retired_at": time.time()})
+        for ref in stale:
+            transaction.delete(ref)
+
+    retire_in_transaction(db.transaction())
+
+
+def collect():
+    """Snapshots of every instance, this one live, plus the retired totals"""
+    snapshots = [snapshot()]
+    if FLUSH_SEC <= 0:
+        return snapshots
+    # The stored snapshot must not lag what this scrape reports, or the next
+    # scrape served by another instance would see counters go down
+    flush()
+
+    collection = get_firestore().collection(COLLECTION)
+    cutoff = time.time() - RETENTION_SEC
+    stale = {}
+    for doc in collection.stream():
+        data = doc.to_dict()
+        if doc.id in (INSTANCE_ID, RETIRED_ID):
+            continue
+        if data.get("updated_at", 0) < cutoff:
+            stale[doc.id] = json.loads(data["snapshot"])
+        else:
+            snapshots.append(json.loads(data["snapshot"]))
+    if stale:
+        try:
+            _retire(list(stale))
+        except Exception as retire_error:
+            # Still counted, from their own documents; retired on a later scrape
+            print(f"Retiring metrics snapshots failed: {str(retire_error)}")
+            snapshots.extend(stale.values())
+    retired = collection.document(RETIRED_ID).get()
+    if retired.exists:
+        snapshots.append(json.loads(retired.to_dict()["snapshot"]))
+    return snapshots
+
+
+def _merge(snapshots):
+    counters = {}
+    histograms = {}
+    for snap in snapshots:
+        for name, labels, value in snap["counters"]:
+            key = _key(name, labels)
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, buckets, total, count in snap["histograms"]:
+            key = _key(name, labels)
+            merged = histograms.setdefault(key, {"buckets": [0] * len(LATENCY_BUCKETS), "sum": 0.0, "count": 0})
+            merged["buckets"] = [a + b for a, b in zip(merged["buckets"], buckets)]
+            merged["sum"] += total
+            merged["count"] += count
+    return counters, histograms
+
+
+def _as_snapshot(counters, histograms):
+    """Merged counters and histograms back in the snapshot() format"""
+    return {
+        "counters": [[name, dict(labels), value] for (name, labels), value in counters.items()],
+        "histograms": [
+            [name, dict(labels), histogram["buckets"], histogram["sum"], histogram["count"]]
+            for (name, labels), histogram in histograms.items()
+        ],
+    }
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels_text(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in pairs) + "}"
+
+
+def render_prometheus(snapshots):
+    """Prometheus text exposition (format 0.0.4) of the summed snapshots"""
+    counters, histograms = _merge(snapshots)
+    lines = []
+    names = sorted({name for name, _ in counters} | {name for name, _ in histograms})
+    for name in names:
+        kind, description = HELP.get(name, ("untyped", name))
+        lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} {kind}")
+        for (metric, labels), value in sorted(counters.items()):
+            if metric == name:
+                lines.append(f"{name}{_labels_text(labels)} {value}")
+        for (metric, labels), histogram in sorted(histograms.items()):
+            if metric != name:
+                continue
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS, histogram["buckets"]):
+                cumulative += count
+                lines.append(f"{name}_bucket{_labels_text(labels, [('le', bound)])} {cumulative}")
+            lines.append(f"{name}_bucket{_labels_text(labels, [('le', '+Inf')])} {histogram['count']}")
+            lines.append(f"{name}_sum{_labels_text(labels)} {histogram['sum']:.6f}")
+            lines.append(f"{name}_count{_labels_text(labels)} {histogram['count']}")
+    return "\n".join(lines) + "\n"
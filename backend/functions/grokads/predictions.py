@@ -0,0 +1,212 @@
+"""Ad performance predictions, one at a time or in batches.
+
+Scoring a campaign one ad per request costs one Grok completion and one
+browser round trip per ad. In batch mode several ads are packed into each
+prompt (with a strict per-ad schema keyed by `ad_index`), the packs run
+concurrently, and the results come back in input order; any ad the model
+skipped or answered malformed gets the fallback prediction.
+
+Configuration (environment variables):
+    PREDICT_PACK_SIZE          - ads per Grok completion (default 5, capped by grokads.token_budget)
+    PREDICT_BATCH_CONCURRENCY  - concurrent completions per batch (default 8)
+    PREDICT_BATCH_MAX          - max ads per batch request (default 100)
+"""
+import json
+import os
+import threading
+import time
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+from grokads import concurrency, metrics, token_budget, upstream
+
+PACK_SIZE = int(os.getenv("PREDICT_PACK_SIZE", "5"))
+BATCH_CONCURRENCY = int(os.getenv("PREDICT_BATCH_CONCURRENCY", "8"))
+BATCH_MAX = int(os.getenv("PREDICT_BATCH_MAX", "100"))
+# Packs still unanswered after this get the fallback (predict_performance times out at 180 s)
+BATCH_TIMEOUT_SEC = 150
+
+NUMERIC_FIELDS = ("ctr", "conversion_rate", "cpc", "cpa", "engagement_score", "confidence")
+LIST_FIELDS = ("risk_factors", "recommendations")
+
+
+def fallback_prediction():
+    return {
+        "ctr": 2.0,
+        "conversion_rate": 2.5,
+        "cpc": 0.50,
+        "cpa": 20.00,
+        "engagement_score": 65,
+        "risk_factors": ["Limited data available"],
+        "recommendations": ["A/B test multiple variants", "Optimize targeting"],
+        "confidence": 60
+    }
+
+
+def build_prompt(ad, target_audience, channel, budget):
+    return f"""As an expert ad performance analyst, predict the performance of this ad:
+
+Ad Content:
+{json.dumps(ad, indent=2)}
+
+Target Audience: {target_audience}
+Channel: {channel}
+Budget: ${budget}
+
+Analyze and predict:
+1. Expected CTR (Click-Through Rate) as percentage
+2. Expected conversion rate as percentage
+3. Estimated CPC (Cost Per Click)
+4. Estimated CPA (Cost Per Acquisition)
+5. Predicted engagement score (0-100)
+6. Risk factors
+7. Optimization recommendations
+
+Format as JSON:
+{{
+  "ctr": 2.5,
+  "conversion_rate": 3.2,
+  "cpc": 0.45,
+  "cpa": 14.50,
+  "engagement_score": 75,
+  "risk_factors": ["factor1", "factor2"],
+  "recommendations": ["rec1", "rec2"],
+  "confidence": 85
+}}"""
+
+
+def build_batch_prompt(ads, target_audience, channel, budget):
+    """One prompt for a pack of ads; `ads` is a list of (ad_index, ad)"""
+    ads_text = "\n\n".join(f"Ad {index}:\n{json.dumps(ad, indent=2)}" for index, ad in ads)
+    return f"""As an expert ad performance analyst, predict the performance of each of these {len(ads)} ads independently:
+
+{ads_text}
+
+Target Audience: {target_audience}
+Channel: {channel}
+Budget: ${budget} per ad
+
+For every ad, predict:
+1. Expected CTR (Click-Through Rate) as percentage
+2. Expected conversion rate as percentage
+3. Estimated CPC (Cost Per Click)
+4. Estimated CPA (Cost Per Acquisition)
+5. Predicted engagement score (0-100)
+6. Risk factors
+7. Optimization recommendations
+
+Return exactly one entry per ad, with "ad_index" set to the number after "Ad".
+Every field is required; numbers must be plain JSON numbers.
+
+Format as JSON:
+{{
+  "predictions": [
+    {{
+      "ad_index": {ads[0][0]},
+      "ctr": 2.5,
+      "conversion_rate": 3.2,
+      "cpc": 0.45,
+      "cpa": 14.50,
+      "engagement_score": 75,
+      "risk_factors": ["factor1", "factor2"],
+      "recommendations": ["rec1", "rec2"],
+      "confidence": 85
+    }}
+  ]
+}}"""
+
+
+def validate_prediction(prediction):
+    """The prediction with only schema fields, or None if it doesn't match the schema"""
+    if not isinstance(prediction, dict):
+        return None
+    cleaned = {}
+    for field in NUMERIC_FIELDS:
+        value = prediction.get(field)
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            return None
+        cleaned[field] = value
+    for field in LIST_FIELDS:
+        value = prediction.get(field)
+        if not isinstance(value, list):
+            return None
+        cleaned[field] = [str(item) for item in value]
+    return cleaned
+
+
+def _predict_pack(pack, target_audience, channel, budget, api_key, bypass_cache):
+    """Score one pack; returns ({ad_index: prediction}, error)"""
+    response = upstream.grok_chat(
+        build_batch_prompt(pack, target_audience, channel, budget),
+        temperature=0.3,
+        max_tokens=token_budget.plan("predictions", len(pack)),
+        timeout=90,
+        api_key=api_key,
+        cache="predict_performance",
+        bypass_cache=bypass_cache
+    )
+    token_budget.observe("predictions", response, len(pack))
+    if response.status_code != 200:
+        return {}, f"Prediction failed: {str(response.text)}"
+
+    try:
+        entries = json.loads(upstream.chat_content(response)).get("predictions", [])
+    except (ValueError, AttributeError):
+        return {}, "Unparseable predictions JSON"
+
+    expected = {index for index, _ in pack}
+    results = {}
+    for entry in entries if isinstance(entries, list) else []:
+        index = entry.get("ad_index") if isinstance(entry, dict) else None
+        prediction = validate_prediction(entry)
+        if index in expected and index not in results and prediction is not None:
+            results[index] = prediction
+    return results, None if len(results) == len(expected) else "Missing or malformed predictions"
+
+
+def predict_batch(ads, target_audience, channel, budget, api_key=None, bypass_cache=False, pack_size=None,
+                  timeout=BATCH_TIMEOUT_SEC):
+    """Score `ads` in concurrent packs.
+
+    At most BATCH_CONCURRENCY packs are in flight: a slot is taken before a
+    pack is submitted and released when it finishes, so waiting packs don't
+    hold threads of the shared pool. Packs not answered within `timeout`
+    seconds get the fallback.
+
+    Returns one {"index", "prediction", "fallback"} per ad, in input order
+    (plus "error" when the fallback was used).
+    """
+    # Packs shrink if the budget planner says a full one wouldn't fit in one completion
+    pack_size = max(1, min(pack_size or PACK_SIZE, token_budget.max_items("predictions")))
+    indexed = list(enumerate(ads))
+    packs = [indexed[i:i + pack_size] for i in range(0, len(indexed), pack_size)]
+    limit = threading.BoundedSemaphore(max(1, BATCH_CONCURRENCY))
+    deadline = time.time() + timeout
+
+    futures = []
+    for pack in packs:
+        if not limit.acquire(timeout=max(0, deadline - time.time())):
+            futures.append(None)
+            continue
+        future = concurrency.submit(_predict_pack, pack, target_audience, channel, budget, api_key, bypass_cache)
+        future.add_done_callback(lambda _: limit.release())
+        futures.append(future)
+
+    results = []
+    for pack, future in zip(packs, futures):
+        try:
+            if future is None:
+                raise FutureTimeoutError()
+            predictions, error = future.result(timeout=max(0, deadline - time.time()))
+        except FutureTimeoutError:
+            predictions, error = {}, f"No answer within {timeout:g}s"
+        except Exception as pack_error:
+            predictions, error = {}, str(pack_error)
+        if error:
+            print(f"Prediction pack {pack[0][0]}-{pack[-1][0]}: {error}")
+        for index, _ in pack:
+            if index in predictions:
+                results.append({"index": index, "prediction": predictions[index], "fallback": False})
+            else:
+                metrics.record_fallback("prediction")
+                results.append({"index": index, "prediction": fallback_prediction(), "fallback": True, "error": error})
+    return results
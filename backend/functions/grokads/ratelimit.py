@@ -0,0 +1,391 @@
+"""Shared rate limiting, adaptive concurrency and retries for the xAI API.
+
+Every instance (up to max_instances) calls xAI independently, so without
+coordination a burst of traffic turns into a burst of 429s, and naive
+retries make it worse. Calls go through three layers:
+
+    token bucket  - requests per second for the whole app, sized to xAI's
+                    documented per-key limit (480 requests/minute). The
+                    bucket is shared by all instances through a Firestore
+                    document (`rate_limits/<name>`); tokens are leased in
+                    small batches, so most calls take a token from the
+                    in-process lease without any I/O. While Firestore is
+                    unreachable an instance falls back to a local bucket
+                    with the same rate. GROK_RATE_LIMIT_SHARED=0 keeps
+                    every bucket local, which multiplies the limit by the
+                    number of instances (for single-instance development).
+    AIMD limiter  - caps in-flight calls per instance. The cap grows by one
+                    per window of successes and halves on a 429/503 (at most
+                    once per cooldown). A `retry-after` header pauses the
+                    bucket for every instance.
+    retries       - 429, 5xx and connection errors are retried with jittered
+                    exponential backoff, within a per-request time budget.
+                    An instance-wide retry budget (retries may only be a
+                    fraction of successes) keeps an outage from becoming a
+                    retry storm.
+
+Configuration (environment variables):
+    GROK_RATE_LIMIT_RPS        - requests per second (default 8)
+    GROK_RATE_LIMIT_BURST      - bucket capacity (default 16)
+    GROK_RATE_LIMIT_SHARED     - "0" for a bucket per instance instead of one through Firestore (default 1)
+    GROK_RATE_LIMIT_LEASE      - tokens leased per Firestore round trip when shared (default 4)
+    GROK_CONCURRENCY_INITIAL   - starting in-flight cap per instance (default 16)
+    GROK_CONCURRENCY_MAX       - upper bound for the in-flight cap (default 64)
+    GROK_ACQUIRE_TIMEOUT_SEC   - max wait for a token or slot (default 30)
+    GROK_RETRY_MAX_ATTEMPTS    - attempts per request, including the first (default 4)
+    GROK_RETRY_BUDGET_SEC      - max time spent backing off per request (default 20)
+"""
+import email.utils
+import os
+import random
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+import requests
+
+from grokads import metrics
+from grokads.admin import get_firestore
+
+COLLECTION = "rate_limits"
+
+RATE_PER_SEC = float(os.getenv("GROK_RATE_LIMIT_RPS", "8"))
+BURST = float(os.getenv("GROK_RATE_LIMIT_BURST", "16"))
+LEASE_SIZE = int(os.getenv("GROK_RATE_LIMIT_LEASE", "4"))
+SHARED = os.getenv("GROK_RATE_LIMIT_SHARED", "1").lower() in ("1", "true", "yes")
+CONCURRENCY_INITIAL = float(os.getenv("GROK_CONCURRENCY_INITIAL", "16"))
+CONCURRENCY_MAX = float(os.getenv("GROK_CONCURRENCY_MAX", "64"))
+ACQUIRE_TIMEOUT_SEC = float(os.getenv("GROK_ACQUIRE_TIMEOUT_SEC", "30"))
+MAX_ATTEMPTS = int(os.getenv("GROK_RETRY_MAX_ATTEMPTS", "4"))
+RETRY_BUDGET_SEC = float(os.getenv("GROK_RETRY_BUDGET_SEC", "20"))
+
+RETRYABLE_STATUSES = (429, 500, 502, 503, 504)
+BACKOFF_BASE_SEC = 0.5
+BACKOFF_MAX_SEC = 8.0
+DECREASE_COOLDOWN_SEC = 2.0
+FIRESTORE_RETRY_SEC = 60
+
+
+class RateLimited(Exception):
+    """No token or concurrency slot became available in time"""
+
+
+class MemoryBucketStore:
+    """Token bucket state for a single instance"""
+
+    def __init__(self):
+        self._state = {}
+        self._lock = threading.Lock()
+
+    def take(self, name, want, rate, burst, now):
+        with self._lock:
+            state = self._state.setdefault(name, {"tokens": burst, "updated_at": now, "blocked_until": 0})
+            return _take(state, want, rate, burst, now)
+
+    def block(self, name, until):
+        with self._lock:
+            state = self._state.setdefault(name, {"tokens": 0, "updated_at": time.time(), "blocked_until": 0})
+            state["blocked_until"] = max(state["blocked_until"], until)
+
+
+class FirestoreBucketStore:
+    """Token bucket state shared by all instances through one document per limiter"""
+
+    def take(self, name, want, rate, burst, now):
+        from google.cloud import firestore
+
+        db = get_firestore()
+        doc_ref = db.collection(COLLECTION).document(name)
+
+        @firestore.transactional
+        def take_in_transaction(transaction):
+            snapshot = doc_ref.get(transaction=transaction)
+            state = snapshot.to_dict() if snapshot.exists else {"tokens": burst, "updated_at": now, "blocked_until": 0}
+            result = _take(state, want, rate, burst, now)
+            transaction.set(doc_ref, state)
+            return result
+
+        return take_in_transaction(db.transaction())
+
+    def block(self, name, until):
+        from google.cloud import firestore
+
+        db = get_firestore()
+        doc_ref = db.collection(COLLECTION).document(name)
+
+        @firestore.transactional
+        def block_in_transaction(transaction):
+            snapshot = doc_ref.get(transaction=transaction)
+            blocked_until = (snapshot.to_dict() or {}).get("blocked_until", 0) if snapshot.exists else 0
+            if until > blocked_until:
+                transaction.set(doc_ref, {"blocked_until": until}, merge=True)
+
+        block_in_transaction(db.transaction())
+
+
+def _take(state, want, rate, burst, now):
+    """Refill `state` for the elapsed time and take up to `want` tokens.
+
+    Returns (granted, wait_sec); wait_sec is how long until a token is due.
+    """
+    if now < state.get("blocked_until", 0):
+        return 0, state["blocked_until"] - now
+    elapsed = max(0.0, now - state.get("updated_at", now))
+    tokens = min(burst, state.get("tokens", burst) + elapsed * rate)
+    granted = int(min(want, tokens))
+    state["tokens"] = tokens - granted
+    state["updated_at"] = now
+    return granted, 0.0 if granted else (1 - state["tokens"]) / rate
+
+
+class TokenBucket:
+    """Takes tokens from the local bucket, or leases them from the shared store"""
+
+    def __init__(self, name, rate=RATE_PER_SEC, burst=BURST, lease_size=LEASE_SIZE, shared=SHARED):
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+        # Leasing only saves round trips to the shared store
+        self.lease_size = max(1, lease_size) if shared else 1
+        self.memory_store = MemoryBucketStore()
+        self.shared_store = FirestoreBucketStore() if shared else None
+        self._shared_failed_at = None
+        self._leased = 0
+        self._lock = threading.Lock()
+
+    def _store(self):
+        if self.shared_store and (
+            self._shared_failed_at is None or time.time() - self._shared_failed_at > FIRESTORE_RETRY_SEC
+        ):
+            return self.shared_store
+        return self.memory_store
+
+    def _take(self, want):
+        store = self._store()
+        try:
+            return store.take(self.name, want, self.rate, self.burst, time.time())
+        except Exception as store_error:
+            if store is self.memory_store:
+                raise
+            # Keep serving from a per-instance bucket until Firestore is back
+            print(f"Shared rate limiter unavailable, using a local bucket: {str(store_error)}")
+            metrics.record_fallback("rate_limit_local_bucket")
+            self._shared_failed_at = time.time()
+            return self.memory_store.take(self.name, want, self.rate, self.burst, time.time())
+
+    def acquire(self, timeout=ACQUIRE_TIMEOUT_SEC):
+        deadline = time.time() + timeout
+        while True:
+            with self._lock:
+                if self._leased > 0:
+                    self._leased -= 1
+                    return
+            # Outside the lock: with the shared store this is a Firestore
+            # transaction, and other threads may use a lease meanwhile
+            granted, wait = self._take(self.lease_size)
+            if granted:
+                with self._lock:
+                    self._leased += granted - 1
+                return
+            if time.time() + wait > deadline:
+                raise RateLimited(f"No {self.name} token within {timeout:.0f}s")
+            time.sleep(min(wait, 1.0) + random.uniform(0, 0.05))
+
+    def block(self, seconds):
+        """Pause the bucket for everyone (e.g. after a retry-after header)"""
+        until = time.time() + seconds
+        with self._lock:
+            self._leased = 0
+        self.memory_store.block(self.name, until)
+        if self._store() is self.shared_store:
+            try:
+                self.shared_store.block(self.name, until)
+            except Exception as store_error:
+                print(f"Failed to share rate-limit pause: {str(store_error)}")
+
+
+class AdaptiveConcurrency:
+    """AIMD limit on in-flight calls: +1 per `limit` successes, halved on overload"""
+
+    def __init__(self, initial=CONCURRENCY_INITIAL, maximum=CONCURRENCY_MAX, minimum=1.0):
+        self.limit = initial
+        self.maximum = maximum
+        self.minimum = minimum
+        self.in_flight = 0
+        self._last_decrease = 0.0
+        self._condition = threading.Condition()
+
+    def acquire(self, timeout=ACQUIRE_TIMEOUT_SEC):
+        deadline = time.time() + timeout
+        with self._condition:
+            while self.in_flight >= int(self.limit):
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise RateLimited("No upstream concurrency slot available")
+                self._condition.wait(remaining)
+            self.in_flight += 1
+
+    def release(self, overloaded=False):
+        with self._condition:
+            self.in_flight -= 1
+            now = time.time()
+            if overloaded:
+                # One burst of 429s should only halve the limit once
+                if now - self._last_decrease > DECREASE_COOLDOWN_SEC:
+                    self.limit = max(self.minimum, self.limit / 2)
+                    self._last_decrease = now
+            else:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self._condition.notify_all()
+
+
+class RetryBudget:
+    """Instance-wide cap on retries: each success earns `ratio` of a retry"""
+
+    def __init__(self, ratio=0.2, capacity=10.0):
+        self.ratio = ratio
+        self.capacity = capacity
+        self.tokens = capacity
+        self._lock = threading.Lock()
+
+    def record_success(self):
+        with self._lock:
+            self.tokens = min(self.capacity, self.tokens + self.ratio)
+
+    def try_spend(self):
+        with self._lock:
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+
+def retry_after_seconds(response):
+    """Parse a retry-after header (seconds or HTTP date); None if absent"""
+    value = (response.headers or {}).get("retry-after") if response is not None else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def _transient_errors():
+    errors = (requests.ConnectionError, requests.Timeout)
+    if "httpx" in sys.modules:
+        errors += (sys.modules["httpx"].TransportError,)
+    return errors
+
+
+def backoff_delay(attempt):
+    """Full-jitter exponential backoff for the given retry attempt (1-based)"""
+    return random.uniform(0, min(BACKOFF_MAX_SEC, BACKOFF_BASE_SEC * (2 ** attempt)))
+
+
+class LimitedResponse:
+    """Stands in for a requests.Response when the local limiter gives up"""
+
+    def __init__(self, status_code, text):
+        self.status_code = status_code
+        self.text = text
+        self.headers = {}
+
+    def json(self):
+        return {"error": self.text}
+
+
+class _SlotOutcome:
+    overloaded = False
+
+
+class Limiter:
+    """Token bucket + adaptive concurrency + retries for one upstream API"""
+
+    def __init__(self, name):
+        self.name = name
+        self.bucket = TokenBucket(name)
+        self.concurrency = AdaptiveConcurrency()
+        self.retry_budget = RetryBudget()
+
+    @contextmanager
+    def slot(self):
+        """Hold a token and a concurrency slot for a call that can't be retried (e.g. a stream)
+
+        Set `overloaded = True` on the yielded object if the upstream answered 429/503.
+        """
+        self.bucket.acquire()
+        self.concurrency.acquire()
+        outcome = _SlotOutcome()
+        try:
+            yield outcome
+        finally:
+            self.concurrency.release(overloaded=outcome.overloaded)
+            if not outcome.overloaded:
+                self.retry_budget.record_success()
+
+    def call(self, send, max_attempts=MAX_ATTEMPTS, retry_budget_sec=RETRY_BUDGET_SEC):
+        """Run `send()` (which returns a response) under the limiter, with retries"""
+        retry_deadline = time.time() + retry_budget_sec
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                self.bucket.acquire()
+                self.concurrency.acquire()
+            except RateLimited as limited:
+                return LimitedResponse(429, f"{self.name} rate limit reached, try again shortly ({str(limited)})")
+
+            response = None
+            error = None
+            try:
+                response = send()
+            except _transient_errors() as send_error:
+                error = send_error
+            finally:
+                overloaded = response is not None and response.status_code in (429, 503)
+                self.concurrency.release(overloaded=overloaded)
+
+            if error is None and response.status_code not in RETRYABLE_STATUSES:
+                self.retry_budget.record_success()
+                return response
+
+            retry_after = retry_after_seconds(response)
+            if retry_after:
+                self.bucket.block(retry_after)
+
+            delay = retry_after if retry_after is not None else backoff_delay(attempt)
+            if (
+                attempt >= max_attempts
+                or time.time() + delay > retry_deadline
+                or not self.retry_budget.try_spend()
+            ):
+                if error is not None:
+                    raise error
+                return response
+
+            reason = f"status {response.status_code}" if response is not None else str(error)
+            print(f"{self.name}: retrying after {reason} in {delay:.2f}s (attempt {attempt + 1}/{max_attempts})")
+            metrics.inc("grokads_upstream_retries_total", limiter=self.name)
+            time.sleep(delay)
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(name):
+    """The process-wide limiter for `name` (e.g. "xai")"""
+    limiter = _limiters.get(name)
+    if limiter is None:
+        with _limiters_lock:
+            limiter = _limiters.get(name)
+            if limiter is None:
+                limiter = Limiter(name)
+                _limiters[name] = limiter
+    return limiter
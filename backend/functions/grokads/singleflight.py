@@ -0,0 +1,160 @@
+"""Coalescing of identical in-flight upstream requests (single flight).
+
+When a trend spikes, many users ask for exactly the same thing at the same
+moment. Within an instance, concurrent callers with the same key share one
+in-flight call: the first runs it and the rest wait for its result.
+
+Across instances, the leader can also take a short lease in Firestore
+(`inflight/<key>`) and write its result there; leaders on other instances
+find the lease and wait for that result instead of issuing a duplicate. If
+the leader dies or is too slow, the lease expires and followers run the
+call themselves.
+
+Configuration (environment variables):
+    SINGLEFLIGHT_SHARED     - "1" to coalesce across instances (default off)
+    SINGLEFLIGHT_LEASE_SEC  - lifetime of a leader's lease (default 30)
+    SINGLEFLIGHT_WAIT_SEC   - max time a follower waits for a result (default 25)
+"""
+import hashlib
+import os
+import threading
+import time
+from concurrent.futures import Future
+
+from grokads.admin import get_firestore
+
+COLLECTION = "inflight"
+
+SHARED = os.getenv("SINGLEFLIGHT_SHARED", "").lower() in ("1", "true", "yes")
+LEASE_SEC = float(os.getenv("SINGLEFLIGHT_LEASE_SEC", "30"))
+WAIT_SEC = float(os.getenv("SINGLEFLIGHT_WAIT_SEC", "25"))
+POLL_INTERVAL_SEC = 0.25
+# How long a finished result may still be picked up by a late follower
+RESULT_TTL_SEC = 5.0
+
+_calls = {}
+_calls_lock = threading.Lock()
+
+_stats = {"leaders": 0, "followers": 0, "shared_followers": 0}
+_stats_lock = threading.Lock()
+
+
+def _count(counter):
+    with _stats_lock:
+        _stats[counter] += 1
+
+
+def stats():
+    with _stats_lock:
+        return dict(_stats)
+
+
+def do(key, fn, shared=None, encode=None, decode=None):
+    """Run `fn()` once for all concurrent callers with the same `key`.
+
+    Every caller gets the leader's return value (or its exception). With
+    `shared` (default SINGLEFLIGHT_SHARED), the result is also offered to
+    other instances; `encode(result)` must return a Firestore-safe dict and
+    `decode(dict)` rebuild the result.
+    """
+    with _calls_lock:
+        future = _calls.get(key)
+        leader = future is None
+        if leader:
+            future = Future()
+            _calls[key] = future
+
+    if not leader:
+        _count("followers")
+        return future.result()
+
+    _count("leaders")
+    try:
+        if (SHARED if shared is None else shared) and encode and decode:
+            result = _do_shared(key, fn, encode, decode)
+        else:
+            result = fn()
+        future.set_result(result)
+        return result
+    except BaseException as call_error:
+        future.set_exception(call_error)
+        raise
+    finally:
+        with _calls_lock:
+            _calls.pop(key, None)
+
+
+def _doc(key):
+    # Keys can be long or contain "/", document ids can't
+    return get_firestore().collection(COLLECTION).document(hashlib.sha256(key.encode("utf-8")).hexdigest())
+
+
+def _try_lease(doc_ref):
+    """Create the lease document; returns True if this instance is now the leader"""
+    from google.api_core import exceptions
+
+    now = time.time()
+    try:
+        doc_ref.create({"done": False, "result": None, "expires_at": now + LEASE_SEC})
+        return True
+    except exceptions.AlreadyExists:
+        pass
+
+    snapshot = doc_ref.get()
+    lease = snapshot.to_dict() if snapshot.exists else None
+    if lease is None or lease["expires_at"] < now:
+        # A stale lease or an old result: replace it, but only if nobody else did first
+        try:
+            if snapshot.exists:
+                doc_ref.delete(option=get_firestore().write_option(last_update_time=snapshot.update_time))
+            doc_ref.create({"done": False, "result": None, "expires_at": now + LEASE_SEC})
+            return True
+        except (exceptions.AlreadyExists, exceptions.FailedPrecondition):
+            return False
+    return False
+
+
+def _wait_for_result(doc_ref):
+    """Poll a leader's lease; returns its encoded result, or None to run the call ourselves"""
+    deadline = time.time() + WAIT_SEC
+    while time.time() < deadline:
+        snapshot = doc_ref.get()
+        lease = snapshot.to_dict() if snapshot.exists else None
+        if lease is None or lease["expires_at"] < time.time():
+            return None
+        if lease["done"]:
+            return lease["result"]
+        time.sleep(POLL_INTERVAL_SEC)
+    return None
+
+
+def _do_shared(key, fn, encode, decode):
+    try:
+        doc_ref = _doc(key)
+        is_leader = _try_lease(doc_ref)
+    except Exception as lease_error:
+        print(f"Single-flight lease unavailable, calling directly: {str(lease_error)}")
+        return fn()
+
+    if not is_leader:
+        result = _wait_for_result(doc_ref)
+        if result is not None:
+            _count("shared_followers")
+            return decode(result)
+        return fn()
+
+    try:
+        result = fn()
+    except BaseException:
+        # Let followers give up right away instead of waiting out the lease
+        try:
+            doc_ref.delete()
+        except Exception:
+            pass
+        raise
+
+    try:
+        doc_ref.set({"done": True, "result": encode(result), "expires_at": time.time() + RESULT_TTL_SEC})
+    except Exception as publish_error:
+        print(f"Failed to publish single-flight result: {str(publish_error)}")
+    return result
@@ -0,0 +1,282 @@
+"""Storage for generated media (videos, images).
+
+Media is written in chunks straight to the storage backend, and responses
+carry a short-lived URL instead of the bytes themselves, so memory use and
+response size stay constant no matter how large the file is.
+
+Two backends:
+    gcs   - Cloud Storage, served with V4 signed URLs (default in production)
+    local - a directory on disk, served by the `get_media` function with
+            HMAC-signed URLs (default in the emulator; handy for tests)
+
+Configuration (environment variables):
+    MEDIA_STORAGE_BACKEND     - "gcs" or "local"
+    STORAGE_BUCKET            - bucket name (default: the project's default bucket)
+    MEDIA_LOCAL_DIR           - root directory of the local backend
+    MEDIA_LOCAL_BASE_URL      - URL of the get_media function (local backend)
+    MEDIA_URL_SIGNING_SECRET  - HMAC secret for local-backend URLs
+    MEDIA_URL_TTL_SEC         - lifetime of download URLs (default 3600)
+"""
+import hashlib
+import hmac
+import mimetypes
+import os
+import shutil
+import tempfile
+import time
+from datetime import timedelta
+from pathlib import Path
+from urllib.parse import urlencode
+
+from grokads.admin import get_app, get_bucket
+
+SIGNED_URL_TTL = int(os.getenv("MEDIA_URL_TTL_SEC", "3600"))
+CHUNK_SIZE = 1024 * 1024  # Resumable uploads require a multiple of 256 KiB
+
+
+def _default_backend_name():
+    if os.getenv("MEDIA_STORAGE_BACKEND"):
+        return os.getenv("MEDIA_STORAGE_BACKEND").lower()
+    return "local" if os.getenv("FUNCTIONS_EMULATOR") == "true" else "gcs"
+
+
+class GCSStorageBackend:
+    """Cloud Storage backend"""
+
+    name = "gcs"
+
+    def open_write(self, path, content_type):
+        return get_bucket().blob(path).open("wb", content_type=content_type, chunk_size=CHUNK_SIZE)
+
+    def save_file(self, path, local_path, content_type):
+        get_bucket().blob(path).upload_from_filename(local_path, content_type=content_type)
+
+    def open_read(self, path):
+        return get_bucket().blob(path).open("rb", chunk_size=CHUNK_SIZE)
+
+    def exists(self, path):
+        return get_bucket().blob(path).exists()
+
+    def size(self, path):
+        blob = get_bucket().get_blob(path)
+        return blob.size if blob else None
+
+    def delete(self, path):
+        from google.api_core import exceptions
+        try:
+            get_bucket().blob(path).delete()
+        except exceptions.NotFound:
+            pass
+
+    def signed_url(self, path, ttl):
+        return get_bucket().blob(path).generate_signed_url(
+            version="v4",
+            expiration=timedelta(seconds=ttl),
+            method="GET",
+            **self._signing_kwargs()
+        )
+
+    @staticmethod
+    def _signing_kwargs():
+        # Service-account key files can sign locally. On Cloud Functions the
+        # runtime only has a token, so signing goes through the IAM signBlob API.
+        credentials = get_app().credential.get_credential()
+        if hasattr(credentials, "sign_bytes") and getattr(credentials, "signer", None):
+            return {}
+        from google.auth.transport.requests import Request
+        if not credentials.valid:
+            credentials.refresh(Request())
+        return {
+            "service_account_email": credentials.service_account_email,
+            "access_token": credentials.token,
+        }
+
+
+class LocalStorageBackend:
+    """Filesystem backend for the emulator and tests"""
+
+    name = "local"
+
+    def __init__(self, root):
+        self.root = Path(root).resolve()
+
+    def local_path(self, path):
+        file_path = (self.root / path).resolve()
+        if self.root not in file_path.parents:
+            raise ValueError(f"Invalid media path: {path}")
+        return file_path
+
+    def open_write(self, path, content_type):
+        file_path = self.local_path(path)
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+        return open(file_path, "wb")
+
+    def save_file(self, path, local_path, content_type):
+        file_path = self.local_path(path)
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copyfile(local_path, file_path)
+
+    def open_read(self, path):
+        return open(self.local_path(path), "rb")
+
+    def exists(self, path):
+        return self.local_path(path).is_file()
+
+    def size(self, path):
+        file_path = self.local_path(path)
+        return file_path.stat().st_size if file_path.is_file() else None
+
+    def delete(self, path):
+        self.local_path(path).unlink(missing_ok=True)
+
+    def signed_url(self, path, ttl):
+        expires = int(time.time()) + ttl
+        query = urlencode({"path": path, "expires": expires, "signature": _local_signature(path, expires)})
+        return f"{_local_base_url()}?{query}"
+
+
+def _local_base_url():
+    if os.getenv("MEDIA_LOCAL_BASE_URL"):
+        return os.getenv("MEDIA_LOCAL_BASE_URL")
+    project = os.getenv("GCLOUD_PROJECT", "grokads-47abba")
+    return f"http://localhost:5001/{project}/us-central1/get_media"
+
+
+def _local_signature(path, expires):
+    # Both codebases must agree on the secret, so the local default is a fixed
+    # development value rather than a per-process random one
+    secret = os.getenv("MEDIA_URL_SIGNING_SECRET", "grokads-local-media")
+    message = f"{path}:{expires}".encode("utf-8")
+    return hmac.new(secret.encode("utf-8"), message, hashlib.sha256).hexdigest()
+
+
+def verify_local_signature(path, expires, signature):
+    """Check a local-backend URL signature and expiry"""
+    try:
+        expires = int(expires)
+    except (TypeError, ValueError):
+        return False
+    if expires < time.time():
+        return False
+    return hmac.compare_digest(_local_signature(path, expires), signature or "")
+
+
+_backend = None
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        if _default_backend_name() == "local":
+            root = os.getenv("MEDIA_LOCAL_DIR") or os.path.join(tempfile.gettempdir(), "grokads-media")
+            _backend = LocalStorageBackend(root)
+        else:
+            _backend = GCSStorageBackend()
+    return _backend
+
+
+def guess_content_type(path):
+    return mimetypes.guess_type(path)[0] or "application/octet-stream"
+
+
+def save_stream(path, chunks, content_type):
+    """Write an iterable of byte chunks to `path`; returns the number of bytes written"""
+    size_bytes = 0
+    with get_backend().open_write(path, content_type) as writer:
+        for chunk in chunks:
+            if chunk:
+                writer.write(chunk)
+                size_bytes += len(chunk)
+    return size_bytes
+
+
+def save_file(path, local_path, content_type):
+    """Upload a local file to `path`; returns its size in bytes"""
+    get_backend().save_file(path, local_path, content_type)
+    return os.path.getsize(local_path)
+
+
+def put_bytes(path, data, content_type):
+    """Upload an in-memory payload to `path` and return the path"""
+    save_stream(path, [data], content_type)
+    return path
+
+
+def open_read(path):
+    return get_backend().open_read(path)
+
+
+def delete(path):
+    get_backend().delete(path)
+
+
+def parse_range(header, size_bytes):
+    """Parse a single-range `Range: bytes=...` header into (start, end), inclusive
+
+    Returns None when the header is absent or not a single byte range (the
+    whole file is served), and raises ValueError when the range can't be
+    satisfied (a 416).
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    first, _, last = header[len("bytes="):].strip().partition("-")
+    try:
+        if first:
+            start = int(first)
+            end = int(last) if last else size_bytes - 1
+        else:
+            # Suffix range: the last N bytes
+            start = max(size_bytes - int(last), 0)
+            end = size_bytes - 1
+    except ValueError:
+        return None
+    if start >= size_bytes or start > end:
+        raise ValueError(f"Range not satisfiable: {header}")
+    return start, min(end, size_bytes - 1)
+
+
+def etag_matches(if_none_match, etag):
+    """Whether an If-None-Match header lists `etag` (a quoted entity tag)
+
+    The header is a comma-separated list of tags or "*"; tags are compared
+    exactly after dropping the weak "W/" prefix, as If-None-Match uses the
+    weak comparison.
+    """
+    if not if_none_match or not etag:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    wanted = etag.removeprefix("W/")
+    return any(tag.strip().removeprefix("W/") == wanted for tag in if_none_match.split(","))
+
+
+def read_range(path, start=0, end=None):
+    """Yield bytes start..end (inclusive; None = to the end) of a stored file in chunks"""
+    with open_read(path) as f:
+        if start:
+            f.seek(start)
+        remaining = None if end is None else end - start + 1
+        while remaining is None or remaining > 0:
+            chunk = f.read(CHUNK_SIZE if remaining is None else min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            if remaining is not None:
+                remaining -= len(chunk)
+            yield chunk
+
+
+def signed_url(path, ttl=None):
+    """Return a short-lived GET URL for `path`"""
+    return get_backend().signed_url(path, ttl or SIGNED_URL_TTL)
+
+
+def media_info(path, content_type, size_bytes, ttl=None):
+    """Response metadata for a stored media file, including a fresh download URL"""
+    ttl = ttl or SIGNED_URL_TTL
+    return {
+        "storage_path": path,
+        "url": signed_url(path, ttl),
+        "url_expires_at": int(time.time()) + ttl,
+        "mime_type": content_type,
+        "size_bytes": size_bytes,
+    }
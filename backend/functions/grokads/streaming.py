@@ -0,0 +1,32 @@
+"""Helpers for streaming event responses as NDJSON or Server-Sent Events."""
+import json
+
+CONTENT_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "sse": "text/event-stream",
+}
+
+
+def negotiate_format(requested, accept_header):
+    """Pick "ndjson" or "sse" from an explicit request or the Accept header"""
+    if requested in CONTENT_TYPES:
+        return requested
+    return "sse" if "text/event-stream" in (accept_header or "") else "ndjson"
+
+
+def encode_events(events, stream_format):
+    """Encode dict events (each with a "type") as NDJSON lines or SSE messages"""
+    for event in events:
+        if stream_format == "sse":
+            yield f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+        else:
+            yield json.dumps(event) + "\n"
+
+
+def stream_headers(stream_format):
+    return {
+        "Content-Type": CONTENT_TYPES[stream_format],
+        "Cache-Control": "no-cache",
+        # Ask proxies not to buffer, so each event is flushed as it is produced
+        "X-Accel-Buffering": "no",
+    }
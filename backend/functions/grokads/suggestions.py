@@ -0,0 +1,55 @@
+"""Grok suggestions (text overlay, caption, hashtags) for generated media."""
+import json
+
+from grokads import token_budget, upstream
+
+# How long a handler waits for suggestions once its media is ready
+SUGGESTIONS_GRACE_SEC = 10
+
+
+def generate_suggestions(user_prompt, media_type="video"):
+    """Ask Grok for text overlay, caption and hashtag suggestions ({} on failure)
+
+    Depends only on the prompt, so handlers start it alongside the media
+    generation instead of after it.
+    """
+    suggestions = {}
+    grok_api_key = upstream.get_secret("GROK_API_KEY")
+    if not grok_api_key:
+        return suggestions
+
+    try:
+        suggestions_prompt = f"""Based on this {media_type} ad prompt: "{user_prompt}"
+
+Generate:
+1. A short, punchy text overlay (3-5 words max) that would work well overlaid on the {media_type}
+2. A compelling social media caption (1-2 sentences) for posting this {media_type}
+3. 5-10 relevant hashtags (without # symbol, just the words)
+
+Format as JSON:
+{{
+  "text_overlay": "short punchy text",
+  "caption": "compelling caption text",
+  "hashtags": ["hashtag1", "hashtag2", "hashtag3"]
+}}"""
+
+        suggestions_response = upstream.grok_chat(
+            suggestions_prompt,
+            temperature=0.8,
+            max_tokens=token_budget.plan("media_suggestions"),
+            timeout=30,
+            api_key=grok_api_key,
+            cache="media_suggestions"
+        )
+        token_budget.observe("media_suggestions", suggestions_response)
+
+        if suggestions_response.status_code == 200:
+            suggestions_content = upstream.chat_content(suggestions_response)
+            try:
+                suggestions = json.loads(suggestions_content)
+            except ValueError:
+                pass
+    except Exception as suggestions_error:
+        print(f"Failed to generate suggestions: {str(suggestions_error)}")
+
+    return suggestions
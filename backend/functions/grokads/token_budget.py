@@ -0,0 +1,105 @@
+"""Output token budgets for Grok completions, sized to the request.
+
+Each kind of completion has a profile: a fixed overhead (JSON wrapper,
+shared fields) plus a per-item cost (one variant, one prediction, ...).
+`plan(profile, items)` turns that into `max_tokens` for a call producing
+`items` items, and `max_items(profile)` is how many items fit under
+TOKEN_BUDGET_CEILING, so callers split larger requests into several calls
+instead of getting JSON that is cut off mid-object.
+
+Profiles start from conservative priors and are calibrated from the
+`usage` of answered calls (`observe`): the per-item cost becomes a moving
+average of what the model actually wrote, plus TOKEN_BUDGET_HEADROOM. A
+call that stopped on the token limit (finish_reason "length") raises the
+estimate at once. Answers from the completion cache are not observed, as
+they would count the same completion again. Calibration is per instance; a
+cold instance uses the priors.
+
+max_tokens is part of the completion cache key (grokads.llm_cache), so
+budgets are rounded up to one of a few fixed BUCKETS rather than following
+every move of the estimate; the same request keeps hitting the same cache
+entry across instances and calibrations. max_tokens is only a cap, so the
+unused part of a bucket costs nothing.
+
+Configuration (environment variables):
+    TOKEN_BUDGET_CEILING   - max_tokens never goes above this; larger requests are split (default 4000)
+    TOKEN_BUDGET_HEADROOM  - margin over the calibrated per-item cost (default 1.3)
+"""
+import os
+import threading
+
+CEILING = int(os.getenv("TOKEN_BUDGET_CEILING", "4000"))
+HEADROOM = float(os.getenv("TOKEN_BUDGET_HEADROOM", "1.3"))
+# max_tokens values plan() returns; the last is always CEILING
+BUCKETS = tuple(sorted({size for size in (256, 512, 1024, 2048) if size < CEILING} | {CEILING}))
+
+# Weight of each new observation in the moving average
+ALPHA = 0.2
+# Growth of the per-item estimate after a truncated completion
+TRUNCATION_GROWTH = 1.5
+
+# (overhead, prior per-item tokens); the priors give roughly the previous fixed budgets
+PROFILES = {
+    "strategy": (0, 2000),
+    "campaign_variants": (40, 300),
+    "variants": (40, 200),
+    "prediction": (0, 1500),
+    "predictions": (30, 380),
+    "trend_ad": (0, 1000),
+    "media_suggestions": (0, 500),
+    "trend_suggestions": (0, 500),
+}
+
+_calibrated = {}
+_lock = threading.Lock()
+
+
+def _per_item(profile):
+    """Calibrated per-item estimate with headroom, or the prior"""
+    overhead, prior = PROFILES[profile]
+    with _lock:
+        average = _calibrated.get(profile)
+    return prior if average is None else average * HEADROOM
+
+
+def plan(profile, items=1):
+    """max_tokens for a call of `profile` that should produce `items` items"""
+    overhead, _ = PROFILES[profile]
+    estimate = overhead + _per_item(profile) * max(1, items)
+    return next((size for size in BUCKETS if size >= estimate), CEILING)
+
+
+def max_items(profile):
+    """The most items one call of `profile` can produce under the ceiling (at least 1)"""
+    overhead, _ = PROFILES[profile]
+    return max(1, int((CEILING - overhead) // max(1.0, _per_item(profile))))
+
+
+def observe(profile, response, items=1):
+    """Calibrate `profile` from an answered call that asked for `items` items"""
+    if getattr(response, "status_code", None) != 200 or items < 1:
+        return
+    if response.headers.get("X-Grok-Cache") == "hit":
+        return
+    try:
+        body = response.json()
+    except ValueError:
+        return
+    usage = body.get("usage") if isinstance(body, dict) else None
+    completion_tokens = usage.get("completion_tokens") if isinstance(usage, dict) else None
+    if not isinstance(completion_tokens, int):
+        return
+    choices = body.get("choices") or [{}]
+    truncated = choices[0].get("finish_reason") == "length"
+
+    overhead, _ = PROFILES[profile]
+    sample = max(1.0, (completion_tokens - overhead) / items)
+    with _lock:
+        average = _calibrated.get(profile)
+        if truncated:
+            # The real cost is unknown but larger than what fit; don't average it down
+            _calibrated[profile] = max(sample, average or 0) * TRUNCATION_GROWTH
+        elif average is None:
+            _calibrated[profile] = sample
+        else:
+            _calibrated[profile] = average + ALPHA * (sample - average)
@@ -0,0 +1,207 @@
+"""Precomputed image/video prompt suggestions for trending topics.
+
+The top trends are the same for every user, so instead of a Grok call on
+every click a scheduled job (`prefetch_trend_suggestions`, or this module's
+CLI) fetches trends for a list of WOEIDs and stores prompts for the top K
+of them in the `trend_suggestions` collection. `get_trend_ad_suggestions`
+serves those instantly and only generates live on a miss.
+
+CLI (from backend/functions, with the functions venv active):
+    python -m grokads.trend_suggestions
+    python -m grokads.trend_suggestions --woeid 1 --woeid 23424975 --top 5
+
+Configuration (environment variables):
+    PREFETCH_WOEIDS       - comma-separated WOEIDs (default "1,23424977")
+    PREFETCH_TOP_K        - trends per WOEID (default 10)
+    PREFETCH_CONCURRENCY  - concurrent Grok calls while prefetching (default 4)
+    PREFETCH_TTL_SEC      - lifetime of a stored suggestion (default 3600)
+"""
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from grokads import concurrency, token_budget, trends, upstream
+from grokads.admin import get_firestore
+from grokads.cache import LRUCache
+
+COLLECTION = "trend_suggestions"
+
+WOEIDS = [w.strip() for w in os.getenv("PREFETCH_WOEIDS", "1,23424977").split(",") if w.strip()]
+TOP_K = int(os.getenv("PREFETCH_TOP_K", "10"))
+CONCURRENCY = int(os.getenv("PREFETCH_CONCURRENCY", "4"))
+TTL_SEC = int(os.getenv("PREFETCH_TTL_SEC", "3600"))
+
+# Suggestions found in Firestore are kept in memory until they expire
+_memory = LRUCache(512)
+
+
+def build_prompt(trend_name):
+    return f"""For the trending topic: "{trend_name}", generate:
+
+1. A detailed image generation prompt (for creating an advertisement image, 1-2 sentences, focus on visual elements)
+2. A detailed video generation prompt (for creating a short advertisement video, 1-2 sentences, focus on dynamic visual elements and narrative)
+
+Format as JSON object:
+{{
+  "image_prompt": "detailed image generation prompt",
+  "video_prompt": "detailed video generation prompt"
+}}
+
+Be creative and make the prompts relevant to the trending topic and suitable for advertising."""
+
+
+def fallback_prompts(trend_name):
+    return {
+        "image_prompt": f"Create an engaging advertisement image for {trend_name}, featuring modern design, vibrant colors, and compelling visual elements that capture attention",
+        "video_prompt": f"Create a short, dynamic advertisement video for {trend_name}, with smooth transitions, engaging visuals, and a clear narrative that connects with viewers"
+    }
+
+
+def generate_prompts(trend_name, api_key=None, bypass_cache=False):
+    """Ask Grok for prompts for one trend; None if the answer can't be parsed.
+
+    Raises UpstreamError if Grok answers with a non-200 status.
+    """
+    response = upstream.grok_chat(
+        build_prompt(trend_name),
+        temperature=0.8,
+        max_tokens=token_budget.plan("trend_suggestions"),
+        timeout=30,
+        api_key=api_key,
+        cache="trend_suggestions",
+        bypass_cache=bypass_cache
+    )
+    token_budget.observe("trend_suggestions", response)
+    if response.status_code != 200:
+        raise upstream.UpstreamError(response.status_code, response.text)
+
+    try:
+        prompts = json.loads(upstream.chat_content(response))
+    except ValueError:
+        return None
+    if not isinstance(prompts, dict) or "image_prompt" not in prompts or "video_prompt" not in prompts:
+        return None
+    return {"image_prompt": prompts["image_prompt"], "video_prompt": prompts["video_prompt"]}
+
+
+def _doc_id(trend_name):
+    normalized = " ".join(trend_name.lower().split())
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()[:40]
+
+
+def get_precomputed(trend_name):
+    """Stored prompts for `trend_name`, or None if missing or expired"""
+    key = _doc_id(trend_name)
+    entry = _memory.get(key)
+    if entry is None:
+        try:
+            snapshot = get_firestore().collection(COLLECTION).document(key).get()
+        except Exception as firestore_error:
+            print(f"Trend suggestion lookup failed: {str(firestore_error)}")
+            return None
+        if not snapshot.exists:
+            return None
+        entry = snapshot.to_dict()
+        _memory.set(key, entry)
+    if entry.get("expires_at", 0) < time.time():
+        _memory.pop(key)
+        return None
+    return entry["prompts"]
+
+
+def store(trend_name, prompts, woeid=None, ttl=None):
+    key = _doc_id(trend_name)
+    now = time.time()
+    entry = {
+        "trend": trend_name,
+        "prompts": prompts,
+        "woeid": woeid,
+        "generated_at": now,
+        "expires_at": now + (ttl or TTL_SEC),
+    }
+    get_firestore().collection(COLLECTION).document(key).set(entry)
+    _memory.set(key, entry)
+
+
+def store_in_background(trend_name, prompts):
+    """Keep a live-generated result for the next request (best effort)"""
+    def save():
+        try:
+            store(trend_name, prompts)
+        except Exception as store_error:
+            print(f"Failed to store trend suggestion: {str(store_error)}")
+    concurrency.submit(save)
+
+
+def top_trends(woeid, top_k):
+    cached = trends.get_trends(woeid)
+    if cached["status_code"] != 200:
+        print(f"Trends unavailable for WOEID {woeid}: {cached['status_code']}")
+        return []
+    data = json.loads(cached["body"]).get("data") or []
+    return [t["trend_name"] for t in data[:top_k] if t.get("trend_name")]
+
+
+def prefetch(woeids=None, top_k=None, max_workers=None, force=False):
+    """Precompute suggestions for the top trends of each WOEID.
+
+    Trends that already have a fresh suggestion are skipped unless `force`.
+    At most `max_workers` Grok calls run at once. Returns a summary dict.
+    """
+    woeids = woeids or WOEIDS
+    top_k = top_k or TOP_K
+    api_key = upstream.get_secret("GROK_API_KEY")
+    if not api_key:
+        raise RuntimeError("Grok API key not configured")
+
+    # The same trend often tops several regions; generate it once
+    todo = {}
+    for woeid in woeids:
+        for trend_name in top_trends(woeid, top_k):
+            todo.setdefault(_doc_id(trend_name), (trend_name, woeid))
+
+    summary = {"trends": len(todo), "generated": 0, "skipped": 0, "failed": 0}
+
+    def work(trend_name, woeid):
+        if not force and get_precomputed(trend_name) is not None:
+            return "skipped"
+        try:
+            prompts = generate_prompts(trend_name, api_key=api_key, bypass_cache=force)
+        except upstream.UpstreamError as grok_error:
+            print(f"Prefetch failed for {trend_name!r}: {grok_error.status_code} {grok_error.text[:200]}")
+            return "failed"
+        if prompts is None:
+            print(f"Prefetch got unparseable prompts for {trend_name!r}")
+            return "failed"
+        store(trend_name, prompts, woeid=woeid)
+        return "generated"
+
+    # A dedicated, bounded pool: a large prefetch must not starve request fan-out
+    with ThreadPoolExecutor(max_workers=max(1, max_workers or CONCURRENCY), thread_name_prefix="prefetch") as pool:
+        futures = [pool.submit(work, trend_name, woeid) for trend_name, woeid in todo.values()]
+        for future in futures:
+            try:
+                summary[future.result()] += 1
+            except Exception as prefetch_error:
+                print(f"Prefetch task failed: {str(prefetch_error)}")
+                summary["failed"] += 1
+
+    return summary
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from dotenv import load_dotenv
+
+    parser = argparse.ArgumentParser(description="Precompute ad suggestions for the current top trends")
+    parser.add_argument("--woeid", action="append", help="WOEID to prefetch (repeatable; default PREFETCH_WOEIDS)")
+    parser.add_argument("--top", type=int, default=None, help="trends per WOEID (default PREFETCH_TOP_K)")
+    parser.add_argument("--concurrency", type=int, default=None, help="concurrent Grok calls (default PREFETCH_CONCURRENCY)")
+    parser.add_argument("--force", action="store_true", help="regenerate trends that are already stored")
+    args = parser.parse_args()
+
+    load_dotenv(os.path.join(os.path.dirname(__file__), "..", "..", ".env"))
+    print(json.dumps(prefetch(args.woeid, args.top, args.concurrency, args.force), indent=2))
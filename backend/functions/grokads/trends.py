@@ -0,0 +1,194 @@
+"""Two-tier cache for X trends, keyed by WOEID.
+
+X trends change on a scale of minutes and the trends endpoint is tightly
+rate limited, so responses are cached:
+
+    memory    - an LRU per instance (no I/O on a hit)
+    firestore - the `trends_cache` collection, shared by all instances
+
+An entry is fresh for TRENDS_TTL_SEC. After that it is still served for up
+to TRENDS_STALE_SEC while a single background refresh fetches a new copy
+(stale-while-revalidate). Upstream 4xx responses (including 429) are cached
+too, for TRENDS_NEGATIVE_TTL_SEC (or until X's rate-limit reset), so a bad
+token or an exhausted quota is not retried on every page load. 5xx and
+network errors are never cached; the last good entry is served instead, if
+there is one.
+
+Configuration (environment variables):
+    TRENDS_TTL_SEC           - freshness lifetime (default 300)
+    TRENDS_STALE_SEC         - stale-while-revalidate window (default 900)
+    TRENDS_NEGATIVE_TTL_SEC  - lifetime of cached 4xx responses (default 60)
+    TRENDS_CACHE_MAX_ENTRIES - size of the in-memory LRU (default 256)
+    TRENDS_CACHE_FIRESTORE   - "0" to disable the shared Firestore tier
+"""
+import hashlib
+import os
+import threading
+import time
+
+from grokads import concurrency, singleflight, upstream
+from grokads.admin import get_firestore
+from grokads.cache import LRUCache
+
+COLLECTION = "trends_cache"
+
+TTL_SEC = int(os.getenv("TRENDS_TTL_SEC", "300"))
+STALE_SEC = int(os.getenv("TRENDS_STALE_SEC", "900"))
+NEGATIVE_TTL_SEC = int(os.getenv("TRENDS_NEGATIVE_TTL_SEC", "60"))
+MAX_NEGATIVE_TTL_SEC = 900
+FIRESTORE_ENABLED = os.getenv("TRENDS_CACHE_FIRESTORE", "1").lower() not in ("0", "false", "no")
+
+_memory = LRUCache(int(os.getenv("TRENDS_CACHE_MAX_ENTRIES", "256")))
+_refreshing = set()
+_refreshing_lock = threading.Lock()
+
+
+def _etag(body):
+    return '"' + hashlib.sha256(body.encode("utf-8")).hexdigest()[:32] + '"'
+
+
+def _negative_ttl(response, now):
+    """Cache lifetime of a 4xx response; a 429 is kept until X's rate-limit reset"""
+    ttl = NEGATIVE_TTL_SEC
+    if response.status_code == 429:
+        reset = response.headers.get("x-rate-limit-reset")
+        if reset and reset.isdigit():
+            ttl = max(ttl, int(reset) - int(now))
+    return min(ttl, MAX_NEGATIVE_TTL_SEC)
+
+
+def _firestore_get(woeid):
+    if not FIRESTORE_ENABLED:
+        return None
+    try:
+        snapshot = get_firestore().collection(COLLECTION).document(woeid).get()
+        return snapshot.to_dict() if snapshot.exists else None
+    except Exception as firestore_error:
+        print(f"Trends cache read failed for {woeid}: {str(firestore_error)}")
+        return None
+
+
+def _firestore_set(woeid, entry):
+    if not FIRESTORE_ENABLED:
+        return
+    try:
+        get_firestore().collection(COLLECTION).document(woeid).set(entry)
+    except Exception as firestore_error:
+        print(f"Trends cache write failed for {woeid}: {str(firestore_error)}")
+
+
+def _lookup(woeid):
+    entry = _memory.get(woeid)
+    if entry is None:
+        entry = _firestore_get(woeid)
+        if entry is not None:
+            _memory.set(woeid, entry)
+    return entry
+
+
+def _fetch(woeid, bearer_token):
+    """Call X and store the result; returns the new entry, or None if it can't be cached"""
+    response = upstream.x_trends(woeid, bearer_token, timeout=30)
+    now = time.time()
+    if response.status_code == 200:
+        fresh_until = now + TTL_SEC
+    elif 400 <= response.status_code < 500:
+        fresh_until = now + _negative_ttl(response, now)
+    else:
+        print(f"X trends returned {response.status_code} for {woeid}, not caching")
+        return {
+            "woeid": woeid,
+            "status_code": response.status_code,
+            "body": response.text,
+            "etag": None,
+            "fetched_at": now,
+            "fresh_until": now,
+            "cacheable": False,
+        }
+
+    entry = {
+        "woeid": woeid,
+        "status_code": response.status_code,
+        "body": response.text,
+        "etag": _etag(response.text),
+        "fetched_at": now,
+        "fresh_until": fresh_until,
+        "cacheable": True,
+    }
+    _memory.set(woeid, entry)
+    _firestore_set(woeid, entry)
+    return entry
+
+
+def _refresh_in_background(woeid, bearer_token):
+    """Start at most one background refresh per WOEID on this instance"""
+    with _refreshing_lock:
+        if woeid in _refreshing:
+            return
+        _refreshing.add(woeid)
+
+    def refresh():
+        try:
+            _fetch(woeid, bearer_token)
+        except Exception as refresh_error:
+            print(f"Background trends refresh failed for {woeid}: {str(refresh_error)}")
+        finally:
+            with _refreshing_lock:
+                _refreshing.discard(woeid)
+
+    concurrency.submit(refresh)
+
+
+def _result(entry, cache_status, now):
+    return {
+        "status_code": entry["status_code"],
+        "body": entry["body"],
+        "etag": entry["etag"],
+        "fetched_at": entry["fetched_at"],
+        "max_age": max(0, int(entry["fresh_until"] - now)) if entry["cacheable"] else 0,
+        "cache": cache_status,
+    }
+
+
+def get_trends(woeid, bearer_token=None):
+    """Return X trends for `woeid`, from cache when possible.
+
+    Returns a dict with the upstream `status_code` and raw `body`, plus
+    `etag`, `fetched_at`, `max_age` (seconds the response stays fresh) and
+    `cache` ("hit", "stale" or "miss"). Raises on network errors when there
+    is nothing cached to fall back to.
+    """
+    woeid = str(woeid)
+    now = time.time()
+    entry = _lookup(woeid)
+
+    if entry is not None:
+        if now < entry["fresh_until"]:
+            return _result(entry, "hit", now)
+        # Only successful responses are worth serving stale
+        if entry["status_code"] == 200 and now < entry["fresh_until"] + STALE_SEC:
+            _refresh_in_background(woeid, bearer_token)
+            return _result(entry, "stale", now)
+
+    try:
+        # A spike of clicks on the same region turns into one X call
+        fetched = singleflight.do(
+            f"x_trends:{woeid}",
+            lambda: _fetch(woeid, bearer_token),
+            encode=dict,
+            decode=dict,
+        )
+    except Exception:
+        if entry is not None and entry["status_code"] == 200:
+            print(f"X trends unreachable for {woeid}, serving the last cached copy")
+            return _result(entry, "stale", now)
+        raise
+
+    if not fetched["cacheable"] and entry is not None and entry["status_code"] == 200:
+        return _result(entry, "stale", now)
+    return _result(fetched, "miss", now)
+
+
+def invalidate(woeid):
+    """Drop a WOEID from the in-memory tier (the Firestore copy expires on its own)"""
+    _memory.pop(str(woeid))
@@ -0,0 +1,443 @@
+"""Pooled, keep-alive HTTP client for the upstream APIs (xAI and X).
+
+Sessions are created once per host and reused for the lifetime of the
+instance, so on a warm instance only the first call to a host pays for the
+TCP + TLS handshake. Only the known upstream hosts (POOLED_HOSTS) get a
+pooled session; any other URL is sent on a connection of its own, so
+arbitrary hosts can't grow the session cache. API keys are resolved once
+and cached here as well.
+
+Configuration (environment variables):
+    UPSTREAM_POOL_SIZE  - max keep-alive connections per host (default 20)
+    UPSTREAM_HTTP2      - "1" to use an HTTP/2 client (requires httpx[http2])
+"""
+import ipaddress
+import json
+import os
+import socket
+import threading
+import time
+from pathlib import Path
+from urllib.parse import urljoin, urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from grokads import llm_cache, metrics, ratelimit, singleflight
+
+XAI_BASE_URL = "https://api.x.ai/v1"
+X_API_BASE_URL = "https://api.x.com/2"
+DEFAULT_CHAT_MODEL = "grok-2-1212"
+
+POOL_SIZE = int(os.getenv("UPSTREAM_POOL_SIZE", "20"))
+HTTP2_ENABLED = os.getenv("UPSTREAM_HTTP2", "").lower() in ("1", "true", "yes")
+
+# Hosts that get a pooled keep-alive session (xAI, X, OpenAI, Cloud Storage);
+# subdomains of x.ai cover the generated-image CDN
+POOLED_HOSTS = ("api.x.ai", "api.x.com", "api.openai.com", "storage.googleapis.com")
+POOLED_DOMAINS = (".x.ai",)
+
+# Legacy `firebase functions:config` locations for each secret
+_LEGACY_CONFIG_KEYS = {
+    "GROK_API_KEY": ("grok", "key"),
+    "X_API_BEARER_TOKEN": ("x_api", "bearer_token"),
+    "OPENAI_API_KEY": ("openai", "key"),
+}
+
+
+class UpstreamError(Exception):
+    """A non-200 response from an upstream API"""
+
+    def __init__(self, status_code, text):
+        super().__init__(f"Upstream error {status_code}: {text}")
+        self.status_code = status_code
+        self.text = text
+
+
+class StoredResponse:
+    """A response rebuilt from its status code and body (e.g. shared by another instance)"""
+
+    def __init__(self, status_code, text):
+        self.status_code = status_code
+        self.text = text
+        self.headers = {}
+
+    def json(self):
+        return json.loads(self.text)
+
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+_secrets = {}
+
+
+def get_secret(name):
+    """Resolve an API key from the environment (or legacy config) and cache it"""
+    if name in _secrets:
+        return _secrets[name]
+
+    value = os.getenv(name)
+
+    if not value:
+        # Try loading .env again (it may have been created after startup)
+        env_path = Path(__file__).resolve().parent.parent.parent / '.env'
+        if env_path.exists():
+            from dotenv import load_dotenv
+            load_dotenv(env_path, override=True)
+            value = os.getenv(name)
+
+    if not value and name in _LEGACY_CONFIG_KEYS:
+        # Fallback: try to get from Firebase config (legacy method)
+        section, key = _LEGACY_CONFIG_KEYS[name]
+        try:
+            from firebase_functions import config
+            cfg = config()
+            value = getattr(getattr(cfg, section), key) if hasattr(cfg, section) else None
+        except Exception:
+            value = None
+
+    # Only cache hits so a key configured later is still picked up
+    if value:
+        _secrets[name] = value
+    return value
+
+
+def _new_session():
+    if HTTP2_ENABLED:
+        try:
+            import httpx
+            return httpx.Client(
+                http2=True,
+                limits=httpx.Limits(max_connections=POOL_SIZE, max_keepalive_connections=POOL_SIZE),
+            )
+        except ImportError:
+            print("UPSTREAM_HTTP2 is set but httpx[http2] is not installed, falling back to HTTP/1.1")
+
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+class _OneOffSession(requests.Session):
+    """Sends every request on a connection of its own, for hosts that aren't pooled"""
+
+    def request(self, method, url, **kwargs):
+        return requests.request(method, url, **kwargs)
+
+
+_one_off = _OneOffSession()
+
+
+def is_pooled_host(host):
+    host = (host or "").lower()
+    return host in POOLED_HOSTS or host.endswith(POOLED_DOMAINS)
+
+
+def get_session(url):
+    """Return the shared session for the scheme+host of `url`
+
+    URLs outside POOLED_HOSTS get a session that doesn't keep connections.
+    """
+    parts = urlsplit(url)
+    if not is_pooled_host(parts.hostname):
+        return _one_off
+    origin = f"{parts.scheme}://{parts.netloc}"
+    session = _sessions.get(origin)
+    if session is None:
+        with _sessions_lock:
+            session = _sessions.get(origin)
+            if session is None:
+                session = _new_session()
+                _sessions[origin] = session
+    return session
+
+
+class _PinnedAdapter(HTTPAdapter):
+    """Connects to one already-checked address instead of resolving the host again
+
+    TLS still uses the URL's host name (SNI and certificate check) and so
+    does the Host header; only the DNS lookup is skipped, so the host can't
+    be re-resolved to another address between the check and the connect.
+    """
+
+    def __init__(self, address):
+        self.address = address
+        super().__init__()
+
+    def _pool(self, url):
+        parts = urlsplit(url)
+        return self.poolmanager.connection_from_host(
+            self.address, parts.port or 443, "https",
+            pool_kwargs={"server_hostname": parts.hostname, "assert_hostname": parts.hostname},
+        )
+
+    def get_connection(self, url, proxies=None):
+        return self._pool(url)
+
+    def get_connection_with_tls_context(self, request, verify, proxies=None, cert=None):
+        return self._pool(request.url)
+
+    def add_headers(self, request, **kwargs):
+        request.headers["Host"] = urlsplit(request.url).netloc.rpartition("@")[2]
+
+
+def _public_address(url):
+    """(error, address): why `url` may not be fetched, or the public address to connect to"""
+    parts = urlsplit(url or "")
+    if parts.scheme != "https" or not parts.hostname:
+        return "must be an https URL", None
+    try:
+        port = parts.port or 443
+        addresses = socket.getaddrinfo(parts.hostname, port, proto=socket.IPPROTO_TCP)
+    except (ValueError, socket.gaierror):
+        return "host does not resolve", None
+    ips = [ipaddress.ip_address(address[4][0].split("%")[0]) for address in addresses]
+    if not ips:
+        return "host does not resolve", None
+    if not all(ip.is_global for ip in ips):
+        return "must not point to a private, loopback or link-local address", None
+    return None, str(ips[0])
+
+
+def public_url_error(url):
+    """Why a client-supplied `url` may not be fetched, or None if it may
+
+    Only https URLs whose host resolves to public addresses are allowed, so
+    clients can't point requests at metadata servers or internal services.
+    """
+    return _public_address(url)[0]
+
+
+def request_public(method, url, max_redirects=5, **kwargs):
+    """Send a one-off (unpooled) request to a client-supplied URL
+
+    Every redirect hop is checked like public_url_error, and the request
+    connects to the address that was checked (_PinnedAdapter). Raises
+    ValueError if a URL isn't allowed.
+    """
+    for _ in range(max_redirects + 1):
+        error, address = _public_address(url)
+        if error:
+            raise ValueError(f"URL {error}")
+        session = requests.Session()
+        # No proxies from the environment: the connection must go to `address`
+        session.trust_env = False
+        session.mount("https://", _PinnedAdapter(address))
+        response = _timed(url, lambda: session.request(method, url, allow_redirects=False, **kwargs))
+        if not kwargs.get("stream"):
+            session.close()
+        if not response.is_redirect:
+            return response
+        response.close()
+        url = urljoin(url, response.headers["Location"])
+        if response.status_code == 303:
+            method = "GET"
+            kwargs.pop("data", None)
+            kwargs.pop("json", None)
+    raise ValueError("Too many redirects")
+
+
+def download_public_chunks(url, timeout=60, chunk_size=1024 * 1024):
+    """download_chunks for a client-supplied URL: filtered like request_public, never pooled
+
+    Raises ValueError if the URL isn't allowed, UpstreamError if the status is not 200.
+    """
+    with request_public("GET", url, timeout=timeout, stream=True) as response:
+        if response.status_code != 200:
+            raise UpstreamError(response.status_code, response.text[:500])
+        yield from response.iter_content(chunk_size)
+
+
+def auth_headers(token):
+    return {
+        "Authorization": f"Bearer {token}",
+        "Content-Type": "application/json"
+    }
+
+
+def _timed(url, send):
+    """Run `send()`, one HTTP call to `url`, and record its latency and status"""
+    started = time.perf_counter()
+    status = "error"
+    try:
+        response = send()
+        status = response.status_code
+        return response
+    finally:
+        metrics.observe_upstream(urlsplit(url).netloc, status, time.perf_counter() - started)
+
+
+def get(url, headers=None, timeout=30, params=None):
+    return _timed(url, lambda: get_session(url).get(url, headers=headers, params=params, timeout=timeout))
+
+
+def download_chunks(url, headers=None, timeout=60, chunk_size=1024 * 1024):
+    """Stream a GET response body in chunks, without holding it in memory
+
+    Raises UpstreamError if the response status is not 200.
+    """
+    session = get_session(url)
+    started = time.perf_counter()
+    status = "error"
+    try:
+        if isinstance(session, requests.Session):
+            with session.get(url, headers=headers, timeout=timeout, stream=True) as response:
+                status = response.status_code
+                if response.status_code != 200:
+                    raise UpstreamError(response.status_code, response.text[:500])
+                yield from response.iter_content(chunk_size)
+        else:
+            with session.stream("GET", url, headers=headers, timeout=timeout) as response:
+                status = response.status_code
+                if response.status_code != 200:
+                    response.read()
+                    raise UpstreamError(response.status_code, response.text[:500])
+                yield from response.iter_bytes(chunk_size)
+    finally:
+        # Includes the time spent streaming the body
+        metrics.observe_upstream(urlsplit(url).netloc, status, time.perf_counter() - started)
+
+
+def post_json(url, payload, headers=None, timeout=60):
+    return _timed(url, lambda: get_session(url).post(url, headers=headers, json=payload, timeout=timeout))
+
+
+def chat_payload(prompt, temperature, max_tokens, model=DEFAULT_CHAT_MODEL, json_mode=True):
+    """Build a chat-completions request body for a single user prompt"""
+    payload = {
+        "messages": [{"role": "user", "content": prompt}],
+        "model": model,
+        "temperature": temperature,
+        "max_tokens": max_tokens,
+    }
+    if json_mode:
+        payload["response_format"] = {"type": "json_object"}
+    return payload
+
+
+def grok_chat(prompt, temperature, max_tokens, timeout=60, model=DEFAULT_CHAT_MODEL, json_mode=True, api_key=None,
+              cache=None, bypass_cache=False, coalesce=None):
+    """POST a single-prompt chat completion to xAI and return the raw response
+
+    With `cache` set to a policy name from grokads.llm_cache, identical
+    requests are answered from the completion cache. Identical requests
+    that are in flight at the same time share one upstream call
+    (`coalesce`, on by default for cached policies).
+    """
+    payload = chat_payload(prompt, temperature, max_tokens, model=model, json_mode=json_mode)
+    if cache:
+        cached = llm_cache.lookup(cache, payload, bypass=bypass_cache)
+        if cached is not None:
+            return cached
+
+    api_key = api_key or get_secret("GROK_API_KEY")
+
+    def send():
+        response = ratelimit.get_limiter("xai").call(lambda: post_json(
+            f"{XAI_BASE_URL}/chat/completions",
+            payload,
+            headers=auth_headers(api_key),
+            timeout=timeout,
+        ))
+        if response.status_code == 200:
+            try:
+                metrics.record_usage(response.json().get("usage"), model)
+            except ValueError:
+                pass
+        if cache:
+            llm_cache.store(cache, payload, response)
+        return response
+
+    if coalesce if coalesce is not None else bool(cache):
+        return singleflight.do(
+            f"grok_chat:{llm_cache.cache_key(payload)}",
+            send,
+            encode=lambda response: {"status_code": response.status_code, "text": response.text},
+            decode=lambda stored: StoredResponse(stored["status_code"], stored["text"]),
+        )
+    return send()
+
+
+def grok_chat_stream(prompt, temperature, max_tokens, timeout=60, model=DEFAULT_CHAT_MODEL, json_mode=True, api_key=None):
+    """Stream a single-prompt chat completion, yielding content deltas as they arrive
+
+    Raises UpstreamError if xAI answers with a non-200 status.
+    """
+    api_key = api_key or get_secret("GROK_API_KEY")
+    url = f"{XAI_BASE_URL}/chat/completions"
+    payload = chat_payload(prompt, temperature, max_tokens, model=model, json_mode=json_mode)
+    payload["stream"] = True
+    session = get_session(url)
+    started = None
+    status = "error"
+
+    # A partly consumed stream can't be replayed, so streams are rate limited but not retried
+    try:
+        with ratelimit.get_limiter("xai").slot() as slot:
+            started = time.perf_counter()
+            if isinstance(session, requests.Session):
+                with session.post(url, headers=auth_headers(api_key), json=payload, timeout=timeout, stream=True) as response:
+                    status = response.status_code
+                    if response.status_code != 200:
+                        slot.overloaded = response.status_code in (429, 503)
+                        raise UpstreamError(response.status_code, response.text)
+                    yield from _sse_deltas(response.iter_lines(decode_unicode=True), model)
+            else:
+                with session.stream("POST", url, headers=auth_headers(api_key), json=payload, timeout=timeout) as response:
+                    status = response.status_code
+                    if response.status_code != 200:
+                        response.read()
+                        slot.overloaded = response.status_code in (429, 503)
+                        raise UpstreamError(response.status_code, response.text)
+                    yield from _sse_deltas(response.iter_lines(), model)
+    except ratelimit.RateLimited as limited:
+        raise UpstreamError(429, str(limited))
+    finally:
+        if started is not None:
+            metrics.observe_upstream(urlsplit(url).netloc, status, time.perf_counter() - started)
+
+
+def _sse_deltas(lines, model=DEFAULT_CHAT_MODEL):
+    """Turn chat-completions SSE lines into content deltas
+
+    Chunks may carry a running `usage` block; the last one is recorded.
+    """
+    usage = None
+    try:
+        for line in lines:
+            if not line or not line.startswith("data:"):
+                continue
+            data = line[len("data:"):].strip()
+            if data == "[DONE]":
+                return
+            try:
+                chunk = json.loads(data)
+            except ValueError:
+                continue
+            usage = chunk.get("usage") or usage
+            choices = chunk.get("choices") or [{}]
+            delta = choices[0].get("delta", {}).get("content")
+            if delta:
+                yield delta
+    finally:
+        metrics.record_usage(usage, model)
+
+
+def chat_content(response):
+    """Extract the assistant message text from a chat-completions response"""
+    data = response.json()
+    return data.get("choices", [{}])[0].get("message", {}).get("content", "{}")
+
+
+def xai_images(payload, api_key=None, timeout=60):
+    api_key = api_key or get_secret("GROK_API_KEY")
+    return ratelimit.get_limiter("xai_images").call(
+        lambda: post_json(f"{XAI_BASE_URL}/images/generations", payload, headers=auth_headers(api_key), timeout=timeout)
+    )
+
+
+def x_trends(woeid, bearer_token=None, timeout=30):
+    bearer_token = bearer_token or get_secret("X_API_BEARER_TOKEN")
+    return get(f"{X_API_BASE_URL}/trends/by/woeid/{woeid}", headers=auth_headers(bearer_token), timeout=timeout)
@@ -0,0 +1,230 @@
+"""Sharded, parallel generation of ad variants.
+
+Asking for N variants in one completion makes latency grow with N (one long
+sequential decode) and, for large N, truncates the JSON so the whole answer
+is lost. Instead the request is split into shards of a few variants each,
+every shard gets its own creative angle so they don't repeat each other, the
+shards run concurrently, and only failed shards are asked again.
+
+Each shard's max_tokens comes from grokads.token_budget for the variant
+count it asks for, and shards are made smaller if the budget planner says
+SHARD_SIZE variants wouldn't fit under its ceiling.
+
+Configuration (environment variables):
+    VARIANT_SHARD_SIZE      - variants per shard (default 5, capped by grokads.token_budget)
+    VARIANT_SHARD_ATTEMPTS  - attempts per shard, including the first (default 2)
+"""
+import json
+import os
+import queue
+
+from grokads import concurrency, token_budget, upstream
+from grokads.jsonstream import ArrayItemParser
+
+SHARD_SIZE = int(os.getenv("VARIANT_SHARD_SIZE", "5"))
+SHARD_ATTEMPTS = int(os.getenv("VARIANT_SHARD_ATTEMPTS", "2"))
+
+# One per shard, so concurrent shards explore different directions
+ANGLE_HINTS = [
+    "problem-solution: lead with the pain point the product removes",
+    "social proof: testimonials, popularity and community",
+    "aspirational: the lifestyle or identity the product enables",
+    "urgency and scarcity: limited time, limited stock, act now",
+    "humor: playful, witty and memorable",
+    "emotional storytelling: a short narrative with a human moment",
+    "rational: concrete numbers, features and value for money",
+    "contrarian: challenge a common belief in the category",
+    "curiosity: open a loop the viewer wants to close",
+    "FOMO: what the audience misses out on without it",
+]
+
+
+def split_into_shards(num_variants, shard_size=None, budget=None):
+    """Split a variant count into shard sizes, e.g. 12 -> [5, 5, 2]
+
+    With a token `budget` profile, shards never exceed what one call can produce.
+    """
+    shard_size = max(1, shard_size or SHARD_SIZE)
+    if budget:
+        shard_size = min(shard_size, token_budget.max_items(budget))
+    shards = [shard_size] * (num_variants // shard_size)
+    if num_variants % shard_size:
+        shards.append(num_variants % shard_size)
+    return shards
+
+
+def parse_variants(content):
+    """Extract the variants list from a completion ([] if nothing can be parsed)
+
+    A completion cut off by its token limit isn't valid JSON; the variants
+    it finished before the cut are still returned.
+    """
+    try:
+        variants_json = json.loads(content)
+    except ValueError:
+        return ArrayItemParser("variants").feed(content)
+    if isinstance(variants_json, dict) and isinstance(variants_json.get("variants"), list):
+        return [v for v in variants_json["variants"] if isinstance(v, dict)]
+    if isinstance(variants_json, list):
+        return [v for v in variants_json if isinstance(v, dict)]
+    return []
+
+
+def _run_shard(build_prompt, count, angle_hint, temperature, budget, timeout, api_key):
+    """One completion for one shard; returns (variants, error)"""
+    response = upstream.grok_chat(
+        build_prompt(count, angle_hint),
+        temperature=temperature,
+        max_tokens=token_budget.plan(budget, count),
+        timeout=timeout,
+        api_key=api_key
+    )
+    token_budget.observe(budget, response, count)
+    if response.status_code != 200:
+        return [], {"status_code": response.status_code, "text": response.text}
+    variants = parse_variants(upstream.chat_content(response))
+    if not variants:
+        return [], {"status_code": 200, "text": "Unparseable or empty variants JSON"}
+    return variants[:count], None
+
+
+def generate_variants_sharded(build_prompt, num_variants, temperature, budget,
+                              timeout, api_key, shard_size=None):
+    """Generate `num_variants` variants with concurrent shards.
+
+    `build_prompt(count, angle_hint)` returns the prompt for one shard;
+    `angle_hint` is None when the request fits in a single shard. `budget`
+    is the grokads.token_budget profile of one variant.
+
+    Returns a dict with:
+        variants - merged variants in shard order, renumbered via `variant_id`
+        missing  - how many variants could not be generated after retries
+        error    - the last upstream error ({"status_code", "text"}) or None
+    """
+    shard_sizes = split_into_shards(num_variants, shard_size, budget)
+    single_shard = len(shard_sizes) == 1
+
+    def hint(index):
+        return None if single_shard else ANGLE_HINTS[index % len(ANGLE_HINTS)]
+
+    results = [[] for _ in shard_sizes]
+    pending = list(range(len(shard_sizes)))
+    last_error = None
+
+    for attempt in range(max(1, SHARD_ATTEMPTS)):
+        if not pending:
+            break
+        futures = {}
+        for index in pending:
+            needed = shard_sizes[index] - len(results[index])
+            futures[index] = concurrency.submit(
+                _run_shard, build_prompt, needed, hint(index), temperature, budget, timeout, api_key
+            )
+
+        still_pending = []
+        for index, future in futures.items():
+            try:
+                variants, error = future.result(timeout=timeout + 5)
+            except Exception as shard_error:
+                variants, error = [], {"status_code": 500, "text": str(shard_error)}
+            # Keep whatever a short shard produced and only ask for the rest
+            results[index].extend(variants)
+            if error:
+                last_error = error
+            if len(results[index]) < shard_sizes[index]:
+                still_pending.append(index)
+
+        if still_pending:
+            print(f"Variant shards {still_pending} incomplete after attempt {attempt + 1}")
+        pending = still_pending
+
+    merged = [variant for shard in results for variant in shard]
+    for i, variant in enumerate(merged):
+        variant["variant_id"] = i + 1
+
+    return {
+        "variants": merged,
+        "missing": num_variants - len(merged),
+        "error": last_error,
+    }
+
+
+def _stream_shard(build_prompt, count, angle_hint, temperature, max_tokens, timeout, api_key, events):
+    """Stream one shard, putting each variant on `events` as soon as it is complete"""
+    parser = ArrayItemParser("variants")
+    received = []
+    emitted = 0
+    try:
+        for delta in upstream.grok_chat_stream(
+            build_prompt(count, angle_hint),
+            temperature=temperature,
+            max_tokens=max_tokens,
+            timeout=timeout,
+            api_key=api_key
+        ):
+            received.append(delta)
+            for variant in parser.feed(delta):
+                if emitted < count:
+                    events.put(("variant", variant))
+                    emitted += 1
+
+        # The model answered in an unexpected shape: fall back to a full parse
+        if emitted == 0:
+            for variant in parse_variants("".join(received))[:count]:
+                events.put(("variant", variant))
+                emitted += 1
+
+        events.put(("shard_done", None if emitted else {"status_code": 200, "text": "Unparseable or empty variants JSON"}))
+    except upstream.UpstreamError as stream_error:
+        events.put(("shard_done", {"status_code": stream_error.status_code, "text": stream_error.text}))
+    except Exception as stream_error:
+        events.put(("shard_done", {"status_code": 500, "text": str(stream_error)}))
+
+
+def stream_variants_sharded(build_prompt, num_variants, temperature, budget,
+                            timeout, api_key, shard_size=None):
+    """Streaming counterpart of generate_variants_sharded.
+
+    All shards stream concurrently and every variant is yielded the moment
+    its JSON object closes, so the first one arrives after roughly one
+    variant's worth of tokens. Yields events:
+
+        {"type": "variant", "variant": {...}}   (variant_id in arrival order)
+        {"type": "done", "count": n, "missing": m, "error": {...} | None}
+    """
+    shard_sizes = split_into_shards(num_variants, shard_size, budget)
+    single_shard = len(shard_sizes) == 1
+    events = queue.Queue()
+
+    for index, count in enumerate(shard_sizes):
+        concurrency.submit(
+            _stream_shard,
+            build_prompt,
+            count,
+            None if single_shard else ANGLE_HINTS[index % len(ANGLE_HINTS)],
+            temperature,
+            token_budget.plan(budget, count),
+            timeout,
+            api_key,
+            events
+        )
+
+    emitted = 0
+    shards_done = 0
+    last_error = None
+    while shards_done < len(shard_sizes):
+        try:
+            kind, payload = events.get(timeout=timeout + 5)
+        except queue.Empty:
+            last_error = {"status_code": 504, "text": "Timed out waiting for variant shards"}
+            break
+        if kind == "variant":
+            emitted += 1
+            payload["variant_id"] = emitted
+            yield {"type": "variant", "variant": payload}
+        else:
+            shards_done += 1
+            if payload:
+                last_error = payload
+
+    yield {"type": "done", "count": emitted, "missing": num_variants - emitted, "error": last_error}
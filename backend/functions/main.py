@@ -1,25 +1,24 @@
-from firebase_functions import https_fn
+from firebase_functions import https_fn, scheduler_fn
 from firebase_functions.options import CorsOptions, set_global_options
-from firebase_admin import initialize_app
-import requests
+import hmac
 import json
-import os
 import time
-import base64
-import asyncio
-import tempfile
 from pathlib import Path
-from dotenv import load_dotenv
-from openai import OpenAI, AsyncOpenAI
-from moviepy import VideoFileClip, TextClip, CompositeVideoClip
 
-# Load environment variables from .env file
+from grokads import assets, campaigns, concurrency, images, jobs, llm_cache, metrics, predictions, storage, streaming, token_budget, trend_suggestions, trends, upstream
+from grokads.suggestions import SUGGESTIONS_GRACE_SEC, generate_suggestions
+from grokads.variants import generate_variants_sharded, stream_variants_sharded
+
+# Only lightweight JSON endpoints live in this codebase. The video endpoints
+# (generate_ad, add_text_overlay) are deployed from ../video so that their
+# MoviePy/numpy/OpenAI dependencies never load here.
+
+# Load environment variables from .env file (local development only)
 env_path = Path(__file__).parent.parent / '.env'
 if env_path.exists():
+    from dotenv import load_dotenv
     load_dotenv(env_path)
     print(f"✅ Loaded .env file from {env_path}")
-else:
-    load_dotenv()
 
 # For cost control, you can set the maximum number of containers that can be
 # running at the same time. This helps mitigate the impact of unexpected
@@ -28,242 +27,6 @@ else:
 # parameter in the decorator, e.g. @https_fn.on_request(max_instances=5).
 set_global_options(max_instances=10)
 
-initialize_app()
-
-
-@https_fn.on_request(
-    cors=CorsOptions(
-        cors_origins=["http://localhost:3000", "https://*.web.app", "https://*.firebaseapp.com"],
-        cors_methods=["GET", "POST"]
-    ),
-    timeout_sec=300  # 5 minutes timeout
-)
-def generate_ad(req: https_fn.Request) -> https_fn.Response:
-    """Generate an ad using LLM based on user prompt"""
-    
-    if req.method == "OPTIONS":
-        return https_fn.Response("", status=204)
-    
-    if req.method != "POST":
-        return https_fn.Response(
-            json.dumps({"error": "Method not allowed"}),
-            status=405,
-            headers={"Content-Type": "application/json"}
-        )
-    
-    try:
-        data = req.get_json(silent=True)
-        if not data or "prompt" not in data:
-            return https_fn.Response(
-                json.dumps({"error": "Missing 'prompt' in request body"}),
-                status=400,
-                headers={"Content-Type": "application/json"}
-            )
-        
-        user_prompt = data["prompt"]
-        
-        # Get OpenAI API key from environment variable
-        # Set this with: firebase functions:secrets:set OPENAI_API_KEY
-        openai_api_key = os.getenv("OPENAI_API_KEY")
-        
-        if not openai_api_key:
-            # Fallback: try to get from Firebase config (legacy method)
-            try:
-                from firebase_functions import config
-                openai_api_key = config().openai.key if hasattr(config(), 'openai') else None
-            except:
-                pass
-        
-        if not openai_api_key:
-            return https_fn.Response(
-                json.dumps({"error": "OpenAI API key not configured. Please set OPENAI_API_KEY environment variable."}),
-                status=500,
-                headers={"Content-Type": "application/json"}
-            )
-        
-        # Initialize OpenAI client (async for polling)
-        async_client = AsyncOpenAI(api_key=openai_api_key)
-        sync_client = OpenAI(api_key=openai_api_key)
-        
-        # Async function to create and poll video with progress logging
-        async def create_and_poll_video():
-            print(f"Starting video generation with prompt: {user_prompt}")
-            
-            # Create video
-            video = await async_client.videos.create(
-                model="sora-2",
-                prompt=user_prompt,
-                seconds='4',
-            )
-            
-            print(f"Video creation started. Video ID: {video.id if hasattr(video, 'id') else 'N/A'}")
-            print(f"Initial status: {video.status if hasattr(video, 'status') else 'N/A'}")
-            
-            # Poll for completion with progress logging
-            bar_length = 30
-            
-            while video.status in ("in_progress", "queued"):
-                # Get progress if available
-                progress = getattr(video, "progress", 0)
-                
-                # Create progress bar
-                filled_length = int((progress / 100) * bar_length) if progress > 0 else 0
-                bar = "=" * filled_length + "-" * (bar_length - filled_length)
-                status_text = "Queued" if video.status == "queued" else "Processing"
-                
-                # Log progress
-                if progress > 0:
-                    print(f"{status_text}: [{bar}] {progress:.1f}%")
-                else:
-                    print(f"{status_text}: [{bar}] Status: {video.status}")
-                
-                # Wait before next poll
-                await asyncio.sleep(2)
-                
-                # Refresh status
-                video = await async_client.videos.retrieve(video.id)
-            
-            # Final status log
-            progress = getattr(video, "progress", 100 if video.status == "completed" else 0)
-            print(f"Final status: {video.status}, Progress: {progress}%")
-            
-            return video
-        
-        # Call Sora API to generate video
-        try:
-            # Run async function
-            video = asyncio.run(create_and_poll_video())
-            
-            print(f"Video generation completed. Status: {video.status}")
-            print(f"Video ID: {video.id if hasattr(video, 'id') else 'N/A'}")
-            
-            # Check if video generation failed
-            if video.status == "failed":
-                error_message = "Video generation failed"
-                if hasattr(video, 'error') and video.error:
-                    if hasattr(video.error, 'message'):
-                        error_message = video.error.message
-                print(f"Video generation failed: {error_message}")
-                return https_fn.Response(
-                    json.dumps({"error": error_message}),
-                    status=500,
-                    headers={"Content-Type": "application/json"}
-                )
-            
-            # Download video content
-            if video.status == "completed":
-                try:
-                    print("Downloading video content...")
-                    # Download the video content using sync client
-                    video_content = sync_client.videos.download_content(video.id, variant="video")
-                    
-                    # Read video content as bytes
-                    video_bytes = video_content.read()
-                    print(f"Video downloaded. Size: {len(video_bytes)} bytes")
-                    
-                    # Encode to base64 for JSON transmission
-                    video_base64 = base64.b64encode(video_bytes).decode('utf-8')
-                    print("Video encoded to base64")
-                    
-                    # Generate AI suggestions for text overlay, caption, and hashtags
-                    suggestions = {}
-                    grok_api_key = os.getenv("GROK_API_KEY")
-                    if grok_api_key:
-                        try:
-                            suggestions_prompt = f"""Based on this video ad prompt: "{user_prompt}"
-
-Generate:
-1. A short, punchy text overlay (3-5 words max) that would work well overlaid on the video
-2. A compelling social media caption (1-2 sentences) for posting this video
-3. 5-10 relevant hashtags (without # symbol, just the words)
-
-Format as JSON:
-{{
-  "text_overlay": "short punchy text",
-  "caption": "compelling caption text",
-  "hashtags": ["hashtag1", "hashtag2", "hashtag3"]
-}}"""
-
-                            suggestions_response = requests.post(
-                                "https://api.x.ai/v1/chat/completions",
-                                headers={
-                                    "Authorization": f"Bearer {grok_api_key}",
-                                    "Content-Type": "application/json"
-                                },
-                                json={
-                                    "messages": [{"role": "user", "content": suggestions_prompt}],
-                                    "model": "grok-2-1212",
-                                    "temperature": 0.8,
-                                    "max_tokens": 500,
-                                    "response_format": {"type": "json_object"}
-                                },
-                                timeout=30
-                            )
-                            
-                            if suggestions_response.status_code == 200:
-                                suggestions_data = suggestions_response.json()
-                                suggestions_content = suggestions_data.get("choices", [{}])[0].get("message", {}).get("content", "{}")
-                                try:
-                                    suggestions = json.loads(suggestions_content)
-                                except:
-                                    pass
-                        except Exception as suggestions_error:
-                            print(f"Failed to generate suggestions: {str(suggestions_error)}")
-                    
-                    # Convert video object to dictionary for JSON serialization
-                    video_data = {
-                        "id": video.id if hasattr(video, 'id') else None,
-                        "status": video.status if hasattr(video, 'status') else None,
-                        "video_url": video.video_url if hasattr(video, 'video_url') else None,
-                        "prompt": user_prompt,
-                        "video_base64": video_base64,
-                        "mime_type": "video/mp4",
-                        "suggestions": suggestions
-                    }
-                    
-                    print("Video generation completed successfully")
-                    return https_fn.Response(
-                        json.dumps({
-                            "video": video_data,
-                            "message": "Video generation completed successfully"
-                        }),
-                        status=200,
-                        headers={"Content-Type": "application/json"}
-                    )
-                except Exception as download_error:
-                    print(f"Failed to download video: {str(download_error)}")
-                    return https_fn.Response(
-                        json.dumps({"error": f"Failed to download video: {str(download_error)}"}),
-                        status=500,
-                        headers={"Content-Type": "application/json"}
-                    )
-            else:
-                # Unexpected status
-                print(f"Unexpected video status: {video.status}")
-                return https_fn.Response(
-                    json.dumps({
-                        "error": f"Unexpected video status: {video.status}",
-                        "video_id": video.id if hasattr(video, 'id') else None
-                    }),
-                    status=500,
-                    headers={"Content-Type": "application/json"}
-                )
-            
-        except Exception as api_error:
-            print(f"Sora API error: {str(api_error)}")
-            return https_fn.Response(
-                json.dumps({"error": f"Sora API error: {str(api_error)}"}),
-                status=500,
-                headers={"Content-Type": "application/json"}
-            )
-        
-    except Exception as e:
-        return https_fn.Response(
-            json.dumps({"error": f"Internal server error: {str(e)}"}),
-            status=500,
-            headers={"Content-Type": "application/json"}
-        )
-
 
 @https_fn.on_request(
     cors=CorsOptions(
@@ -271,6 +34,7 @@ Format as JSON:
         cors_methods=["GET", "POST"]
     )
 )
+@metrics.instrument
 def get_trend_ad_suggestions(req: https_fn.Request) -> https_fn.Response:
     """Generate AI ad suggestions for a specific trend"""
     
@@ -294,15 +58,20 @@ def get_trend_ad_suggestions(req: https_fn.Request) -> https_fn.Response:
             )
         
         trend_name = data["trend"]
+        bypass_cache = llm_cache.bypass_requested(req)
+        
+        # Top trends are prefetched on a schedule; serve those without a Grok call
+        # unless the client asked to bypass the cache
+        prompts = None if bypass_cache else trend_suggestions.get_precomputed(trend_name)
+        if prompts is not None:
+            return https_fn.Response(
+                json.dumps({"prompts": prompts, "precomputed": True}),
+                status=200,
+                headers={"Content-Type": "application/json"}
+            )
         
         # Get API key
-        api_key = os.getenv("GROK_API_KEY")
-        if not api_key:
-            try:
-                from firebase_functions import config
-                api_key = config().grok.key if hasattr(config(), 'grok') else None
-            except:
-                pass
+        api_key = upstream.get_secret("GROK_API_KEY")
         
         if not api_key:
             return https_fn.Response(
@@ -312,68 +81,24 @@ def get_trend_ad_suggestions(req: https_fn.Request) -> https_fn.Response:
             )
         
         # Generate image and video prompts using Grok
-        prompt = f"""For the trending topic: "{trend_name}", generate:
-
-1. A detailed image generation prompt (for creating an advertisement image, 1-2 sentences, focus on visual elements)
-2. A detailed video generation prompt (for creating a short advertisement video, 1-2 sentences, focus on dynamic visual elements and narrative)
-
-Format as JSON object:
-{{
-  "image_prompt": "detailed image generation prompt",
-  "video_prompt": "detailed video generation prompt"
-}}
-
-Be creative and make the prompts relevant to the trending topic and suitable for advertising."""
-
-        headers = {
-            "Authorization": f"Bearer {api_key}",
-            "Content-Type": "application/json"
-        }
-        
-        payload = {
-            "messages": [
-                {
-                    "role": "user",
-                    "content": prompt
-                }
-            ],
-            "model": "grok-2-1212",
-            "temperature": 0.8,
-            "max_tokens": 500,
-            "response_format": {"type": "json_object"}
-        }
-        
-        response = requests.post(
-            "https://api.x.ai/v1/chat/completions",
-            headers=headers,
-            json=payload,
-            timeout=30
-        )
-        
-        if response.status_code != 200:
+        try:
+            prompts = trend_suggestions.generate_prompts(trend_name, api_key=api_key, bypass_cache=bypass_cache)
+        except upstream.UpstreamError as grok_error:
             return https_fn.Response(
-                json.dumps({"error": f"Grok API error: {response.text}"}),
-                status=response.status_code,
+                json.dumps({"error": f"Grok API error: {grok_error.text}"}),
+                status=grok_error.status_code,
                 headers={"Content-Type": "application/json"}
             )
         
-        result = response.json()
-        content = result.get("choices", [{}])[0].get("message", {}).get("content", "{}")
-        
-        # Parse JSON response
-        try:
-            prompts = json.loads(content)
-            if "image_prompt" not in prompts or "video_prompt" not in prompts:
-                raise ValueError("Missing prompts")
-        except:
+        if prompts is not None:
+            trend_suggestions.store_in_background(trend_name, prompts)
+        else:
             # Fallback prompts
-            prompts = {
-                "image_prompt": f"Create an engaging advertisement image for {trend_name}, featuring modern design, vibrant colors, and compelling visual elements that capture attention",
-                "video_prompt": f"Create a short, dynamic advertisement video for {trend_name}, with smooth transitions, engaging visuals, and a clear narrative that connects with viewers"
-            }
+            metrics.record_fallback("trend_suggestions")
+            prompts = trend_suggestions.fallback_prompts(trend_name)
         
         return https_fn.Response(
-            json.dumps({"prompts": prompts}),
+            json.dumps({"prompts": prompts, "precomputed": False}),
             status=200,
             headers={"Content-Type": "application/json"}
         )
@@ -386,12 +111,21 @@ Be creative and make the prompts relevant to the trending topic and suitable for
         )
 
 
+@scheduler_fn.on_schedule(schedule="every 15 minutes", timeout_sec=300)
+@metrics.instrument
+def prefetch_trend_suggestions(event: scheduler_fn.ScheduledEvent) -> None:
+    """Precompute ad suggestions for the current top trends (see grokads.trend_suggestions)"""
+    summary = trend_suggestions.prefetch()
+    print(f"Trend suggestion prefetch: {json.dumps(summary)}")
+
+
 @https_fn.on_request(
     cors=CorsOptions(
         cors_origins=["http://localhost:3000", "https://*.web.app", "https://*.firebaseapp.com"],
         cors_methods=["GET", "POST"]
     )
 )
+@metrics.instrument
 def get_trends(req: https_fn.Request) -> https_fn.Response:
     """Get trending topics from X (Twitter) API"""
     
@@ -408,15 +142,7 @@ def get_trends(req: https_fn.Request) -> https_fn.Response:
     try:
         # Get API credentials from environment variables
         # You need: X_API_BEARER_TOKEN (for v2)
-        bearer_token = os.environ.get("X_API_BEARER_TOKEN")
-        
-        if not bearer_token:
-            # Fallback: try to get from Firebase config (legacy method)
-            try:
-                from firebase_functions import config
-                bearer_token = config().x_api.bearer_token if hasattr(config(), 'x_api') else None
-            except:
-                pass
+        bearer_token = upstream.get_secret("X_API_BEARER_TOKEN")
         
         if not bearer_token:
             return https_fn.Response(
@@ -435,24 +161,27 @@ def get_trends(req: https_fn.Request) -> https_fn.Response:
         
         # X API v2 trends endpoint
         # Documentation: https://developer.x.com/en/docs/x-api/tweets/trends/api-reference/get-trends-by-woeid
-        url = f"https://api.x.com/2/trends/by/woeid/{woeid}"
-        
-        headers = {
-            "Authorization": f"Bearer {bearer_token}",
-            "Content-Type": "application/json"
-        }
-        
-        response = requests.get(
-            url,
-            headers=headers,
-            timeout=30
-        )
-        
-        if response.status_code == 401:
+        # Served from the trends cache (memory + Firestore, stale-while-revalidate)
+        cached = trends.get_trends(woeid, bearer_token)
+        
+        cache_headers = {"X-Cache": cached["cache"]}
+        if cached["status_code"] == 200:
+            cache_headers["ETag"] = cached["etag"]
+            cache_headers["Cache-Control"] = f"public, max-age={cached['max_age']}, stale-while-revalidate={trends.STALE_SEC}"
+        elif cached["max_age"]:
+            cache_headers["Cache-Control"] = f"public, max-age={cached['max_age']}"
+        else:
+            cache_headers["Cache-Control"] = "no-store"
+        
+        # Let browsers and CDNs revalidate without downloading the trends again
+        if cached["status_code"] == 200 and storage.etag_matches(req.headers.get("If-None-Match"), cached["etag"]):
+            return https_fn.Response("", status=304, headers=cache_headers)
+        
+        if cached["status_code"] == 401:
             return https_fn.Response(
                 json.dumps({
                     "error": "X API authentication failed (401 Unauthorized)",
-                    "details": response.text,
+                    "details": cached["body"],
                     "troubleshooting": [
                         "1. Verify your Bearer Token is correct in the X Developer Portal",
                         "2. Make sure the token hasn't been regenerated (regenerating invalidates old tokens)",
@@ -463,21 +192,21 @@ def get_trends(req: https_fn.Request) -> https_fn.Response:
                     ]
                 }),
                 status=401,
-                headers={"Content-Type": "application/json"}
+                headers={"Content-Type": "application/json", **cache_headers}
             )
         
-        if response.status_code != 200:
+        if cached["status_code"] != 200:
             return https_fn.Response(
                 json.dumps({
-                    "error": f"X API error: {response.text}",
-                    "status_code": response.status_code,
+                    "error": f"X API error: {cached['body']}",
+                    "status_code": cached["status_code"],
                     "note": "Make sure you have X API v2 access and a valid Bearer token."
                 }),
-                status=response.status_code,
-                headers={"Content-Type": "application/json"}
+                status=cached["status_code"],
+                headers={"Content-Type": "application/json", **cache_headers}
             )
         
-        trends_data = response.json()
+        trends_data = json.loads(cached["body"])
         
         # Parse trends from X API v2 response
         # Response format: {"data": [{"trend_name": "...", "tweet_count": ...}]}
@@ -509,7 +238,7 @@ def get_trends(req: https_fn.Request) -> https_fn.Response:
         return https_fn.Response(
             json.dumps({"trends": formatted_trends}),
             status=200,
-            headers={"Content-Type": "application/json"}
+            headers={"Content-Type": "application/json", **cache_headers}
         )
         
     except Exception as e:
@@ -526,6 +255,7 @@ def get_trends(req: https_fn.Request) -> https_fn.Response:
         cors_methods=["GET", "POST"]
     )
 )
+@metrics.instrument
 def generate_image(req: https_fn.Request) -> https_fn.Response:
     """Generate an image using xAI Image Generation API"""
     
@@ -554,23 +284,18 @@ def generate_image(req: https_fn.Request) -> https_fn.Response:
         n = data.get("n", 1)  # Number of images (1-10)
         response_format = data.get("response_format", "url")  # url or b64_json
         
-        # Get API key from environment variable
-        api_key = os.getenv("GROK_API_KEY")
-        
-        if not api_key:
-            # Try loading .env again
-            env_path = Path(__file__).parent.parent / '.env'
-            if env_path.exists():
-                load_dotenv(env_path, override=True)
-            api_key = os.getenv("GROK_API_KEY")
+        # Optional thumbnails / WebP / AVIF renditions, returned as references
+        try:
+            postprocess = images.build_options(data.get("postprocess"))
+        except ValueError as e:
+            return https_fn.Response(
+                json.dumps({"error": str(e)}),
+                status=400,
+                headers={"Content-Type": "application/json"}
+            )
         
-        if not api_key:
-            # Fallback: try to get from Firebase config (legacy method)
-            try:
-                from firebase_functions import config
-                api_key = config().grok.key if hasattr(config(), 'grok') else None
-            except:
-                pass
+        # Get API key from environment variable (or legacy Firebase config)
+        api_key = upstream.get_secret("GROK_API_KEY")
         
         if not api_key:
             return https_fn.Response(
@@ -580,13 +305,6 @@ def generate_image(req: https_fn.Request) -> https_fn.Response:
             )
         
         # Call xAI Image Generation API
-        url = "https://api.x.ai/v1/images/generations"
-        
-        headers = {
-            "Authorization": f"Bearer {api_key}",
-            "Content-Type": "application/json"
-        }
-        
         payload = {
             "prompt": user_prompt,
             "model": model,
@@ -595,14 +313,13 @@ def generate_image(req: https_fn.Request) -> https_fn.Response:
             "response_format": response_format
         }
         
-        response = requests.post(
-            url,
-            headers=headers,
-            json=payload,
-            timeout=60
-        )
+        # Suggestions depend only on the prompt: start them alongside the image
+        suggestions_future = concurrency.submit(generate_suggestions, user_prompt, "image")
+        
+        response = upstream.xai_images(payload, api_key, timeout=60)
         
         if response.status_code != 200:
+            suggestions_future.cancel()
             return https_fn.Response(
                 json.dumps({
                     "error": f"xAI Image API error: {response.text}",
@@ -614,49 +331,19 @@ def generate_image(req: https_fn.Request) -> https_fn.Response:
         
         result = response.json()
         
-        # Generate AI suggestions for overlay text, caption, and hashtags
+        if postprocess and result.get("data"):
+            # Runs while the suggestions future is still in flight
+            result["data"] = images.process_images(result["data"], postprocess, user_prompt)
+        
+        # Suggestions were generated concurrently with the image; a slow or
+        # failed suggestion call only leaves them empty
         suggestions = {}
-        if api_key and result.get("data") and len(result.get("data", [])) > 0:
-            try:
-                suggestions_prompt = f"""Based on this image ad prompt: "{user_prompt}"
-
-Generate:
-1. A short, punchy text overlay (3-5 words max) that would work well overlaid on the image
-2. A compelling social media caption (1-2 sentences) for posting this image
-3. 5-10 relevant hashtags (without # symbol, just the words)
-
-Format as JSON:
-{{
-  "text_overlay": "short punchy text",
-  "caption": "compelling caption text",
-  "hashtags": ["hashtag1", "hashtag2", "hashtag3"]
-}}"""
-
-                suggestions_response = requests.post(
-                    "https://api.x.ai/v1/chat/completions",
-                    headers={
-                        "Authorization": f"Bearer {api_key}",
-                        "Content-Type": "application/json"
-                    },
-                    json={
-                        "messages": [{"role": "user", "content": suggestions_prompt}],
-                        "model": "grok-2-1212",
-                        "temperature": 0.8,
-                        "max_tokens": 500,
-                        "response_format": {"type": "json_object"}
-                    },
-                    timeout=30
-                )
-                
-                if suggestions_response.status_code == 200:
-                    suggestions_data = suggestions_response.json()
-                    suggestions_content = suggestions_data.get("choices", [{}])[0].get("message", {}).get("content", "{}")
-                    try:
-                        suggestions = json.loads(suggestions_content)
-                    except:
-                        pass
-            except Exception as suggestions_error:
-                print(f"Failed to generate suggestions: {str(suggestions_error)}")
+        if result.get("data"):
+            suggestions = concurrency.result_or_default(
+                suggestions_future, SUGGESTIONS_GRACE_SEC, {}, "Suggestions"
+            )
+        else:
+            suggestions_future.cancel()
         
         # Add suggestions to result
         result["suggestions"] = suggestions
@@ -682,8 +369,13 @@ Format as JSON:
     ),
     timeout_sec=300
 )
+@metrics.instrument
 def build_campaign(req: https_fn.Request) -> https_fn.Response:
-    """Build a full-funnel ad campaign with strategy and multiple ad variants"""
+    """Build a full-funnel ad campaign with strategy and multiple ad variants
+
+    With a Firebase ID token ("Authorization: Bearer <token>") the campaign is
+    also stored for list_campaigns and get_campaign.
+    """
     
     if req.method == "OPTIONS":
         return https_fn.Response("", status=204)
@@ -710,13 +402,16 @@ def build_campaign(req: https_fn.Request) -> https_fn.Response:
         goals = data.get("goals", ["awareness", "conversions"])
         num_variants = min(max(1, data.get("num_variants", 10)), 50)
         
-        api_key = os.getenv("GROK_API_KEY")
-        if not api_key:
-            try:
-                from firebase_functions import config
-                api_key = config().grok.key if hasattr(config(), 'grok') else None
-            except:
-                pass
+        try:
+            owner = campaigns.request_owner(req, required=False)
+        except PermissionError as e:
+            return https_fn.Response(
+                json.dumps({"error": str(e)}),
+                status=401,
+                headers={"Content-Type": "application/json"}
+            )
+        
+        api_key = upstream.get_secret("GROK_API_KEY")
         
         if not api_key:
             return https_fn.Response(
@@ -725,51 +420,15 @@ def build_campaign(req: https_fn.Request) -> https_fn.Response:
                 headers={"Content-Type": "application/json"}
             )
         
-        # Use structured outputs for reliable JSON
-        strategy_prompt = f"""You are an expert advertising strategist. Create a comprehensive ad campaign strategy for:
-
-Product/Service: {product}
-Target Audience: {target_audience}
-Budget: {budget}
-Goals: {', '.join(goals)}
-
-Provide a detailed campaign strategy with:
-1. Campaign overview and positioning
-2. Key messaging pillars (3-5)
-3. Target audience insights
-4. Channel recommendations
-5. Budget allocation suggestions
-6. Success metrics
-
-Format your response as a JSON object with these exact keys:
-{{
-  "overview": "Campaign overview text",
-  "positioning": "Brand positioning statement",
-  "messaging_pillars": ["pillar1", "pillar2", "pillar3"],
-  "audience_insights": "Detailed audience insights",
-  "channels": ["channel1", "channel2"],
-  "budget_allocation": {{"channel1": "percentage", "channel2": "percentage"}},
-  "success_metrics": ["metric1", "metric2"]
-}}"""
-
-        headers = {
-            "Authorization": f"Bearer {api_key}",
-            "Content-Type": "application/json"
-        }
-        
         # Get campaign strategy
-        strategy_response = requests.post(
-            "https://api.x.ai/v1/chat/completions",
-            headers=headers,
-            json={
-                "messages": [{"role": "user", "content": strategy_prompt}],
-                "model": "grok-2-1212",
-                "temperature": 0.7,
-                "max_tokens": 2000,
-                "response_format": {"type": "json_object"}
-            },
-            timeout=60
+        strategy_response = upstream.grok_chat(
+            campaigns.strategy_prompt(product, target_audience, budget, goals),
+            temperature=0.7,
+            max_tokens=token_budget.plan("strategy"),
+            timeout=60,
+            api_key=api_key
         )
+        token_budget.observe("strategy", strategy_response)
         
         if strategy_response.status_code != 200:
             return https_fn.Response(
@@ -778,98 +437,51 @@ Format your response as a JSON object with these exact keys:
                 headers={"Content-Type": "application/json"}
             )
         
-        strategy_data = strategy_response.json()
-        strategy_content = strategy_data.get("choices", [{}])[0].get("message", {}).get("content", "{}")
+        strategy_content = upstream.chat_content(strategy_response)
         
         try:
             strategy = json.loads(strategy_content)
         except:
+            metrics.record_fallback("strategy")
             strategy = {"error": "Failed to parse strategy"}
         
-        # Generate multiple ad variants
-        variants_prompt = f"""Generate {num_variants} unique ad variants for this campaign:
-
-Product: {product}
-Target Audience: {target_audience}
-Strategy: {json.dumps(strategy, indent=2)}
-
-For each variant, create:
-- A catchy headline
-- Compelling ad copy (2-3 sentences)
-- Call-to-action
-- Suggested visual style
-- Target emotion/angle
-- Image generation prompt (detailed description for creating an ad image, 1-2 sentences)
-- Video generation prompt (detailed description for creating a short video ad, 1-2 sentences)
-
-Format as JSON object with "variants" array:
-{{
-  "variants": [
-    {{
-      "headline": "string",
-      "copy": "string",
-      "cta": "string",
-      "visual_style": "string",
-      "emotion": "string",
-      "angle": "string",
-      "image_prompt": "detailed prompt for image generation",
-      "video_prompt": "detailed prompt for video generation"
-    }}
-  ]
-}}"""
-
-        variants_response = requests.post(
-            "https://api.x.ai/v1/chat/completions",
-            headers=headers,
-            json={
-                "messages": [{"role": "user", "content": variants_prompt}],
-                "model": "grok-2-1212",
-                "temperature": 0.9,
-                "max_tokens": 4000,
-                "response_format": {"type": "json_object"}
-            },
-            timeout=60
+        # Generate multiple ad variants (in concurrent shards, each with its own angle)
+        def build_variants_prompt(count, angle_hint):
+            return campaigns.variants_prompt(product, target_audience, strategy, count, angle_hint)
+        
+        sharded = generate_variants_sharded(
+            build_variants_prompt,
+            num_variants,
+            temperature=0.9,
+            budget="campaign_variants",
+            timeout=60,
+            api_key=api_key
         )
-        
-        variants = []
-        if variants_response.status_code == 200:
-            variants_data = variants_response.json()
-            variants_content = variants_data.get("choices", [{}])[0].get("message", {}).get("content", "{}")
-            try:
-                variants_json = json.loads(variants_content)
-                if "variants" in variants_json:
-                    variants = variants_json["variants"]
-                elif isinstance(variants_json, list):
-                    variants = variants_json
-            except:
-                pass
+        variants = sharded["variants"]
         
         # Ensure we have at least some variants
         if not variants:
-            for i in range(min(num_variants, 10)):
-                variants.append({
-                    "headline": f"Ad Variant {i+1} for {product}",
-                    "copy": f"Discover {product} - the solution you've been looking for.",
-                    "cta": "Learn More",
-                    "visual_style": "Modern and clean",
-                    "emotion": "Excitement",
-                    "angle": "Problem-solution",
-                    "image_prompt": f"Create an engaging advertisement image showcasing {product} with a modern, clean aesthetic that conveys excitement and solves problems",
-                    "video_prompt": f"Create a short, dynamic video advertisement featuring {product} that demonstrates its value and creates excitement, with modern visuals and clear messaging"
-                })
+            metrics.record_fallback("variants")
+            variants = campaigns.default_variants(product, min(num_variants, 10))
         
         # If variants don't have prompts, generate them
-        for variant in variants:
-            if "image_prompt" not in variant or not variant.get("image_prompt"):
-                variant["image_prompt"] = f"Create an engaging advertisement image for {product}: {variant.get('headline', '')}. Style: {variant.get('visual_style', 'modern')}. Emotion: {variant.get('emotion', 'excitement')}"
-            if "video_prompt" not in variant or not variant.get("video_prompt"):
-                variant["video_prompt"] = f"Create a short video advertisement for {product}: {variant.get('headline', '')}. Show {variant.get('angle', 'value proposition')}. Style: {variant.get('visual_style', 'dynamic')}. Emotion: {variant.get('emotion', 'excitement')}"
+        campaigns.fill_variant_prompts(variants, product)
+        variants = variants[:num_variants]
+        
+        # Store a signed-in caller's campaign so it can be listed and reopened later;
+        # the write runs after the response and a failure only loses the listing
+        if owner:
+            params = {"product": product, "target_audience": target_audience, "budget": budget,
+                      "goals": goals, "num_variants": num_variants}
+            campaign_id = campaigns.save_in_background(params, strategy, variants, owner)
+        else:
+            campaign_id = f"campaign_{int(time.time())}"
         
         return https_fn.Response(
             json.dumps({
                 "strategy": strategy,
-                "variants": variants[:num_variants],
-                "campaign_id": f"campaign_{int(time.time())}"
+                "variants": variants,
+                "campaign_id": campaign_id
             }),
             status=200,
             headers={"Content-Type": "application/json"}
@@ -888,10 +500,17 @@ Format as JSON object with "variants" array:
         cors_origins=["http://localhost:3000", "https://*.web.app", "https://*.firebaseapp.com"],
         cors_methods=["GET", "POST"]
     ),
-    timeout_sec=180
+    timeout_sec=campaigns.RUN_TIMEOUT_SEC
 )
-def predict_performance(req: https_fn.Request) -> https_fn.Response:
-    """Predict ad performance using Grok reasoning"""
+@metrics.instrument
+def run_campaign(req: https_fn.Request) -> https_fn.Response:
+    """Build a campaign with the server-side pipeline (strategy, variants, images, predictions)
+
+    POST the build_campaign parameters (plus optional "channel" and "stages")
+    to start a campaign, or {"campaign_id": ...} to resume one that failed or
+    ran out of time. Answers when the run ends; get_campaign reports progress
+    meanwhile. Requires a Firebase ID token as "Authorization: Bearer <token>".
+    """
     
     if req.method == "OPTIONS":
         return https_fn.Response("", status=204)
@@ -904,27 +523,18 @@ def predict_performance(req: https_fn.Request) -> https_fn.Response:
         )
     
     try:
-        data = req.get_json(silent=True)
-        if not data or "ad" not in data:
+        data = req.get_json(silent=True) or {}
+        
+        try:
+            owner = campaigns.request_owner(req)
+        except PermissionError as e:
             return https_fn.Response(
-                json.dumps({"error": "Missing 'ad' in request body"}),
-                status=400,
+                json.dumps({"error": str(e)}),
+                status=401,
                 headers={"Content-Type": "application/json"}
             )
         
-        ad = data["ad"]
-        target_audience = data.get("target_audience", "General")
-        channel = data.get("channel", "social_media")
-        budget = data.get("budget", 1000)
-        
-        api_key = os.getenv("GROK_API_KEY")
-        if not api_key:
-            try:
-                from firebase_functions import config
-                api_key = config().grok.key if hasattr(config(), 'grok') else None
-            except:
-                pass
-        
+        api_key = upstream.get_secret("GROK_API_KEY")
         if not api_key:
             return https_fn.Response(
                 json.dumps({"error": "Grok API key not configured"}),
@@ -932,81 +542,42 @@ def predict_performance(req: https_fn.Request) -> https_fn.Response:
                 headers={"Content-Type": "application/json"}
             )
         
-        # Use Grok's reasoning for performance prediction
-        prediction_prompt = f"""As an expert ad performance analyst, predict the performance of this ad:
-
-Ad Content:
-{json.dumps(ad, indent=2)}
-
-Target Audience: {target_audience}
-Channel: {channel}
-Budget: ${budget}
-
-Analyze and predict:
-1. Expected CTR (Click-Through Rate) as percentage
-2. Expected conversion rate as percentage
-3. Estimated CPC (Cost Per Click)
-4. Estimated CPA (Cost Per Acquisition)
-5. Predicted engagement score (0-100)
-6. Risk factors
-7. Optimization recommendations
-
-Format as JSON:
-{{
-  "ctr": 2.5,
-  "conversion_rate": 3.2,
-  "cpc": 0.45,
-  "cpa": 14.50,
-  "engagement_score": 75,
-  "risk_factors": ["factor1", "factor2"],
-  "recommendations": ["rec1", "rec2"],
-  "confidence": 85
-}}"""
-
-        headers = {
-            "Authorization": f"Bearer {api_key}",
-            "Content-Type": "application/json"
-        }
-        
-        response = requests.post(
-            "https://api.x.ai/v1/chat/completions",
-            headers=headers,
-            json={
-                "messages": [{"role": "user", "content": prediction_prompt}],
-                "model": "grok-2-1212",
-                "temperature": 0.3,
-                "max_tokens": 1500,
-                "response_format": {"type": "json_object"}
-            },
-            timeout=60
-        )
+        campaign_id = data.get("campaign_id")
+        if campaign_id:
+            campaign = campaigns.get_campaign(campaign_id)
+            if campaign is None or campaign["owner"] != owner:
+                return https_fn.Response(
+                    json.dumps({"error": f"Campaign not found: {campaign_id}"}),
+                    status=404,
+                    headers={"Content-Type": "application/json"}
+                )
+            if campaign["status"] == "completed":
+                return https_fn.Response(
+                    json.dumps({"campaign": campaigns.detail_view(campaign)}),
+                    status=200,
+                    headers={"Content-Type": "application/json"}
+                )
+        else:
+            try:
+                params = campaigns.build_params(data)
+            except ValueError as e:
+                return https_fn.Response(
+                    json.dumps({"error": str(e)}),
+                    status=400,
+                    headers={"Content-Type": "application/json"}
+                )
+            campaign_id = campaigns.create_campaign(params, owner=owner)
         
-        if response.status_code != 200:
+        campaign = campaigns.run(campaign_id, api_key=api_key)
+        if campaign is None:
             return https_fn.Response(
-                json.dumps({"error": f"Prediction failed: {str(response.text)}"}),
-                status=response.status_code,
+                json.dumps({"error": "Campaign is already running", "campaign_id": campaign_id}),
+                status=409,
                 headers={"Content-Type": "application/json"}
             )
         
-        result = response.json()
-        content = result.get("choices", [{}])[0].get("message", {}).get("content", "{}")
-        
-        try:
-            prediction = json.loads(content)
-        except:
-            prediction = {
-                "ctr": 2.0,
-                "conversion_rate": 2.5,
-                "cpc": 0.50,
-                "cpa": 20.00,
-                "engagement_score": 65,
-                "risk_factors": ["Limited data available"],
-                "recommendations": ["A/B test multiple variants", "Optimize targeting"],
-                "confidence": 60
-            }
-        
         return https_fn.Response(
-            json.dumps({"prediction": prediction}),
+            json.dumps({"campaign": campaigns.detail_view(campaign)}),
             status=200,
             headers={"Content-Type": "application/json"}
         )
@@ -1024,15 +595,24 @@ Format as JSON:
         cors_origins=["http://localhost:3000", "https://*.web.app", "https://*.firebaseapp.com"],
         cors_methods=["GET", "POST"]
     ),
-    timeout_sec=300
+    timeout_sec=60
 )
-def generate_variants(req: https_fn.Request) -> https_fn.Response:
-    """Generate multiple personalized ad variants"""
+@metrics.instrument
+def get_campaign(req: https_fn.Request) -> https_fn.Response:
+    """Get the status and checkpointed output of a campaign (supports long-polling)
+
+    Requires the owner's Firebase ID token as "Authorization: Bearer <token>".
+
+    Query parameters:
+        campaign_id - id returned by run_campaign or build_campaign
+        wait        - seconds to wait for a change before answering (max 50)
+        since       - `updated_at` from the previous response
+    """
     
     if req.method == "OPTIONS":
         return https_fn.Response("", status=204)
     
-    if req.method != "POST":
+    if req.method != "GET":
         return https_fn.Response(
             json.dumps({"error": "Method not allowed"}),
             status=405,
@@ -1040,34 +620,370 @@ def generate_variants(req: https_fn.Request) -> https_fn.Response:
         )
     
     try:
-        data = req.get_json(silent=True)
-        if not data or "prompt" not in data:
+        campaign_id = req.args.get("campaign_id")
+        if not campaign_id:
             return https_fn.Response(
-                json.dumps({"error": "Missing 'prompt' in request body"}),
+                json.dumps({"error": "Missing 'campaign_id' query parameter"}),
                 status=400,
                 headers={"Content-Type": "application/json"}
             )
         
-        prompt = data["prompt"]
-        num_variants = min(max(1, data.get("num_variants", 10)), 50)
-        personalization_data = data.get("personalization", {})
-        
-        api_key = os.getenv("GROK_API_KEY")
-        if not api_key:
-            try:
-                from firebase_functions import config
-                api_key = config().grok.key if hasattr(config(), 'grok') else None
-            except:
-                pass
-        
-        if not api_key:
+        try:
+            owner = campaigns.request_owner(req)
+        except PermissionError as e:
             return https_fn.Response(
-                json.dumps({"error": "Grok API key not configured"}),
-                status=500,
+                json.dumps({"error": str(e)}),
+                status=401,
+                headers={"Content-Type": "application/json"}
+            )
+        
+        try:
+            wait = float(req.args.get("wait", 0))
+            since = float(req.args["since"]) if req.args.get("since") else None
+        except ValueError:
+            return https_fn.Response(
+                json.dumps({"error": "'wait' and 'since' must be numbers"}),
+                status=400,
+                headers={"Content-Type": "application/json"}
+            )
+        
+        if wait > 0:
+            campaign = campaigns.wait_for_campaign(campaign_id, since=since, timeout=wait)
+        else:
+            campaign = campaigns.get_campaign(campaign_id)
+        if campaign is None or campaign["owner"] != owner:
+            return https_fn.Response(
+                json.dumps({"error": f"Campaign not found: {campaign_id}"}),
+                status=404,
+                headers={"Content-Type": "application/json"}
+            )
+        
+        # Signed URLs are short-lived, so the detail view mints fresh ones on every read
+        return https_fn.Response(
+            json.dumps({"campaign": campaigns.detail_view(campaign)}),
+            status=200,
+            headers={"Content-Type": "application/json", "Cache-Control": "no-store"}
+        )
+        
+    except Exception as e:
+        return https_fn.Response(
+            json.dumps({"error": f"Internal server error: {str(e)}"}),
+            status=500,
+            headers={"Content-Type": "application/json"}
+        )
+
+
+@https_fn.on_request(
+    cors=CorsOptions(
+        cors_origins=["http://localhost:3000", "https://*.web.app", "https://*.firebaseapp.com"],
+        cors_methods=["GET", "POST"]
+    )
+)
+@metrics.instrument
+def list_campaigns(req: https_fn.Request) -> https_fn.Response:
+    """List the caller's campaigns, one page of summaries at a time
+
+    Requires a Firebase ID token as "Authorization: Bearer <token>".
+
+    Query parameters:
+        goal   - only campaigns with this goal
+        order  - created_at (default) or engagement_score, newest/best first
+        limit  - page size (default 20, max 100)
+        cursor - next_cursor from the previous page
+    """
+    
+    if req.method == "OPTIONS":
+        return https_fn.Response("", status=204)
+    
+    if req.method != "GET":
+        return https_fn.Response(
+            json.dumps({"error": "Method not allowed"}),
+            status=405,
+            headers={"Content-Type": "application/json"}
+        )
+    
+    try:
+        try:
+            owner = campaigns.request_owner(req)
+        except PermissionError as e:
+            return https_fn.Response(
+                json.dumps({"error": str(e)}),
+                status=401,
+                headers={"Content-Type": "application/json"}
+            )
+        
+        try:
+            summaries, next_cursor = campaigns.list_campaigns(
+                owner,
+                goal=req.args.get("goal"),
+                order=req.args.get("order", "created_at"),
+                limit=campaigns.page_size(req.args.get("limit")),
+                cursor=req.args.get("cursor")
+            )
+        except ValueError as e:
+            return https_fn.Response(
+                json.dumps({"error": str(e)}),
+                status=400,
+                headers={"Content-Type": "application/json"}
+            )
+        
+        return https_fn.Response(
+            json.dumps({"campaigns": summaries, "next_cursor": next_cursor}),
+            status=200,
+            headers={"Content-Type": "application/json", "Cache-Control": "no-store"}
+        )
+        
+    except Exception as e:
+        return https_fn.Response(
+            json.dumps({"error": f"Internal server error: {str(e)}"}),
+            status=500,
+            headers={"Content-Type": "application/json"}
+        )
+
+
+@https_fn.on_request(
+    cors=CorsOptions(
+        cors_origins=["http://localhost:3000", "https://*.web.app", "https://*.firebaseapp.com"],
+        cors_methods=["GET", "POST"]
+    )
+)
+@metrics.instrument
+def list_variants(req: https_fn.Request) -> https_fn.Response:
+    """List variants by predicted engagement score, one page at a time
+
+    Requires a Firebase ID token as "Authorization: Bearer <token>".
+
+    Query parameters:
+        campaign_id - only this campaign's variants (default: all of the caller's)
+        limit       - page size (default 20, max 100)
+        cursor      - next_cursor from the previous page
+
+    Each variant carries its copy, score and image thumbnail, not its prompts
+    or full-size renditions.
+    """
+    
+    if req.method == "OPTIONS":
+        return https_fn.Response("", status=204)
+    
+    if req.method != "GET":
+        return https_fn.Response(
+            json.dumps({"error": "Method not allowed"}),
+            status=405,
+            headers={"Content-Type": "application/json"}
+        )
+    
+    try:
+        try:
+            owner = campaigns.request_owner(req)
+        except PermissionError as e:
+            return https_fn.Response(
+                json.dumps({"error": str(e)}),
+                status=401,
+                headers={"Content-Type": "application/json"}
+            )
+        
+        try:
+            variants, next_cursor = campaigns.list_variants(
+                owner,
+                campaign_id=req.args.get("campaign_id"),
+                limit=campaigns.page_size(req.args.get("limit")),
+                cursor=req.args.get("cursor")
+            )
+        except ValueError as e:
+            return https_fn.Response(
+                json.dumps({"error": str(e)}),
+                status=400,
+                headers={"Content-Type": "application/json"}
+            )
+        
+        for variant in variants:
+            if variant.get("image"):
+                images.refresh_urls(variant["image"])
+        
+        return https_fn.Response(
+            json.dumps({"variants": variants, "next_cursor": next_cursor}),
+            status=200,
+            headers={"Content-Type": "application/json", "Cache-Control": "no-store"}
+        )
+        
+    except Exception as e:
+        return https_fn.Response(
+            json.dumps({"error": f"Internal server error: {str(e)}"}),
+            status=500,
+            headers={"Content-Type": "application/json"}
+        )
+
+
+@https_fn.on_request(
+    cors=CorsOptions(
+        cors_origins=["http://localhost:3000", "https://*.web.app", "https://*.firebaseapp.com"],
+        cors_methods=["GET", "POST"]
+    ),
+    timeout_sec=180
+)
+@metrics.instrument
+def predict_performance(req: https_fn.Request) -> https_fn.Response:
+    """Predict ad performance using Grok reasoning
+
+    Send `ads` (a list) instead of `ad` to score many ads in one call; they
+    share `target_audience`, `channel` and `budget`, and `predictions` comes
+    back in input order.
+    """
+    
+    if req.method == "OPTIONS":
+        return https_fn.Response("", status=204)
+    
+    if req.method != "POST":
+        return https_fn.Response(
+            json.dumps({"error": "Method not allowed"}),
+            status=405,
+            headers={"Content-Type": "application/json"}
+        )
+    
+    try:
+        data = req.get_json(silent=True)
+        if not data or ("ad" not in data and "ads" not in data):
+            return https_fn.Response(
+                json.dumps({"error": "Missing 'ad' in request body"}),
+                status=400,
+                headers={"Content-Type": "application/json"}
+            )
+        
+        batch = "ads" in data
+        if batch and (not isinstance(data["ads"], list) or not data["ads"]):
+            return https_fn.Response(
+                json.dumps({"error": "'ads' must be a non-empty list"}),
+                status=400,
+                headers={"Content-Type": "application/json"}
+            )
+        if batch and len(data["ads"]) > predictions.BATCH_MAX:
+            return https_fn.Response(
+                json.dumps({"error": f"At most {predictions.BATCH_MAX} ads per request"}),
+                status=400,
+                headers={"Content-Type": "application/json"}
+            )
+        
+        target_audience = data.get("target_audience", "General")
+        channel = data.get("channel", "social_media")
+        budget = data.get("budget", 1000)
+        
+        api_key = upstream.get_secret("GROK_API_KEY")
+        
+        if not api_key:
+            return https_fn.Response(
+                json.dumps({"error": "Grok API key not configured"}),
+                status=500,
+                headers={"Content-Type": "application/json"}
+            )
+        
+        if batch:
+            results = predictions.predict_batch(
+                data["ads"],
+                target_audience,
+                channel,
+                budget,
+                api_key=api_key,
+                bypass_cache=llm_cache.bypass_requested(req)
+            )
+            return https_fn.Response(
+                json.dumps({"predictions": results, "count": len(results)}),
+                status=200,
+                headers={"Content-Type": "application/json"}
+            )
+        
+        # Use Grok's reasoning for performance prediction
+        prediction_prompt = predictions.build_prompt(data["ad"], target_audience, channel, budget)
+        
+        response = upstream.grok_chat(
+            prediction_prompt,
+            temperature=0.3,
+            max_tokens=token_budget.plan("prediction"),
+            timeout=60,
+            api_key=api_key,
+            cache="predict_performance",
+            bypass_cache=llm_cache.bypass_requested(req)
+        )
+        token_budget.observe("prediction", response)
+        
+        if response.status_code != 200:
+            return https_fn.Response(
+                json.dumps({"error": f"Prediction failed: {str(response.text)}"}),
+                status=response.status_code,
+                headers={"Content-Type": "application/json"}
+            )
+        
+        content = upstream.chat_content(response)
+        
+        try:
+            prediction = json.loads(content)
+        except:
+            metrics.record_fallback("prediction")
+            prediction = predictions.fallback_prediction()
+        
+        return https_fn.Response(
+            json.dumps({"prediction": prediction}),
+            status=200,
+            headers={"Content-Type": "application/json"}
+        )
+        
+    except Exception as e:
+        return https_fn.Response(
+            json.dumps({"error": f"Internal server error: {str(e)}"}),
+            status=500,
+            headers={"Content-Type": "application/json"}
+        )
+
+
+@https_fn.on_request(
+    cors=CorsOptions(
+        cors_origins=["http://localhost:3000", "https://*.web.app", "https://*.firebaseapp.com"],
+        cors_methods=["GET", "POST"]
+    ),
+    timeout_sec=300
+)
+@metrics.instrument
+def generate_variants(req: https_fn.Request) -> https_fn.Response:
+    """Generate multiple personalized ad variants
+
+    With `"stream": true` variants are streamed as they are generated, as
+    NDJSON or Server-Sent Events (`stream_format`, or `Accept: text/event-stream`).
+    """
+    
+    if req.method == "OPTIONS":
+        return https_fn.Response("", status=204)
+    
+    if req.method != "POST":
+        return https_fn.Response(
+            json.dumps({"error": "Method not allowed"}),
+            status=405,
+            headers={"Content-Type": "application/json"}
+        )
+    
+    try:
+        data = req.get_json(silent=True)
+        if not data or "prompt" not in data:
+            return https_fn.Response(
+                json.dumps({"error": "Missing 'prompt' in request body"}),
+                status=400,
+                headers={"Content-Type": "application/json"}
+            )
+        
+        prompt = data["prompt"]
+        num_variants = min(max(1, data.get("num_variants", 10)), 50)
+        personalization_data = data.get("personalization", {})
+        
+        api_key = upstream.get_secret("GROK_API_KEY")
+        
+        if not api_key:
+            return https_fn.Response(
+                json.dumps({"error": "Grok API key not configured"}),
+                status=500,
                 headers={"Content-Type": "application/json"}
             )
         
-        variants_prompt = f"""Generate {num_variants} unique, personalized ad variants for:
+        # Variants are generated in concurrent shards, each with its own angle
+        def build_variants_prompt(count, angle_hint):
+            variants_prompt = f"""Generate {count} unique, personalized ad variants for:
 
 Base Prompt: {prompt}
 Personalization Data: {json.dumps(personalization_data, indent=2)}
@@ -1093,57 +1009,72 @@ Format as JSON object with "variants" array:
     }}
   ]
 }}"""
-
-        headers = {
-            "Authorization": f"Bearer {api_key}",
-            "Content-Type": "application/json"
-        }
+            if angle_hint:
+                variants_prompt += f"\n\nCreative direction for this batch: {angle_hint}"
+            return variants_prompt
+        
+        def placeholder_variant(i):
+            return {
+                "variant_id": i + 1,
+                "headline": f"Variant {i + 1}",
+                "copy": f"Discover {prompt} - personalized for you.",
+                "cta": "Get Started",
+                "target_emotion": "Excitement",
+                "audience_segment": "General",
+                "personalization_note": "Generated variant"
+            }
         
-        response = requests.post(
-            "https://api.x.ai/v1/chat/completions",
-            headers=headers,
-            json={
-                "messages": [{"role": "user", "content": variants_prompt}],
-                "model": "grok-2-1212",
-                "temperature": 0.9,
-                "max_tokens": 4000,
-                "response_format": {"type": "json_object"}
-            },
-            timeout=120
+        # Streaming mode: emit each variant as soon as its JSON object is complete
+        if data.get("stream"):
+            stream_format = streaming.negotiate_format(data.get("stream_format"), req.headers.get("Accept"))
+            
+            def variant_events():
+                for event in stream_variants_sharded(
+                    build_variants_prompt,
+                    num_variants,
+                    temperature=0.9,
+                    budget="variants",
+                    timeout=120,
+                    api_key=api_key
+                ):
+                    if event["type"] != "done":
+                        yield event
+                        continue
+                    if event["count"] == 0 and event["error"]:
+                        yield {"type": "error", "error": f"Variant generation failed: {str(event['error']['text'])}"}
+                        yield {"type": "done", "count": 0}
+                        return
+                    for i in range(event["count"], num_variants):
+                        yield {"type": "variant", "variant": placeholder_variant(i)}
+                    yield {"type": "done", "count": num_variants}
+            
+            return https_fn.Response(
+                streaming.encode_events(variant_events(), stream_format),
+                status=200,
+                headers=streaming.stream_headers(stream_format)
+            )
+        
+        sharded = generate_variants_sharded(
+            build_variants_prompt,
+            num_variants,
+            temperature=0.9,
+            budget="variants",
+            timeout=120,
+            api_key=api_key
         )
+        variants = sharded["variants"]
         
-        if response.status_code != 200:
+        # Every shard failed upstream: surface the error as before
+        if not variants and sharded["error"] and sharded["error"]["status_code"] != 200:
             return https_fn.Response(
-                json.dumps({"error": f"Variant generation failed: {str(response.text)}"}),
-                status=response.status_code,
+                json.dumps({"error": f"Variant generation failed: {str(sharded['error']['text'])}"}),
+                status=sharded["error"]["status_code"],
                 headers={"Content-Type": "application/json"}
             )
         
-        result = response.json()
-        content = result.get("choices", [{}])[0].get("message", {}).get("content", "{}")
-        
-        try:
-            variants_json = json.loads(content)
-            if "variants" in variants_json:
-                variants = variants_json["variants"]
-            elif isinstance(variants_json, list):
-                variants = variants_json
-            else:
-                variants = []
-        except:
-            variants = []
-        
         if len(variants) < num_variants:
             for i in range(len(variants), num_variants):
-                variants.append({
-                    "variant_id": i + 1,
-                    "headline": f"Variant {i + 1}",
-                    "copy": f"Discover {prompt} - personalized for you.",
-                    "cta": "Get Started",
-                    "target_emotion": "Excitement",
-                    "audience_segment": "General",
-                    "personalization_note": "Generated variant"
-                })
+                variants.append(placeholder_variant(i))
         
         return https_fn.Response(
             json.dumps({
@@ -1169,6 +1100,7 @@ Format as JSON object with "variants" array:
     ),
     timeout_sec=300
 )
+@metrics.instrument
 def trend_to_ad_pipeline(req: https_fn.Request) -> https_fn.Response:
     """Real-time trend detection and instant ad generation"""
     
@@ -1188,15 +1120,8 @@ def trend_to_ad_pipeline(req: https_fn.Request) -> https_fn.Response:
         product = data.get("product", "")
         woeid = data.get("woeid", "23424977")
         
-        api_key = os.getenv("GROK_API_KEY")
-        bearer_token = os.getenv("X_API_BEARER_TOKEN")
-        
-        if not api_key:
-            try:
-                from firebase_functions import config
-                api_key = config().grok.key if hasattr(config(), 'grok') else None
-            except:
-                pass
+        api_key = upstream.get_secret("GROK_API_KEY")
+        bearer_token = upstream.get_secret("X_API_BEARER_TOKEN")
         
         if not api_key:
             return https_fn.Response(
@@ -1209,14 +1134,9 @@ def trend_to_ad_pipeline(req: https_fn.Request) -> https_fn.Response:
         if not trend_name:
             if bearer_token:
                 try:
-                    trends_url = f"https://api.x.com/2/trends/by/woeid/{woeid}"
-                    trends_response = requests.get(
-                        trends_url,
-                        headers={"Authorization": f"Bearer {bearer_token}"},
-                        timeout=30
-                    )
-                    if trends_response.status_code == 200:
-                        trends_data = trends_response.json()
+                    cached = trends.get_trends(woeid, bearer_token)
+                    if cached["status_code"] == 200:
+                        trends_data = json.loads(cached["body"])
                         if trends_data.get("data"):
                             trend_name = trends_data["data"][0].get("trend_name", "")
                 except:
@@ -1248,23 +1168,14 @@ Format as JSON:
   "urgency_level": "High/Medium/Low"
 }}"""
 
-        headers = {
-            "Authorization": f"Bearer {api_key}",
-            "Content-Type": "application/json"
-        }
-        
-        response = requests.post(
-            "https://api.x.ai/v1/chat/completions",
-            headers=headers,
-            json={
-                "messages": [{"role": "user", "content": ad_prompt}],
-                "model": "grok-2-1212",
-                "temperature": 0.8,
-                "max_tokens": 1000,
-                "response_format": {"type": "json_object"}
-            },
-            timeout=60
+        response = upstream.grok_chat(
+            ad_prompt,
+            temperature=0.8,
+            max_tokens=token_budget.plan("trend_ad"),
+            timeout=60,
+            api_key=api_key
         )
+        token_budget.observe("trend_ad", response)
         
         if response.status_code != 200:
             return https_fn.Response(
@@ -1273,12 +1184,12 @@ Format as JSON:
                 headers={"Content-Type": "application/json"}
             )
         
-        result = response.json()
-        content = result.get("choices", [{}])[0].get("message", {}).get("content", "{}")
+        content = upstream.chat_content(response)
         
         try:
             ad = json.loads(content)
         except:
+            metrics.record_fallback("trend_ad")
             ad = {
                 "headline": f"Join the {trend_name} Movement",
                 "copy": f"Be part of the conversation. {trend_name} is trending now.",
@@ -1311,15 +1222,23 @@ Format as JSON:
         cors_origins=["http://localhost:3000", "https://*.web.app", "https://*.firebaseapp.com"],
         cors_methods=["GET", "POST"]
     ),
-    timeout_sec=300  # 5 minutes timeout for video processing
+    timeout_sec=60
 )
-def add_text_overlay(req: https_fn.Request) -> https_fn.Response:
-    """Add a text overlay to a video at a specific location"""
+@metrics.instrument
+def get_video_job(req: https_fn.Request) -> https_fn.Response:
+    """Get the status of an async video job (supports long-polling)
+
+    Query parameters:
+        job_id - id returned by generate_ad with "async": true
+        wait   - seconds to wait for a change before answering (max 50)
+        since  - `updated_at` from the previous response; the request returns
+                 as soon as the job changes after it
+    """
     
     if req.method == "OPTIONS":
         return https_fn.Response("", status=204)
     
-    if req.method != "POST":
+    if req.method != "GET":
         return https_fn.Response(
             json.dumps({"error": "Method not allowed"}),
             status=405,
@@ -1327,273 +1246,271 @@ def add_text_overlay(req: https_fn.Request) -> https_fn.Response:
         )
     
     try:
-        data = req.get_json(silent=True)
-        if not data:
+        job_id = req.args.get("job_id")
+        if not job_id:
             return https_fn.Response(
-                json.dumps({"error": "Missing request body"}),
+                json.dumps({"error": "Missing 'job_id' query parameter"}),
                 status=400,
                 headers={"Content-Type": "application/json"}
             )
         
-        # Required parameters
-        text = data.get("text")
-        if not text:
+        try:
+            wait = float(req.args.get("wait", 0))
+            since = float(req.args["since"]) if req.args.get("since") else None
+        except ValueError:
             return https_fn.Response(
-                json.dumps({"error": "Missing required parameter: 'text'"}),
+                json.dumps({"error": "'wait' and 'since' must be numbers"}),
                 status=400,
                 headers={"Content-Type": "application/json"}
             )
         
-        # Video input - can be base64 or URL
-        video_base64 = data.get("video_base64")
-        video_url = data.get("video_url")
-        
-        if not video_base64 and not video_url:
+        job = jobs.wait_for_job(job_id, since=since, timeout=wait) if wait > 0 else jobs.get_job(job_id)
+        if job is None:
             return https_fn.Response(
-                json.dumps({"error": "Missing required parameter: either 'video_base64' or 'video_url'"}),
-                status=400,
+                json.dumps({"error": f"Job not found: {job_id}"}),
+                status=404,
                 headers={"Content-Type": "application/json"}
             )
         
-        # Position parameters (required)
-        position_x = data.get("position_x")
-        position_y = data.get("position_y")
+        job_data = jobs.public_view(job)
+        
+        # Signed URLs are short-lived, so mint a fresh one on every read
+        result = job_data.get("result")
+        if result and result.get("storage_path"):
+            result["video_url"] = storage.signed_url(result["storage_path"])
+        
+        return https_fn.Response(
+            json.dumps({"job": job_data}),
+            status=200,
+            headers={"Content-Type": "application/json", "Cache-Control": "no-store"}
+        )
         
-        if position_x is None or position_y is None:
+    except Exception as e:
+        return https_fn.Response(
+            json.dumps({"error": f"Internal server error: {str(e)}"}),
+            status=500,
+            headers={"Content-Type": "application/json"}
+        )
+
+
+def media_file_response(req, path, size_bytes, content_type, cache_control, etag=None):
+    """Stream a stored file, honouring a single-range Range header (206 / 416)
+
+    Players request ranges to scrub and to start playback before the whole
+    file has downloaded; only the requested bytes are read from storage.
+    """
+    headers = {
+        "Content-Type": content_type,
+        "Accept-Ranges": "bytes",
+        "Cache-Control": cache_control
+    }
+    if etag:
+        headers["ETag"] = f'"{etag}"'
+        if storage.etag_matches(req.headers.get("If-None-Match"), headers["ETag"]):
+            return https_fn.Response("", status=304, headers=headers)
+    
+    try:
+        byte_range = storage.parse_range(req.headers.get("Range"), size_bytes)
+    except ValueError:
+        headers["Content-Range"] = f"bytes */{size_bytes}"
+        return https_fn.Response("", status=416, headers=headers)
+    
+    # If-Range: a stale validator means the client gets the whole file instead
+    if byte_range and req.headers.get("If-Range") and req.headers.get("If-Range") != headers.get("ETag"):
+        byte_range = None
+    
+    if byte_range is None:
+        headers["Content-Length"] = str(size_bytes)
+        return https_fn.Response(storage.read_range(path), status=200, headers=headers, direct_passthrough=True)
+    
+    start, end = byte_range
+    headers["Content-Range"] = f"bytes {start}-{end}/{size_bytes}"
+    headers["Content-Length"] = str(end - start + 1)
+    return https_fn.Response(storage.read_range(path, start, end), status=206, headers=headers, direct_passthrough=True)
+
+
+@https_fn.on_request(
+    cors=CorsOptions(
+        cors_origins=["http://localhost:3000", "https://*.web.app", "https://*.firebaseapp.com"],
+        cors_methods=["GET"]
+    )
+)
+@metrics.instrument
+def get_media(req: https_fn.Request) -> https_fn.Response:
+    """Serve a file from the local media storage backend (emulator / tests)
+
+    Production media is served directly from Cloud Storage via signed URLs;
+    this endpoint plays that role for MEDIA_STORAGE_BACKEND=local.
+    """
+    
+    if req.method == "OPTIONS":
+        return https_fn.Response("", status=204)
+    
+    if req.method != "GET":
+        return https_fn.Response(
+            json.dumps({"error": "Method not allowed"}),
+            status=405,
+            headers={"Content-Type": "application/json"}
+        )
+    
+    try:
+        backend = storage.get_backend()
+        if backend.name != "local":
             return https_fn.Response(
-                json.dumps({"error": "Missing required parameters: 'position_x' and 'position_y'"}),
-                status=400,
+                json.dumps({"error": "Media is served from Cloud Storage signed URLs"}),
+                status=404,
                 headers={"Content-Type": "application/json"}
             )
         
-        # Optional styling parameters
-        font_size = data.get("font_size", 50)
-        font_color = data.get("font_color", "white")
-        font_family = data.get("font_family", None)  # None will use default font
-        stroke_color = data.get("stroke_color", "black")
-        stroke_width = data.get("stroke_width", 2)
-        start_time = data.get("start_time", 0)  # When to start showing text (in seconds)
-        duration = data.get("duration")  # How long to show text (None = entire video)
-        alignment = data.get("alignment", "center")  # left, center, right
-        
-        # Helper function to find a valid font
-        def get_valid_font(font_name):
-            """Try to find a valid font file, return None if not found (uses default)"""
-            if not font_name:
-                return None
-            
-            # Common font paths
-            font_paths = [
-                '/System/Library/Fonts',
-                '/Library/Fonts',
-                os.path.expanduser('~/Library/Fonts'),
-            ]
-            
-            # Common font file extensions
-            extensions = ['.ttf', '.otf', '.ttc']
-            
-            # Normalize font name - remove common suffixes/prefixes
-            base_name = font_name.replace('-Bold', '').replace('-Regular', '').replace('-Italic', '').strip()
-            
-            # Try exact match first
-            for path in font_paths:
-                if not os.path.exists(path):
-                    continue
-                
-                # Try exact match
-                for ext in extensions:
-                    font_file = os.path.join(path, f"{font_name}{ext}")
-                    if os.path.exists(font_file):
-                        return font_file
-                
-                # Try variations
-                variations = [
-                    font_name,
-                    font_name.replace(' ', '-'),
-                    font_name.replace('-', ' '),
-                    base_name,
-                    f"{base_name}-Bold",
-                    f"{base_name} Bold",
-                ]
-                
-                for variant in variations:
-                    for ext in extensions:
-                        font_file = os.path.join(path, f"{variant}{ext}")
-                        if os.path.exists(font_file):
-                            return font_file
-                
-                # Try case-insensitive search in directory
-                try:
-                    for file in os.listdir(path):
-                        file_lower = file.lower()
-                        font_lower = font_name.lower()
-                        base_lower = base_name.lower()
-                        
-                        # Check if filename contains the font name
-                        if (font_lower in file_lower or base_lower in file_lower) and any(file_lower.endswith(ext) for ext in extensions):
-                            font_file = os.path.join(path, file)
-                            if os.path.exists(font_file):
-                                return font_file
-                except (OSError, PermissionError):
-                    pass
-            
-            # If not found, return None to use default font
-            print(f"Font '{font_name}' not found, using default font")
-            return None
-        
-        # Create temporary files for input and output
-        input_video_path = None
-        output_video_path = None
+        path = req.args.get("path", "")
+        if not storage.verify_local_signature(path, req.args.get("expires"), req.args.get("signature")):
+            return https_fn.Response(
+                json.dumps({"error": "Invalid or expired media URL"}),
+                status=403,
+                headers={"Content-Type": "application/json"}
+            )
         
-        try:
-            # Download or decode video
-            if video_url:
-                print(f"Downloading video from URL: {video_url}")
-                response = requests.get(video_url, timeout=60)
-                if response.status_code != 200:
-                    return https_fn.Response(
-                        json.dumps({"error": f"Failed to download video from URL: {response.status_code}"}),
-                        status=400,
-                        headers={"Content-Type": "application/json"}
-                    )
-                video_bytes = response.content
-            else:
-                print("Decoding base64 video...")
-                video_bytes = base64.b64decode(video_base64)
-            
-            # Save video to temporary file
-            with tempfile.NamedTemporaryFile(delete=False, suffix=".mp4") as temp_input:
-                temp_input.write(video_bytes)
-                input_video_path = temp_input.name
-            
-            print(f"Video saved to temporary file: {input_video_path}")
-            print(f"Video size: {len(video_bytes)} bytes")
-            
-            # Load video
-            print("Loading video with MoviePy...")
-            video = VideoFileClip(input_video_path)
-            
-            # Calculate text duration (use video duration if not specified)
-            text_duration = duration if duration is not None else video.duration - start_time
-            text_duration = min(text_duration, video.duration - start_time)  # Don't exceed video length
-            
-            # Create text clip
-            print(f"Creating text overlay: '{text}' at position ({position_x}, {position_y})")
-            
-            # Get valid font path or None for default
-            font_path = get_valid_font(font_family)
-            
-            # Get video dimensions for size calculation if needed
-            video_width = video.w
-            video_height = video.h
-            
-            # Calculate padding needed for stroke (stroke extends outward)
-            # Add generous padding to prevent any clipping
-            stroke_padding = max(stroke_width * 3, 20)
-            
-            # Build TextClip parameters
-            # Use 'label' method for single-line text positioning
-            text_clip_params = {
-                "text": text,
-                "font_size": font_size,
-                "color": font_color,
-                "stroke_color": stroke_color,
-                "stroke_width": stroke_width,
-                "method": 'label',
-                "text_align": alignment,
-                "margin": (stroke_padding, stroke_padding),  # Add margin to prevent clipping
-                "transparent": True  # Ensure transparent background
-            }
-            
-            # Only add font parameter if we have a valid font path
-            if font_path:
-                text_clip_params["font"] = font_path
-            
-            # Create text clip with margin
-            txt_clip = TextClip(**text_clip_params)
-            
-            print(f"Text clip size with margin: {txt_clip.w}x{txt_clip.h}")
-            
-            # Position the text clip
-            txt_clip = txt_clip.with_position((position_x, position_y)).with_start(start_time).with_duration(text_duration)
-            
-            # Composite video with text overlay
-            print("Compositing video with text overlay...")
-            final_video = CompositeVideoClip([video, txt_clip])
-            
-            # Create output temporary file
-            with tempfile.NamedTemporaryFile(delete=False, suffix=".mp4") as temp_output:
-                output_video_path = temp_output.name
-            
-            # Write output video
-            print(f"Writing output video to: {output_video_path}")
-            final_video.write_videofile(
-                output_video_path,
-                codec='libx264',
-                audio_codec='aac',
-                temp_audiofile=tempfile.mktemp(suffix='.m4a'),
-                remove_temp=True,
-                logger=None
+        size_bytes = backend.size(path)
+        if size_bytes is None:
+            return https_fn.Response(
+                json.dumps({"error": "Media not found"}),
+                status=404,
+                headers={"Content-Type": "application/json"}
             )
-            
-            # Read output video
-            print("Reading output video...")
-            with open(output_video_path, 'rb') as f:
-                output_video_bytes = f.read()
-            
-            print(f"Output video size: {len(output_video_bytes)} bytes")
-            
-            # Encode to base64
-            output_base64 = base64.b64encode(output_video_bytes).decode('utf-8')
-            
-            # Clean up video objects to free memory
-            txt_clip.close()
-            final_video.close()
-            video.close()
-            
+        
+        return media_file_response(req, path, size_bytes, storage.guess_content_type(path), "private, max-age=300")
+        
+    except ValueError as e:
+        return https_fn.Response(
+            json.dumps({"error": str(e)}),
+            status=400,
+            headers={"Content-Type": "application/json"}
+        )
+    except Exception as e:
+        return https_fn.Response(
+            json.dumps({"error": f"Internal server error: {str(e)}"}),
+            status=500,
+            headers={"Content-Type": "application/json"}
+        )
+
+
+@https_fn.on_request(
+    cors=CorsOptions(
+        cors_origins=["http://localhost:3000", "https://*.web.app", "https://*.firebaseapp.com"],
+        cors_methods=["GET"]
+    )
+)
+@metrics.instrument
+def get_asset(req: https_fn.Request) -> https_fn.Response:
+    """Serve a content-addressed asset by id, with HTTP Range support
+
+    GET ?id=<asset_id> streams the media (206 for Range requests); add
+    &metadata=1 for its metadata as JSON instead. Asset ids are SHA-256
+    hashes of the content, so responses never change and are cacheable.
+    """
+    
+    if req.method == "OPTIONS":
+        return https_fn.Response("", status=204)
+    
+    if req.method != "GET":
+        return https_fn.Response(
+            json.dumps({"error": "Method not allowed"}),
+            status=405,
+            headers={"Content-Type": "application/json"}
+        )
+    
+    try:
+        asset_id = req.args.get("id", "")
+        if not assets.is_asset_id(asset_id):
             return https_fn.Response(
-                json.dumps({
-                    "video_base64": output_base64,
-                    "mime_type": "video/mp4",
-                    "message": "Text overlay added successfully",
-                    "text": text,
-                    "position": {"x": position_x, "y": position_y}
-                }),
-                status=200,
+                json.dumps({"error": "Missing or invalid 'id' (a SHA-256 asset id)"}),
+                status=400,
                 headers={"Content-Type": "application/json"}
             )
-            
-        except Exception as video_error:
-            print(f"Video processing error: {str(video_error)}")
-            import traceback
-            traceback.print_exc()
+        
+        asset = assets.get(asset_id)
+        if asset is None:
             return https_fn.Response(
-                json.dumps({"error": f"Video processing failed: {str(video_error)}"}),
-                status=500,
+                json.dumps({"error": "Asset not found"}),
+                status=404,
                 headers={"Content-Type": "application/json"}
             )
         
-        finally:
-            # Clean up temporary files
-            if input_video_path and os.path.exists(input_video_path):
-                try:
-                    os.unlink(input_video_path)
-                    print(f"Cleaned up input file: {input_video_path}")
-                except:
-                    pass
-            
-            if output_video_path and os.path.exists(output_video_path):
-                try:
-                    os.unlink(output_video_path)
-                    print(f"Cleaned up output file: {output_video_path}")
-                except:
-                    pass
+        if req.args.get("metadata"):
+            return https_fn.Response(
+                json.dumps(asset),
+                status=200,
+                headers={"Content-Type": "application/json", "Cache-Control": "private, max-age=31536000, immutable"}
+            )
+        
+        return media_file_response(
+            req,
+            asset["storage_path"],
+            asset["size_bytes"],
+            asset["content_type"],
+            "private, max-age=31536000, immutable",
+            etag=asset_id
+        )
         
     except Exception as e:
-        import traceback
-        traceback.print_exc()
         return https_fn.Response(
             json.dumps({"error": f"Internal server error: {str(e)}"}),
             status=500,
             headers={"Content-Type": "application/json"}
-        )
\ No newline at end of file
+        )
+
+
+@https_fn.on_request(
+    cors=CorsOptions(
+        cors_origins=["http://localhost:3000", "https://*.web.app", "https://*.firebaseapp.com"],
+        cors_methods=["GET"]
+    )
+)
+@metrics.instrument
+def get_metrics(req: https_fn.Request) -> https_fn.Response:
+    """Prometheus metrics for all functions and instances (see grokads.metrics)
+
+    Covers handler latency histograms, upstream call timings, Grok token
+    usage, fallbacks, cache hits and coalesced calls. Requires
+    "Authorization: Bearer <METRICS_TOKEN>"; 404 when METRICS_TOKEN is unset.
+    """
+    
+    if req.method == "OPTIONS":
+        return https_fn.Response("", status=204)
+    
+    if req.method != "GET":
+        return https_fn.Response(
+            json.dumps({"error": "Method not allowed"}),
+            status=405,
+            headers={"Content-Type": "application/json"}
+        )
+    
+    # Off unless a token is configured
+    if not metrics.METRICS_TOKEN:
+        return https_fn.Response(
+            json.dumps({"error": "Not found"}),
+            status=404,
+            headers={"Content-Type": "application/json"}
+        )
+    
+    supplied = req.headers.get("Authorization", "").removeprefix("Bearer ").strip()
+    if not hmac.compare_digest(supplied.encode(), metrics.METRICS_TOKEN.encode()):
+        return https_fn.Response(
+            json.dumps({"error": "Unauthorized"}),
+            status=401,
+            headers={"Content-Type": "application/json"}
+        )
+    
+    try:
+        return https_fn.Response(
+            metrics.render_prometheus(metrics.collect()),
+            status=200,
+            headers={"Content-Type": "text/plain; version=0.0.4", "Cache-Control": "no-store"}
+        )
+        
+    except Exception as e:
+        return https_fn.Response(
+            json.dumps({"error": f"Internal server error: {str(e)}"}),
+            status=500,
+            headers={"Content-Type": "application/json"}
+        )
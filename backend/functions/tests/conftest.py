@@ -0,0 +1,5 @@
+"""Run the tests from anywhere: `python -m pytest backend/functions/tests`"""
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
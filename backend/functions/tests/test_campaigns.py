@@ -0,0 +1,89 @@
+import base64
+
+import pytest
+
+from grokads import campaigns
+
+
+class Reference:
+    def __init__(self, path):
+        self.path = path
+
+
+class Snapshot:
+    def __init__(self, path, exists=True):
+        self.reference = Reference(path)
+        self.exists = exists
+
+
+class Firestore:
+    """Just enough of a client for _cursor_snapshot: every document exists except `missing`"""
+
+    def __init__(self, missing=()):
+        self.missing = set(missing)
+        self.read = []
+
+    def document(self, path):
+        firestore = self
+
+        class Document:
+            def get(self, field_paths=None):
+                firestore.read.append((path, field_paths))
+                return Snapshot(path, exists=path not in firestore.missing)
+
+        return Document()
+
+
+@pytest.fixture
+def firestore(monkeypatch):
+    firestore = Firestore(missing={"campaigns/gone"})
+    monkeypatch.setattr(campaigns, "get_firestore", lambda: firestore)
+    return firestore
+
+
+def test_cursor_round_trip(firestore):
+    path = "campaigns/abc123/variants/007"
+    cursor = campaigns.encode_cursor(Snapshot(path))
+    assert path not in cursor
+    assert campaigns._cursor_snapshot(cursor, "engagement_score").reference.path == path
+    assert firestore.read == [(path, ["engagement_score"])]
+
+
+def test_cursor_is_url_safe():
+    cursor = campaigns.encode_cursor(Snapshot("campaigns/" + "ÿ" * 30))
+    assert all(char.isalnum() or char in "-_=" for char in cursor)
+
+
+@pytest.mark.parametrize("cursor", [
+    "not base64!",
+    base64.urlsafe_b64encode(b"\xff\xfe").decode("ascii"),
+    base64.urlsafe_b64encode(b"users/abc").decode("ascii"),
+    base64.urlsafe_b64encode(b"campaigns/../users/abc").decode("ascii"),
+])
+def test_invalid_cursor(firestore, cursor):
+    with pytest.raises(ValueError, match="Invalid 'cursor'"):
+        campaigns._cursor_snapshot(cursor, "created_at")
+    assert firestore.read == []
+
+
+def test_cursor_of_a_deleted_document(firestore):
+    cursor = campaigns.encode_cursor(Snapshot("campaigns/gone"))
+    with pytest.raises(ValueError, match="deleted"):
+        campaigns._cursor_snapshot(cursor, "created_at")
+
+
+@pytest.mark.parametrize("num_variants, expected", [(None, 10), ("12", 12), (0, 1), (500, 50)])
+def test_build_params_num_variants(num_variants, expected):
+    data = {"product": "socks"} if num_variants is None else {"product": "socks", "num_variants": num_variants}
+    assert campaigns.build_params(data)["num_variants"] == expected
+
+
+@pytest.mark.parametrize("num_variants", [[3], {"n": 3}, "many", None])
+def test_build_params_rejects_non_numeric_num_variants(num_variants):
+    with pytest.raises(ValueError, match="'num_variants' must be a number"):
+        campaigns.build_params({"product": "socks", "num_variants": num_variants})
+
+
+def test_run_budget_leaves_time_to_finish():
+    assert campaigns.RUN_BUDGET_SEC <= campaigns.MAX_RUN_BUDGET_SEC
+    assert campaigns.MAX_RUN_BUDGET_SEC + campaigns.OVERRUN_SEC < campaigns.RUN_TIMEOUT_SEC
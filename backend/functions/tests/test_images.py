@@ -0,0 +1,43 @@
+import base64
+import io
+
+import pytest
+from PIL import Image
+
+from grokads import images
+
+
+@pytest.fixture
+def stored(monkeypatch):
+    stored = []
+
+    def put_bytes(data, content_type, **fields):
+        stored.append({"content_type": content_type, **fields})
+        return {"asset_id": f"asset{len(stored)}", "storage_path": f"assets/{len(stored)}",
+                "content_type": content_type, "size_bytes": len(data)}
+
+    monkeypatch.setattr(images.assets, "put_bytes", put_bytes)
+    monkeypatch.setattr(images.storage, "media_info", lambda path, content_type, size_bytes: {
+        "storage_path": path, "content_type": content_type})
+    return stored
+
+
+def encode(mode, image_format):
+    buffer = io.BytesIO()
+    Image.new(mode, (64, 48)).save(buffer, image_format)
+    return {"b64_json": base64.b64encode(buffer.getvalue()).decode("ascii")}
+
+
+@pytest.mark.parametrize("mode, image_format, content_type", [
+    ("RGB", "PNG", "image/png"),
+    ("L", "JPEG", "image/jpeg"),
+    ("CMYK", "JPEG", "image/jpeg"),
+    ("P", "GIF", "image/gif"),
+])
+def test_original_keeps_its_content_type(stored, mode, image_format, content_type):
+    result = images.process_item(encode(mode, image_format), images.build_options({"formats": ["thumbnail"]}))
+    assert stored[0]["content_type"] == content_type
+    assert result["content_type"] == content_type
+    assert (result["width"], result["height"]) == (64, 48)
+    assert "b64_json" not in result
+    assert list(result["renditions"]) == ["thumbnail"]
@@ -0,0 +1,57 @@
+from grokads.jsonstream import ArrayItemParser
+
+
+def feed_all(parser, chunks):
+    items = []
+    for chunk in chunks:
+        items.extend(parser.feed(chunk))
+    return items
+
+
+def test_items_under_key_arrive_as_they_close():
+    parser = ArrayItemParser("variants")
+    assert parser.feed('{"strategy": "x", "variants": [{"headline": "a"}, {"head') == [{"headline": "a"}]
+    assert parser.feed('line": "b"}]}') == [{"headline": "b"}]
+    assert parser.finished
+
+
+def test_chunks_split_anywhere():
+    text = '{"variants": [{"headline": "one", "tags": ["a", "b"]}, {"headline": "two", "nested": {"k": 1}}]}'
+    for size in (1, 2, 3, 7):
+        chunks = [text[i:i + size] for i in range(0, len(text), size)]
+        assert feed_all(ArrayItemParser("variants"), chunks) == [
+            {"headline": "one", "tags": ["a", "b"]},
+            {"headline": "two", "nested": {"k": 1}},
+        ]
+
+
+def test_escaped_quotes_and_braces_inside_strings():
+    text = r'{"variants": [{"copy": "say \"hi\" {not a brace} [or bracket]"}, {"copy": "back\\"}]}'
+    chunks = [text[i:i + 3] for i in range(0, len(text), 3)]
+    assert feed_all(ArrayItemParser("variants"), chunks) == [
+        {"copy": 'say "hi" {not a brace} [or bracket]'},
+        {"copy": "back\\"},
+    ]
+
+
+def test_other_keys_are_ignored():
+    parser = ArrayItemParser("variants")
+    items = parser.feed('{"notes": [{"x": 1}], "meta": {"variants": [{"y": 2}]}, "variants": [{"z": 3}]}')
+    assert items == [{"z": 3}]
+
+
+def test_top_level_array():
+    assert ArrayItemParser().feed('[{"a": 1}, {"b": 2}]') == [{"a": 1}, {"b": 2}]
+
+
+def test_truncated_output_keeps_complete_items():
+    parser = ArrayItemParser("variants")
+    assert parser.feed('{"variants": [{"a": 1}, {"b": 2}, {"c": "cut off mid') == [{"a": 1}, {"b": 2}]
+    assert not parser.finished
+
+
+def test_nothing_after_the_array_closes():
+    parser = ArrayItemParser("variants")
+    assert parser.feed('{"variants": [{"a": 1}], "variants2": [{"b": 2}]}') == [{"a": 1}]
+    assert parser.finished
+    assert parser.feed('{"c": 3}') == []
@@ -0,0 +1,80 @@
+import time
+from datetime import datetime, timezone
+
+import pytest
+
+from grokads import llm_cache
+
+
+class Backend:
+    def __init__(self, name, entry=None, fail=False):
+        self.name = name
+        self.entries = {} if entry is None else {"key": entry}
+        self.fail = fail
+
+    def get(self, key):
+        return self.entries.get(key)
+
+    def set(self, key, entry):
+        if self.fail:
+            raise RuntimeError(f"{self.name} is down")
+        self.entries[key] = entry
+
+
+@pytest.fixture
+def backends(monkeypatch):
+    backends = []
+    monkeypatch.setattr(llm_cache, "get_backends", lambda: backends)
+    monkeypatch.setattr(llm_cache, "cache_key", lambda payload: "key")
+    monkeypatch.setattr(llm_cache, "_stats", {})
+    return backends
+
+
+def entry(expires_in):
+    return {"body": '{"ok": true}', "policy": "predict_performance", "expires_at": time.time() + expires_in}
+
+
+def test_hit_in_a_later_tier_is_promoted(backends):
+    memory, shared = Backend("memory"), Backend("firestore", entry(60))
+    backends += [memory, shared]
+    assert llm_cache.lookup("predict_performance", {}).json() == {"ok": True}
+    assert "key" in memory.entries
+
+
+def test_failed_promotion_still_serves_the_hit(backends):
+    backends += [Backend("memory", fail=True), Backend("firestore", entry(60))]
+    response = llm_cache.lookup("predict_performance", {})
+    assert response.headers["X-Grok-Cache"] == "hit"
+    assert llm_cache.stats()["predict_performance"]["errors"] == 1
+
+
+def test_expired_entries_are_misses(backends):
+    backends.append(Backend("firestore", entry(-1)))
+    assert llm_cache.lookup("predict_performance", {}) is None
+    assert llm_cache.stats()["predict_performance"]["misses"] == 1
+
+
+def test_firestore_entries_carry_a_ttl_timestamp(monkeypatch):
+    written = {}
+
+    class Document:
+        def __init__(self, key):
+            self.key = key
+
+        def set(self, data):
+            written[self.key] = data
+
+    class Collection:
+        def document(self, key):
+            return Document(key)
+
+    class Client:
+        def collection(self, name):
+            assert name == llm_cache.COLLECTION
+            return Collection()
+
+    monkeypatch.setattr(llm_cache, "get_firestore", lambda: Client())
+    stored = entry(3600)
+    llm_cache.FirestoreBackend().set("key", stored)
+    assert written["key"]["body"] == stored["body"]
+    assert written["key"]["expire_at"] == datetime.fromtimestamp(stored["expires_at"], timezone.utc)
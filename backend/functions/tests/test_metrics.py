@@ -0,0 +1,125 @@
+import json
+import time
+
+import pytest
+from google.cloud import firestore
+
+from grokads import metrics
+
+
+class Snapshot:
+    def __init__(self, doc_id, data):
+        self.id = doc_id
+        self.exists = data is not None
+        self._data = data
+
+    def to_dict(self):
+        return dict(self._data)
+
+
+class Document:
+    def __init__(self, db, doc_id):
+        self.db = db
+        self.id = doc_id
+
+    def get(self, transaction=None):
+        return Snapshot(self.id, self.db.docs.get(self.id))
+
+    def set(self, data):
+        self.db.docs[self.id] = dict(data)
+
+
+class Transaction:
+    def __init__(self, db):
+        self.db = db
+
+    def set(self, ref, data):
+        self.db.docs[ref.id] = dict(data)
+
+    def delete(self, ref):
+        self.db.docs.pop(ref.id, None)
+
+
+class Firestore:
+    """One collection, enough for flush/collect"""
+
+    def __init__(self):
+        self.docs = {}
+
+    def collection(self, name):
+        assert name == metrics.COLLECTION
+        return self
+
+    def document(self, doc_id):
+        return Document(self, doc_id)
+
+    def stream(self):
+        return [Snapshot(doc_id, data) for doc_id, data in list(self.docs.items())]
+
+    def transaction(self):
+        return Transaction(self)
+
+
+@pytest.fixture
+def db(monkeypatch):
+    db = Firestore()
+    monkeypatch.setattr(metrics, "get_firestore", lambda: db)
+    monkeypatch.setattr(firestore, "transactional", lambda fn: fn)
+    monkeypatch.setattr(metrics, "FLUSH_SEC", 60)
+    monkeypatch.setattr(metrics, "RETENTION_SEC", 100)
+    monkeypatch.setattr(metrics, "_counters", {})
+    monkeypatch.setattr(metrics, "_histograms", {})
+    return db
+
+
+def store(db, instance, requests, updated_at):
+    db.docs[instance] = {
+        "snapshot": json.dumps({"counters": [["grokads_requests_total", {"endpoint": "get_trends", "status": "200"}, requests]],
+                                "histograms": []}),
+        "updated_at": updated_at,
+    }
+
+
+def exported_requests(snapshots):
+    counters, _ = metrics._merge(snapshots)
+    return sum(value for (name, _), value in counters.items() if name == "grokads_requests_total")
+
+
+def test_gone_instances_are_folded_into_the_retired_totals(db):
+    store(db, "live", 3, time.time())
+    store(db, "gone-1", 5, time.time() - 1000)
+    store(db, "gone-2", 7, time.time() - 1000)
+
+    assert exported_requests(metrics.collect()) == 15
+    assert set(db.docs) == {"live", metrics.RETIRED_ID, metrics.INSTANCE_ID}
+
+    # Later the live instance goes away too; nothing it counted is lost
+    db.docs["live"]["updated_at"] = time.time() - 1000
+    assert exported_requests(metrics.collect()) == 15
+    assert set(db.docs) == {metrics.RETIRED_ID, metrics.INSTANCE_ID}
+
+
+def test_collect_flushes_this_instance_first(db):
+    metrics.inc("grokads_requests_total", endpoint="get_trends", status="200")
+    assert exported_requests(metrics.collect()) == 1
+    stored = json.loads(db.docs[metrics.INSTANCE_ID]["snapshot"])
+    assert exported_requests([stored]) == 1
+
+
+def test_failed_retirement_keeps_counting_the_snapshot(db, monkeypatch):
+    store(db, "gone", 5, time.time() - 1000)
+
+    def fail(stale_ids):
+        raise RuntimeError("contention")
+
+    monkeypatch.setattr(metrics, "_retire", fail)
+    assert exported_requests(metrics.collect()) == 5
+    assert "gone" in db.docs
+
+
+def test_histograms_survive_retirement(db):
+    snapshot = {"counters": [], "histograms": [["grokads_request_duration_seconds", {"endpoint": "x"},
+                                                 [1] + [0] * (len(metrics.LATENCY_BUCKETS) - 1), 0.005, 1]]}
+    db.docs["gone"] = {"snapshot": json.dumps(snapshot), "updated_at": 0}
+    _, histograms = metrics._merge(metrics.collect())
+    assert histograms[metrics._key("grokads_request_duration_seconds", {"endpoint": "x"})]["count"] == 1
@@ -0,0 +1,81 @@
+import pytest
+
+from grokads import ratelimit
+from grokads.ratelimit import RateLimited, TokenBucket
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(ratelimit, "time", clock)
+    return clock
+
+
+def test_local_bucket_allows_the_burst_then_limits(clock):
+    bucket = TokenBucket("test", rate=2, burst=3, shared=False)
+    assert bucket.shared_store is None
+    for _ in range(3):
+        bucket.acquire(timeout=0)
+    with pytest.raises(RateLimited):
+        bucket.acquire(timeout=0)
+
+
+def test_local_bucket_refills_at_its_rate(clock):
+    bucket = TokenBucket("test", rate=2, burst=3, shared=False)
+    for _ in range(3):
+        bucket.acquire(timeout=0)
+    clock.now += 0.5
+    bucket.acquire(timeout=0)
+    with pytest.raises(RateLimited):
+        bucket.acquire(timeout=0)
+    # Waits for the next token instead of failing
+    started = clock.now
+    bucket.acquire(timeout=5)
+    assert 0.5 <= clock.now - started < 1
+
+
+def test_local_bucket_never_leases(clock):
+    bucket = TokenBucket("test", rate=1, burst=10, lease_size=5, shared=False)
+    assert bucket.lease_size == 1
+    bucket.acquire(timeout=0)
+    assert bucket._leased == 0
+
+
+def test_block_pauses_the_bucket(clock):
+    bucket = TokenBucket("test", rate=10, burst=10, shared=False)
+    bucket.block(2)
+    with pytest.raises(RateLimited):
+        bucket.acquire(timeout=1)
+    clock.now += 2
+    bucket.acquire(timeout=0)
+
+
+class CountingStore(ratelimit.MemoryBucketStore):
+    def __init__(self):
+        super().__init__()
+        self.takes = 0
+
+    def take(self, name, want, rate, burst, now):
+        self.takes += 1
+        return super().take(name, want, rate, burst, now)
+
+
+def test_shared_bucket_leases_tokens(clock):
+    bucket = TokenBucket("test", rate=1, burst=8, lease_size=4, shared=True)
+    bucket.shared_store = CountingStore()
+    for _ in range(8):
+        bucket.acquire(timeout=0)
+    assert bucket.shared_store.takes == 2
+    with pytest.raises(RateLimited):
+        bucket.acquire(timeout=0)
@@ -0,0 +1,62 @@
+import json
+
+import pytest
+
+from grokads import llm_cache, token_budget
+
+
+class Response:
+    def __init__(self, completion_tokens, finish_reason="stop", status_code=200, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.text = json.dumps({
+            "usage": {"completion_tokens": completion_tokens},
+            "choices": [{"finish_reason": finish_reason}],
+        })
+
+    def json(self):
+        return json.loads(self.text)
+
+
+@pytest.fixture(autouse=True)
+def uncalibrated(monkeypatch):
+    monkeypatch.setattr(token_budget, "_calibrated", {})
+
+
+def test_plan_uses_the_priors_in_fixed_buckets():
+    assert token_budget.plan("strategy") == 2048
+    assert token_budget.plan("variants", 5) == 2048
+    assert token_budget.plan("variants", 1) == 256
+    assert token_budget.plan("media_suggestions") == 512
+    assert all(token_budget.plan("variants", n) in token_budget.BUCKETS for n in range(1, 40))
+
+
+def test_plan_never_exceeds_the_ceiling():
+    assert token_budget.plan("predictions", 100) == token_budget.CEILING
+
+
+def test_max_items_fit_under_the_ceiling():
+    items = token_budget.max_items("variants")
+    overhead, prior = token_budget.PROFILES["variants"]
+    assert overhead + items * prior <= token_budget.CEILING < overhead + (items + 1) * prior
+
+
+def test_observe_calibrates_the_per_item_cost():
+    token_budget.observe("variants", Response(40 + 5 * 100), 5)
+    assert token_budget._calibrated["variants"] == 100
+    token_budget.observe("variants", Response(40 + 5 * 200), 5)
+    assert token_budget._calibrated["variants"] == pytest.approx(100 + token_budget.ALPHA * 100)
+    assert token_budget.plan("variants", 5) == 1024
+
+
+def test_truncated_completion_raises_the_estimate():
+    token_budget.observe("variants", Response(40 + 5 * 100), 5)
+    token_budget.observe("variants", Response(40 + 5 * 100, finish_reason="length"), 5)
+    assert token_budget._calibrated["variants"] == pytest.approx(100 * token_budget.TRUNCATION_GROWTH)
+
+
+def test_observe_skips_failed_and_cached_answers():
+    token_budget.observe("variants", Response(500, status_code=500), 5)
+    token_budget.observe("variants", Response(500, headers={"X-Grok-Cache": "hit"}), 5)
+    token_budget.observe("variants", llm_cache.CachedResponse(Response(500).text), 5)
+    assert token_budget._calibrated == {}
@@ -0,0 +1,77 @@
+import socket
+
+import pytest
+import requests
+
+from grokads import upstream
+
+
+@pytest.fixture
+def dns(monkeypatch):
+    """Resolve names from a dict; each lookup pops the next answer for rebinding tests"""
+    answers = {}
+    lookups = []
+
+    def getaddrinfo(host, port, *args, **kwargs):
+        lookups.append(host)
+        ips = answers[host].pop(0) if len(answers[host]) > 1 else answers[host][0]
+        return [(socket.AF_INET6 if ":" in ip else socket.AF_INET, socket.SOCK_STREAM, 6, "", (ip, port)) for ip in ips]
+
+    monkeypatch.setattr(upstream.socket, "getaddrinfo", getaddrinfo)
+    return answers, lookups
+
+
+@pytest.mark.parametrize("url, ips, error", [
+    ("https://cdn.test/video.mp4", ["93.184.216.34"], None),
+    ("http://cdn.test/video.mp4", ["93.184.216.34"], "must be an https URL"),
+    ("https:///video.mp4", [], "must be an https URL"),
+    ("https://cdn.test/v", ["10.0.0.5"], "must not point to"),
+    ("https://cdn.test/v", ["93.184.216.34", "127.0.0.1"], "must not point to"),
+    ("https://cdn.test/v", ["169.254.169.254"], "must not point to"),
+    ("https://cdn.test/v", ["::1"], "must not point to"),
+])
+def test_public_url_error(dns, url, ips, error):
+    answers, _ = dns
+    answers["cdn.test"] = [ips]
+    result = upstream.public_url_error(url)
+    assert result == error if error is None else error in result
+
+
+class Sent(Exception):
+    pass
+
+
+def test_request_connects_to_the_checked_address(dns, monkeypatch):
+    answers, lookups = dns
+    # Public when checked, loopback for any later lookup
+    answers["rebind.test"] = [["93.184.216.34"], ["127.0.0.1"]]
+    connected = []
+
+    def send(adapter, request, **kwargs):
+        pool = adapter.get_connection(request.url)
+        adapter.add_headers(request)
+        connected.append((pool.host, pool.conn_kw["server_hostname"], request.headers["Host"]))
+        raise Sent()
+
+    monkeypatch.setattr(upstream._PinnedAdapter, "send", send)
+    with pytest.raises(Sent):
+        upstream.request_public("GET", "https://rebind.test:8443/video.mp4", timeout=5)
+    assert connected == [("93.184.216.34", "rebind.test", "rebind.test:8443")]
+    assert lookups == ["rebind.test"]
+
+
+def test_redirects_are_checked(dns, monkeypatch):
+    answers, _ = dns
+    answers["cdn.test"] = [["93.184.216.34"]]
+    answers["internal.test"] = [["10.0.0.5"]]
+
+    def send(adapter, request, **kwargs):
+        response = requests.Response()
+        response.status_code = 302
+        response.headers["Location"] = "https://internal.test/secret"
+        response.url = request.url
+        return response
+
+    monkeypatch.setattr(upstream._PinnedAdapter, "send", send)
+    with pytest.raises(ValueError, match="private"):
+        upstream.request_public("GET", "https://cdn.test/video.mp4", timeout=5)
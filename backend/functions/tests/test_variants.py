@@ -0,0 +1,33 @@
+import pytest
+
+from grokads import token_budget
+from grokads.variants import parse_variants, split_into_shards
+
+
+@pytest.mark.parametrize("num_variants, shard_size, expected", [
+    (12, 5, [5, 5, 2]),
+    (10, 5, [5, 5]),
+    (3, 5, [3]),
+    (1, 1, [1]),
+    (4, 0, [4]),
+])
+def test_split_into_shards(num_variants, shard_size, expected, monkeypatch):
+    monkeypatch.setattr("grokads.variants.SHARD_SIZE", 4)
+    assert split_into_shards(num_variants, shard_size) == expected
+
+
+def test_split_into_shards_respects_the_token_budget(monkeypatch):
+    monkeypatch.setattr(token_budget, "max_items", lambda profile: 3)
+    assert split_into_shards(8, 5, budget="variants") == [3, 3, 2]
+    assert sum(split_into_shards(50, 5, budget="variants")) == 50
+
+
+def test_parse_variants():
+    assert parse_variants('{"variants": [{"a": 1}, "junk", {"b": 2}]}') == [{"a": 1}, {"b": 2}]
+    assert parse_variants('[{"a": 1}]') == [{"a": 1}]
+    assert parse_variants('{"other": []}') == []
+    assert parse_variants("not json") == []
+
+
+def test_parse_variants_keeps_complete_items_of_a_truncated_answer():
+    assert parse_variants('{"variants": [{"a": 1}, {"b": "cut of') == [{"a": 1}]
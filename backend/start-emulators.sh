@@ -12,6 +12,9 @@ else
     exit 1
 fi
 
+# The video codebase needs its own copy of the shared package
+bash "$(dirname "$0")/sync-shared.sh"
+
 # Start Firebase emulators
 echo "🚀 Starting Firebase emulators..."
 firebase emulators:start
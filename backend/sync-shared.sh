@@ -0,0 +1,14 @@
+#!/bin/bash
+# Copy the shared grokads package from the default codebase into the video
+# codebase. Firebase uploads each codebase's source directory on its own, so
+# the video functions need their own copy. Runs as a predeploy hook and from
+# start-emulators.sh.
+
+set -e
+
+BACKEND_DIR="$(cd "$(dirname "$0")" && pwd)"
+
+rm -rf "$BACKEND_DIR/video/grokads"
+cp -R "$BACKEND_DIR/functions/grokads" "$BACKEND_DIR/video/grokads"
+find "$BACKEND_DIR/video/grokads" -name "__pycache__" -type d -prune -exec rm -rf {} +
+echo "✅ Synced shared grokads package into video/"
@@ -0,0 +1,634 @@
+from firebase_functions import https_fn, firestore_fn
+from firebase_functions.options import CorsOptions, MemoryOption, set_global_options
+import json
+import os
+import base64
+import asyncio
+import tempfile
+import time
+import uuid
+from pathlib import Path
+
+from grokads import assets, concurrency, jobs, metrics, storage, upstream
+from grokads.suggestions import SUGGESTIONS_GRACE_SEC, generate_suggestions
+from overlay import ENGINES, MAX_LAYERS, build_layer, build_preview, render_overlay, video_metadata
+from overlay.renditions import build_renditions, render_renditions
+from overlay.uploads import InputError, file_response_body, has_video_source, read_params, save_video, wants_binary
+
+# Heavy dependencies (openai, moviepy -> numpy/imageio, Pillow) are imported
+# inside the handlers and overlay engines that use them so that importing this
+# module stays cheap.
+
+# Load environment variables from .env file (local development only)
+env_path = Path(__file__).parent.parent / '.env'
+if env_path.exists():
+    from dotenv import load_dotenv
+    load_dotenv(env_path)
+    print(f"✅ Loaded .env file from {env_path}")
+
+# For cost control, you can set the maximum number of containers that can be
+# running at the same time. This helps mitigate the impact of unexpected
+# traffic spikes by instead downgrading performance. This limit is a per-function
+# limit. You can override the limit for each function using the max_instances
+# parameter in the decorator, e.g. @https_fn.on_request(max_instances=5).
+set_global_options(max_instances=10)
+
+
+def get_openai_clients(openai_api_key):
+    """Create (async, sync) OpenAI clients; openai is imported lazily"""
+    from openai import OpenAI, AsyncOpenAI
+    return AsyncOpenAI(api_key=openai_api_key), OpenAI(api_key=openai_api_key)
+
+
+async def create_and_poll_video(async_client, user_prompt, on_progress=None):
+    """Create a Sora video and poll until it leaves the queued/in_progress states
+
+    `on_progress(video)` is called after every poll, e.g. to persist job progress.
+    """
+    print(f"Starting video generation with prompt: {user_prompt}")
+    started = time.perf_counter()
+    
+    # Create video
+    video = await async_client.videos.create(
+        model="sora-2",
+        prompt=user_prompt,
+        seconds='4',
+    )
+    
+    print(f"Video creation started. Video ID: {video.id if hasattr(video, 'id') else 'N/A'}")
+    print(f"Initial status: {video.status if hasattr(video, 'status') else 'N/A'}")
+    
+    # Poll for completion, logging only when the status or progress changes
+    last_logged = None
+    
+    while video.status in ("in_progress", "queued"):
+        progress = getattr(video, "progress", 0) or 0
+        if (video.status, progress) != last_logged:
+            last_logged = (video.status, progress)
+            status_text = "Queued" if video.status == "queued" else "Processing"
+            print(f"{status_text}: {progress:.1f}%" if progress > 0 else f"{status_text}: Status: {video.status}")
+        
+        if on_progress:
+            on_progress(video)
+        
+        # Wait before next poll
+        await asyncio.sleep(2)
+        
+        # Refresh status
+        video = await async_client.videos.retrieve(video.id)
+    
+    # Final status log
+    progress = getattr(video, "progress", 100 if video.status == "completed" else 0)
+    print(f"Final status: {video.status}, Progress: {progress}%")
+    # Time from creation to a final status (the polls themselves are cheap)
+    metrics.observe_upstream("api.openai.com", video.status, time.perf_counter() - started)
+    
+    return video
+
+
+def stream_video_to_storage(sync_client, video, storage_path, user_prompt):
+    """Stream a finished Sora video into media storage and register it as an asset; returns the asset"""
+    width, _, height = str(getattr(video, "size", "") or "").partition("x")
+    seconds = getattr(video, "seconds", None)
+    with sync_client.videos.with_streaming_response.download_content(video.id, variant="video") as video_stream:
+        return assets.put_stream(
+            storage_path,
+            video_stream.iter_bytes(storage.CHUNK_SIZE),
+            "video/mp4",
+            producer="generate_ad",
+            source_prompt=user_prompt,
+            width=int(width) if width.isdigit() else None,
+            height=int(height) if height.isdigit() else None,
+            duration=float(seconds) if seconds else None,
+        )
+
+
+def read_base64(storage_path):
+    """Read a stored file back as base64 (only for clients that opt into inline media)"""
+    with storage.open_read(storage_path) as f:
+        return base64.b64encode(f.read()).decode('utf-8')
+
+
+def video_error_message(video):
+    error_message = "Video generation failed"
+    if hasattr(video, 'error') and video.error:
+        if hasattr(video.error, 'message'):
+            error_message = video.error.message
+    return error_message
+
+
+@https_fn.on_request(
+    cors=CorsOptions(
+        cors_origins=["http://localhost:3000", "https://*.web.app", "https://*.firebaseapp.com"],
+        cors_methods=["GET", "POST"]
+    ),
+    timeout_sec=300  # 5 minutes timeout
+)
+@metrics.instrument
+def generate_ad(req: https_fn.Request) -> https_fn.Response:
+    """Generate an ad using LLM based on user prompt
+
+    The video is streamed into media storage and returned as a short-lived
+    `video_url`; pass `"include_base64": true` to also get it inline.
+
+    With `"async": true` in the body the video is rendered by a background
+    job: the response is 202 with a `job_id` to poll via `get_video_job`,
+    and `webhook_url` (optional) is POSTed the job when it finishes.
+    """
+    
+    if req.method == "OPTIONS":
+        return https_fn.Response("", status=204)
+    
+    if req.method != "POST":
+        return https_fn.Response(
+            json.dumps({"error": "Method not allowed"}),
+            status=405,
+            headers={"Content-Type": "application/json"}
+        )
+    
+    try:
+        data = req.get_json(silent=True)
+        if not data or "prompt" not in data:
+            return https_fn.Response(
+                json.dumps({"error": "Missing 'prompt' in request body"}),
+                status=400,
+                headers={"Content-Type": "application/json"}
+            )
+        
+        user_prompt = data["prompt"]
+        
+        # Get OpenAI API key from environment variable
+        # Set this with: firebase functions:secrets:set OPENAI_API_KEY
+        openai_api_key = upstream.get_secret("OPENAI_API_KEY")
+        
+        if not openai_api_key:
+            return https_fn.Response(
+                json.dumps({"error": "OpenAI API key not configured. Please set OPENAI_API_KEY environment variable."}),
+                status=500,
+                headers={"Content-Type": "application/json"}
+            )
+        
+        # Async mode: queue a job and return immediately
+        if data.get("async"):
+            webhook_url = data.get("webhook_url")
+            webhook_error = jobs.webhook_url_error(webhook_url) if webhook_url else None
+            if webhook_error:
+                return https_fn.Response(
+                    json.dumps({"error": f"'webhook_url' {webhook_error}"}),
+                    status=400,
+                    headers={"Content-Type": "application/json"}
+                )
+            
+            job_id = jobs.create_job("video_ad", {"prompt": user_prompt}, webhook_url=webhook_url)
+            print(f"Queued video job {job_id}")
+            return https_fn.Response(
+                json.dumps({
+                    "job_id": job_id,
+                    "status": "queued",
+                    "message": "Video generation queued. Poll get_video_job for progress."
+                }),
+                status=202,
+                headers={"Content-Type": "application/json"}
+            )
+        
+        # Initialize OpenAI client (async for polling)
+        async_client, sync_client = get_openai_clients(openai_api_key)
+        
+        # The suggestions only depend on the prompt, so they are generated
+        # while Sora renders instead of after the download
+        suggestions_future = concurrency.submit(generate_suggestions, user_prompt, "video")
+        
+        # Call Sora API to generate video
+        try:
+            # Run async function
+            video = asyncio.run(create_and_poll_video(async_client, user_prompt))
+            
+            print(f"Video generation completed. Status: {video.status}")
+            print(f"Video ID: {video.id if hasattr(video, 'id') else 'N/A'}")
+            
+            # Check if video generation failed
+            if video.status == "failed":
+                error_message = video_error_message(video)
+                print(f"Video generation failed: {error_message}")
+                return https_fn.Response(
+                    json.dumps({"error": error_message}),
+                    status=500,
+                    headers={"Content-Type": "application/json"}
+                )
+            
+            # Download video content
+            if video.status == "completed":
+                try:
+                    print("Downloading video content...")
+                    # Stream the video straight into storage in chunks
+                    asset = stream_video_to_storage(sync_client, video, f"videos/{video.id}.mp4", user_prompt)
+                    storage_path, size_bytes = asset["storage_path"], asset["size_bytes"]
+                    print(f"Video stored at {storage_path} (asset {asset['asset_id']}). Size: {size_bytes} bytes")
+                    
+                    # AI suggestions for text overlay, caption, and hashtags
+                    suggestions = concurrency.result_or_default(
+                        suggestions_future, SUGGESTIONS_GRACE_SEC, {}, "Suggestions"
+                    )
+                    
+                    # Convert video object to dictionary for JSON serialization
+                    media = storage.media_info(storage_path, "video/mp4", size_bytes)
+                    video_data = {
+                        "id": video.id if hasattr(video, 'id') else None,
+                        "status": video.status if hasattr(video, 'status') else None,
+                        "video_url": media["url"],
+                        "url_expires_at": media["url_expires_at"],
+                        "storage_path": storage_path,
+                        "size_bytes": size_bytes,
+                        "prompt": user_prompt,
+                        "mime_type": "video/mp4",
+                        "suggestions": suggestions,
+                        **assets.response_fields(asset)
+                    }
+                    
+                    # Inline base64 is only sent when explicitly requested
+                    if data.get("include_base64"):
+                        video_data["video_base64"] = read_base64(storage_path)
+                    
+                    print("Video generation completed successfully")
+                    return https_fn.Response(
+                        json.dumps({
+                            "video": video_data,
+                            "message": "Video generation completed successfully"
+                        }),
+                        status=200,
+                        headers={"Content-Type": "application/json"}
+                    )
+                except Exception as download_error:
+                    print(f"Failed to download video: {str(download_error)}")
+                    return https_fn.Response(
+                        json.dumps({"error": f"Failed to download video: {str(download_error)}"}),
+                        status=500,
+                        headers={"Content-Type": "application/json"}
+                    )
+            else:
+                # Unexpected status
+                print(f"Unexpected video status: {video.status}")
+                return https_fn.Response(
+                    json.dumps({
+                        "error": f"Unexpected video status: {video.status}",
+                        "video_id": video.id if hasattr(video, 'id') else None
+                    }),
+                    status=500,
+                    headers={"Content-Type": "application/json"}
+                )
+            
+        except Exception as api_error:
+            print(f"Sora API error: {str(api_error)}")
+            return https_fn.Response(
+                json.dumps({"error": f"Sora API error: {str(api_error)}"}),
+                status=500,
+                headers={"Content-Type": "application/json"}
+            )
+        
+    except Exception as e:
+        return https_fn.Response(
+            json.dumps({"error": f"Internal server error: {str(e)}"}),
+            status=500,
+            headers={"Content-Type": "application/json"}
+        )
+
+
+@firestore_fn.on_document_created(
+    document=f"{jobs.COLLECTION}/{{job_id}}",
+    timeout_sec=540,
+    memory=MemoryOption.GB_1
+)
+@metrics.instrument
+def process_video_job(event: firestore_fn.Event[firestore_fn.DocumentSnapshot | None]) -> None:
+    """Render a queued video job and persist its progress and result to Firestore"""
+    
+    job_id = event.params["job_id"]
+    job = jobs.claim_job(job_id)
+    if job is None:
+        print(f"Job {job_id} already claimed, skipping")
+        return
+    
+    user_prompt = job["params"]["prompt"]
+    
+    try:
+        openai_api_key = upstream.get_secret("OPENAI_API_KEY")
+        if not openai_api_key:
+            raise RuntimeError("OpenAI API key not configured")
+        
+        async_client, sync_client = get_openai_clients(openai_api_key)
+        suggestions_future = concurrency.submit(generate_suggestions, user_prompt, "video")
+        
+        last_progress = {"value": None}
+        
+        def on_progress(video):
+            # Only write when something changed to keep Firestore writes down
+            progress = int(getattr(video, "progress", 0) or 0)
+            if progress != last_progress["value"]:
+                last_progress["value"] = progress
+                jobs.update_job(job_id, progress=progress, sora_video_id=video.id)
+        
+        video = asyncio.run(create_and_poll_video(async_client, user_prompt, on_progress=on_progress))
+        
+        if video.status != "completed":
+            error_message = video_error_message(video) if video.status == "failed" else f"Unexpected video status: {video.status}"
+            jobs.fail_job(job_id, error_message)
+            return
+        
+        print("Downloading video content...")
+        asset = stream_video_to_storage(sync_client, video, f"videos/{job_id}.mp4", user_prompt)
+        storage_path, size_bytes = asset["storage_path"], asset["size_bytes"]
+        print(f"Video stored at {storage_path} (asset {asset['asset_id']}, {size_bytes} bytes)")
+        
+        jobs.complete_job(job_id, {
+            "id": video.id,
+            "prompt": user_prompt,
+            "storage_path": storage_path,
+            "mime_type": "video/mp4",
+            "size_bytes": size_bytes,
+            "asset_id": asset["asset_id"],
+            "suggestions": concurrency.result_or_default(suggestions_future, SUGGESTIONS_GRACE_SEC, {}, "Suggestions")
+        })
+        
+    except Exception as job_error:
+        import traceback
+        traceback.print_exc()
+        jobs.fail_job(job_id, f"Video generation failed: {str(job_error)}")
+        
+    finally:
+        finished = jobs.get_job(job_id)
+        if finished and finished.get("webhook_url"):
+            if finished.get("result") and finished["result"].get("storage_path"):
+                finished["result"]["video_url"] = storage.signed_url(finished["result"]["storage_path"])
+            jobs.notify_webhook(finished)
+
+
+@https_fn.on_request(
+    cors=CorsOptions(
+        cors_origins=["http://localhost:3000", "https://*.web.app", "https://*.firebaseapp.com"],
+        cors_methods=["GET", "POST"]
+    ),
+    timeout_sec=300  # 5 minutes timeout for video processing
+)
+@metrics.instrument
+def add_text_overlay(req: https_fn.Request) -> https_fn.Response:
+    """Add one or more text overlays to a video at specific locations"""
+    
+    if req.method == "OPTIONS":
+        return https_fn.Response("", status=204)
+    
+    if req.method != "POST":
+        return https_fn.Response(
+            json.dumps({"error": "Method not allowed"}),
+            status=405,
+            headers={"Content-Type": "application/json"}
+        )
+    
+    try:
+        # JSON body, or the `params` of a raw/multipart video upload
+        try:
+            data = read_params(req)
+        except InputError as input_error:
+            return https_fn.Response(
+                json.dumps({"error": str(input_error)}),
+                status=400,
+                headers={"Content-Type": "application/json"}
+            )
+        if not data:
+            return https_fn.Response(
+                json.dumps({"error": "Missing request body"}),
+                status=400,
+                headers={"Content-Type": "application/json"}
+            )
+        
+        # Text layers: an ordered `layers` list, or a single layer given by the top-level parameters
+        raw_layers = data.get("layers", [data])
+        if not isinstance(raw_layers, list) or not raw_layers:
+            return https_fn.Response(
+                json.dumps({"error": "'layers' must be a non-empty list"}),
+                status=400,
+                headers={"Content-Type": "application/json"}
+            )
+        
+        if len(raw_layers) > MAX_LAYERS:
+            return https_fn.Response(
+                json.dumps({"error": f"Too many layers: at most {MAX_LAYERS} allowed"}),
+                status=400,
+                headers={"Content-Type": "application/json"}
+            )
+        
+        layers = []
+        for index, raw_layer in enumerate(raw_layers):
+            try:
+                layers.append(build_layer(raw_layer))
+            except ValueError as layer_error:
+                message = str(layer_error) if "layers" not in data else f"Layer {index}: {str(layer_error)}"
+                return https_fn.Response(
+                    json.dumps({"error": message}),
+                    status=400,
+                    headers={"Content-Type": "application/json"}
+                )
+        
+        # Video input - a raw or multipart upload, a storage path, a URL or base64
+        if not has_video_source(req, data):
+            return https_fn.Response(
+                json.dumps({"error": "Missing video: upload it, or pass 'asset_id', 'video_storage_path', 'video_url' or 'video_base64'"}),
+                status=400,
+                headers={"Content-Type": "application/json"}
+            )
+        
+        # Rendering engine: "ffmpeg" (default) or "moviepy"
+        if data.get("engine") and data["engine"] not in ENGINES:
+            return https_fn.Response(
+                json.dumps({"error": f"Invalid 'engine', expected one of: {', '.join(ENGINES)}"}),
+                status=400,
+                headers={"Content-Type": "application/json"}
+            )
+        
+        # Preview mode: a single composited frame or a low-resolution proxy clip
+        try:
+            preview = build_preview(data.get("preview"))
+        except ValueError as preview_error:
+            return https_fn.Response(
+                json.dumps({"error": str(preview_error)}),
+                status=400,
+                headers={"Content-Type": "application/json"}
+            )
+        
+        # Renditions: several aspect ratios/sizes from one decode pass (ffmpeg engine only)
+        try:
+            renditions = build_renditions(data.get("renditions"))
+        except ValueError as renditions_error:
+            return https_fn.Response(
+                json.dumps({"error": str(renditions_error)}),
+                status=400,
+                headers={"Content-Type": "application/json"}
+            )
+        
+        if renditions and (preview or data.get("engine") == "moviepy"):
+            return https_fn.Response(
+                json.dumps({"error": "'renditions' can't be combined with 'preview' or the moviepy engine"}),
+                status=400,
+                headers={"Content-Type": "application/json"}
+            )
+        
+        # Create temporary files for input and output
+        input_video_path = None
+        output_video_path = None
+        
+        try:
+            # Stream the video to a temporary file in chunks
+            with tempfile.NamedTemporaryFile(delete=False, suffix=".mp4") as temp_input:
+                input_video_path = temp_input.name
+            try:
+                video_size = save_video(req, data, input_video_path)
+            except InputError as input_error:
+                return https_fn.Response(
+                    json.dumps({"error": str(input_error)}),
+                    status=400,
+                    headers={"Content-Type": "application/json"}
+                )
+            
+            print(f"Video saved to temporary file: {input_video_path}")
+            print(f"Video size: {video_size} bytes")
+            
+            if renditions:
+                manifest = render_renditions(input_video_path, layers, renditions, parent_asset_id=data.get("asset_id"))
+                print(f"Rendered {len(manifest)} rendition(s)")
+                return https_fn.Response(
+                    json.dumps({
+                        "renditions": manifest,
+                        "message": "Renditions rendered successfully",
+                        "layers": len(layers),
+                        "engine": "ffmpeg"
+                    }),
+                    status=200,
+                    headers={"Content-Type": "application/json"}
+                )
+            
+            # Create output temporary file
+            with tempfile.NamedTemporaryFile(delete=False, suffix=preview["suffix"] if preview else ".mp4") as temp_output:
+                output_video_path = temp_output.name
+            
+            for layer in layers:
+                print(f"Creating text overlay: '{layer['text']}' at position ({layer['position_x']}, {layer['position_y']})")
+            try:
+                engine = render_overlay(input_video_path, output_video_path, layers, engine=data.get("engine"), preview=preview)
+            except ValueError as render_error:
+                return https_fn.Response(
+                    json.dumps({"error": str(render_error)}),
+                    status=400,
+                    headers={"Content-Type": "application/json"}
+                )
+            print(f"Overlay rendered with the {engine} engine")
+            
+            if wants_binary(req, data):
+                # The rendered file itself, streamed from disk (not stored)
+                mime_type = preview["mime_type"] if preview else "video/mp4"
+                return https_fn.Response(
+                    file_response_body(output_video_path),
+                    status=200,
+                    headers={
+                        "Content-Type": mime_type,
+                        "Content-Length": str(os.path.getsize(output_video_path)),
+                        "X-Overlay-Engine": engine
+                    },
+                    direct_passthrough=True
+                )
+            
+            if preview and preview["mode"] == "frame":
+                # Frame previews are small and short-lived: returned inline, never stored
+                with open(output_video_path, 'rb') as f:
+                    image_base64 = base64.b64encode(f.read()).decode('utf-8')
+                return https_fn.Response(
+                    json.dumps({
+                        "image_base64": image_base64,
+                        "mime_type": preview["mime_type"],
+                        "preview": "frame",
+                        "time": preview["time"],
+                        "layers": len(layers),
+                        "engine": engine
+                    }),
+                    status=200,
+                    headers={"Content-Type": "application/json"}
+                )
+            
+            # Upload the output file to media storage (streamed from disk). Final
+            # renders are content-addressed assets; proxy previews are throwaway.
+            asset = None
+            if preview:
+                storage_path = f"previews/{uuid.uuid4().hex}.mp4"
+                output_size = storage.save_file(storage_path, output_video_path, "video/mp4")
+            else:
+                asset = assets.put_file(
+                    output_video_path,
+                    "video/mp4",
+                    producer="add_text_overlay",
+                    parent_asset_id=data.get("asset_id"),
+                    **video_metadata(output_video_path)
+                )
+                storage_path, output_size = asset["storage_path"], asset["size_bytes"]
+            print(f"Output video stored at {storage_path}. Size: {output_size} bytes")
+            
+            media = storage.media_info(storage_path, "video/mp4", output_size)
+            result = {
+                "video_url": media["url"],
+                "url_expires_at": media["url_expires_at"],
+                "storage_path": storage_path,
+                "size_bytes": output_size,
+                "mime_type": "video/mp4",
+                "message": "Preview rendered successfully" if preview else "Text overlay added successfully",
+                "text": layers[0]["text"],
+                "position": {"x": layers[0]["position_x"], "y": layers[0]["position_y"]},
+                "layers": len(layers),
+                "engine": engine
+            }
+            if preview:
+                result["preview"] = "proxy"
+            else:
+                result.update(assets.response_fields(asset))
+            
+            # Inline base64 is only sent when explicitly requested
+            if data.get("include_base64"):
+                with open(output_video_path, 'rb') as f:
+                    result["video_base64"] = base64.b64encode(f.read()).decode('utf-8')
+            
+            return https_fn.Response(
+                json.dumps(result),
+                status=200,
+                headers={"Content-Type": "application/json"}
+            )
+            
+        except Exception as video_error:
+            print(f"Video processing error: {str(video_error)}")
+            import traceback
+            traceback.print_exc()
+            return https_fn.Response(
+                json.dumps({"error": f"Video processing failed: {str(video_error)}"}),
+                status=500,
+                headers={"Content-Type": "application/json"}
+            )
+            
+        finally:
+            # Clean up temporary files
+            if input_video_path and os.path.exists(input_video_path):
+                try:
+                    os.unlink(input_video_path)
+                    print(f"Cleaned up input file: {input_video_path}")
+                except:
+                    pass
+            
+            if output_video_path and os.path.exists(output_video_path):
+                try:
+                    os.unlink(output_video_path)
+                    print(f"Cleaned up output file: {output_video_path}")
+                except:
+                    pass
+        
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        return https_fn.Response(
+            json.dumps({"error": f"Internal server error: {str(e)}"}),
+            status=500,
+            headers={"Content-Type": "application/json"}
+        )
\ No newline at end of file
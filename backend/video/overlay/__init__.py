@@ -0,0 +1,189 @@
+"""Text overlay rendering for add_text_overlay.
+
+Two engines render the same list of layers, all in one decode/encode pass:
+
+    ffmpeg  - each layer's text is rasterised once to a transparent PNG and
+              composited by a single ffmpeg filter graph (a chain of
+              `overlay` filters with enable-time windows); the audio stream
+              is copied untouched. Default.
+    moviepy - MoviePy's CompositeVideoClip, decoding every frame in Python and
+              re-encoding audio. Kept as a fallback.
+
+Both engines can also render a preview instead of the final video (see
+build_preview): a single composited JPEG/PNG frame at a timestamp, or a
+low-resolution, low-frame-rate proxy clip. Previews use the same layer
+rasters and positions as the final render.
+
+A layer is a dict with text, position_x, position_y, font_size, font_color,
+font_path, stroke_color, stroke_width, start_time, duration and alignment
+(see build_layer). Layers are drawn in order, so later ones are on top.
+
+Configuration (environment variables):
+    OVERLAY_ENGINE       - "ffmpeg" (default) or "moviepy"
+    OVERLAY_MAX_LAYERS   - max layers per request (default 10)
+    OVERLAY_PREVIEW_HEIGHT - default proxy preview height in pixels (default 360)
+    OVERLAY_PREVIEW_FPS  - default proxy preview frame rate (default 12)
+    OVERLAY_FFMPEG_PATH  - ffmpeg binary (default: ffmpeg on PATH, else the
+                           binary bundled with imageio-ffmpeg)
+    OVERLAY_X264_PRESET  - libx264 preset for the ffmpeg engine (default "veryfast")
+    OVERLAY_X264_CRF     - libx264 CRF for the ffmpeg engine (default 23)
+"""
+import math
+import os
+
+from grokads import metrics
+from overlay.fonts import find_font
+
+ENGINES = ("ffmpeg", "moviepy")
+DEFAULT_ENGINE = os.getenv("OVERLAY_ENGINE", "ffmpeg").lower()
+MAX_LAYERS = int(os.getenv("OVERLAY_MAX_LAYERS", "10"))
+ALIGNMENTS = ("left", "center", "right")
+
+PREVIEW_HEIGHT = int(os.getenv("OVERLAY_PREVIEW_HEIGHT", "360"))
+PREVIEW_FPS = int(os.getenv("OVERLAY_PREVIEW_FPS", "12"))
+PREVIEW_MODES = ("frame", "proxy")
+FRAME_FORMATS = {"jpeg": ("image/jpeg", ".jpg"), "png": ("image/png", ".png")}
+
+
+def build_layer(params):
+    """Validate one layer's request parameters and fill in the defaults
+
+    Raises ValueError with a client-facing message.
+    """
+    if not isinstance(params, dict):
+        raise ValueError("Each layer must be an object")
+
+    # Required parameters
+    text = params.get("text")
+    if not text:
+        raise ValueError("Missing required parameter: 'text'")
+
+    # Position parameters (required)
+    position_x = params.get("position_x")
+    position_y = params.get("position_y")
+    if position_x is None or position_y is None:
+        raise ValueError("Missing required parameters: 'position_x' and 'position_y'")
+    position_x, position_y = _position(position_x), _position(position_y)
+
+    alignment = params.get("alignment", "center")  # left, center, right
+    if alignment not in ALIGNMENTS:
+        raise ValueError(f"Invalid 'alignment', expected one of: {', '.join(ALIGNMENTS)}")
+
+    return {
+        "text": str(text),
+        "position_x": position_x,
+        "position_y": position_y,
+        # Optional styling parameters
+        "font_size": params.get("font_size", 50),
+        "font_color": params.get("font_color", "white"),
+        "font_path": find_font(params.get("font_family")),  # None will use default font
+        "stroke_color": params.get("stroke_color", "black"),
+        "stroke_width": params.get("stroke_width", 2),
+        "start_time": params.get("start_time", 0),  # When to start showing text (in seconds)
+        "duration": params.get("duration"),  # How long to show text (None = entire video)
+        "alignment": alignment,
+    }
+
+
+def _position(value):
+    """Pixel offset of a layer's top left corner; keywords like "center" aren't supported by both engines"""
+    try:
+        number = math.nan if isinstance(value, bool) else float(value)
+    except (TypeError, ValueError):
+        number = math.nan
+    if not math.isfinite(number):
+        raise ValueError("'position_x' and 'position_y' must be numbers (pixels from the top left)")
+    return int(number) if number.is_integer() else number
+
+
+def build_preview(params):
+    """Validate the `preview` request parameter; returns None for a full render
+
+    `params` is a mode name or an object: {"mode": "frame", "time": 1.5,
+    "format": "jpeg" | "png"} or {"mode": "proxy", "height": 360, "fps": 12}.
+    Raises ValueError with a client-facing message.
+    """
+    if not params:
+        return None
+    if isinstance(params, str):
+        params = {"mode": params}
+    if not isinstance(params, dict):
+        raise ValueError("'preview' must be \"frame\", \"proxy\" or an object")
+
+    mode = params.get("mode", "frame")
+    if mode not in PREVIEW_MODES:
+        raise ValueError(f"Invalid preview 'mode', expected one of: {', '.join(PREVIEW_MODES)}")
+
+    if mode == "frame":
+        image_format = str(params.get("format", "jpeg")).lower().replace("jpg", "jpeg")
+        if image_format not in FRAME_FORMATS:
+            raise ValueError(f"Invalid preview 'format', expected one of: {', '.join(FRAME_FORMATS)}")
+        timestamp = _preview_number(params, "time", 0, float)
+        if timestamp < 0:
+            raise ValueError("Preview 'time' must not be negative")
+        mime_type, suffix = FRAME_FORMATS[image_format]
+        return {"mode": "frame", "time": timestamp, "format": image_format, "mime_type": mime_type, "suffix": suffix}
+
+    height = _preview_number(params, "height", PREVIEW_HEIGHT, int)
+    fps = _preview_number(params, "fps", PREVIEW_FPS, int)
+    if not 64 <= height <= 1080 or not 1 <= fps <= 30:
+        raise ValueError("Preview 'height' must be 64-1080 and 'fps' 1-30")
+    # libx264 needs even dimensions
+    return {"mode": "proxy", "height": height - height % 2, "fps": fps, "mime_type": "video/mp4", "suffix": ".mp4"}
+
+
+def _preview_number(params, name, default, cast):
+    try:
+        return cast(params.get(name, default))
+    except (TypeError, ValueError):
+        raise ValueError(f"Preview '{name}' must be a number")
+
+
+def video_metadata(path):
+    """Width, height and duration of a video, for its asset record ({} if it can't be probed)"""
+    from overlay import ffmpeg_engine
+    try:
+        info = ffmpeg_engine.probe(path)
+    except Exception as probe_error:
+        print(f"Could not probe {path}: {str(probe_error)}")
+        return {}
+    return {key: info[key] for key in ("width", "height", "duration")}
+
+
+def check_preview(input_path, preview):
+    """Reject a frame preview past the end of the video (ValueError with a client-facing message)"""
+    if not preview or preview["mode"] != "frame":
+        return
+    duration = video_metadata(input_path).get("duration")
+    if duration is not None and preview["time"] >= duration:
+        raise ValueError(f"Preview 'time' must be less than the video duration ({duration:g}s)")
+
+
+def render_overlay(input_path, output_path, layers, engine=None, preview=None):
+    """Render `layers` onto the video at `input_path`; returns the engine that was used
+
+    With `preview` (from build_preview), writes a frame image or a proxy clip
+    instead of the full-quality video.
+
+    If the ffmpeg engine fails (e.g. no ffmpeg binary), MoviePy is used instead.
+    Client errors (ValueError) are raised as they are, without the fallback.
+    """
+    engine = (engine or DEFAULT_ENGINE).lower()
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown overlay engine '{engine}', expected one of {', '.join(ENGINES)}")
+    check_preview(input_path, preview)
+
+    if engine == "ffmpeg":
+        from overlay import ffmpeg_engine
+        try:
+            ffmpeg_engine.render(input_path, output_path, layers, preview=preview)
+            return "ffmpeg"
+        except ValueError:
+            raise
+        except Exception as ffmpeg_error:
+            print(f"ffmpeg overlay failed, falling back to MoviePy: {str(ffmpeg_error)}")
+            metrics.record_fallback("overlay_engine")
+
+    from overlay import moviepy_engine
+    moviepy_engine.render(input_path, output_path, layers, preview=preview)
+    return "moviepy"
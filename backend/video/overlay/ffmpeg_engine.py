@@ -0,0 +1,167 @@
+"""ffmpeg overlay engine: one filter graph, no per-frame Python work.
+
+Each layer's text is rasterised once (overlay.text, cached per instance) and composited with a
+chain of ffmpeg `overlay` filters, each enabled only inside its layer's time
+window. Video is decoded and re-encoded (libx264) once no matter how many
+layers there are; audio is stream-copied.
+
+Previews reuse the same PNGs and overlay positions: a frame preview seeks to
+the timestamp and composites the layers visible there onto one decoded
+frame; a proxy preview scales the composited video down after the overlays
+and encodes it at a low frame rate with the fastest x264 preset.
+"""
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+
+from overlay.text import render_text_png
+
+X264_PRESET = os.getenv("OVERLAY_X264_PRESET", "veryfast")
+X264_CRF = os.getenv("OVERLAY_X264_CRF", "23")
+TIMEOUT_SEC = 240
+PROXY_PRESET = "ultrafast"
+PROXY_CRF = "30"
+
+
+def ffmpeg_binary():
+    """Path of the ffmpeg binary to use"""
+    configured = os.getenv("OVERLAY_FFMPEG_PATH")
+    if configured:
+        return configured
+    on_path = shutil.which("ffmpeg")
+    if on_path:
+        return on_path
+    # MoviePy depends on imageio-ffmpeg, which ships a static ffmpeg build
+    import imageio_ffmpeg
+    return imageio_ffmpeg.get_ffmpeg_exe()
+
+
+def enable_expression(start_time, duration):
+    """ffmpeg timeline expression for [start_time, start_time + duration), like MoviePy"""
+    start = float(start_time)
+    if duration is None:
+        return f"gte(t,{start})"
+    return f"gte(t,{start})*lt(t,{start + float(duration)})"
+
+
+def is_active(layer, timestamp):
+    """Whether the layer is on screen at `timestamp` (same window as enable_expression)"""
+    start = float(layer["start_time"])
+    if timestamp < start:
+        return False
+    return layer["duration"] is None or timestamp < start + float(layer["duration"])
+
+
+def build_filter_graph(layers, timed=True, output_filters="format=yuv420p", outputs="[v]"):
+    """Chain one overlay filter per layer: input 0 is the video, input i+1 is layer i's PNG"""
+    steps = []
+    current = "[0:v]"
+    for index, layer in enumerate(layers):
+        enable = f":enable='{enable_expression(layer['start_time'], layer['duration'])}'" if timed else ""
+        steps.append(
+            f"{current}[{index + 1}:v]overlay=x={int(layer['position_x'])}:y={int(layer['position_y'])}"
+            f"{enable}:format=auto[v{index + 1}]"
+        )
+        current = f"[v{index + 1}]"
+    steps.append(f"{current}{output_filters}{outputs}")
+    return ";".join(steps)
+
+
+def build_command(input_path, text_png_paths, output_path, layers, proxy=None):
+    output_filters = "format=yuv420p"
+    preset, crf = X264_PRESET, X264_CRF
+    if proxy:
+        # Scaled after compositing, so the text sits exactly where the full render puts it
+        output_filters = f"scale=-2:{proxy['height']},fps={proxy['fps']},format=yuv420p"
+        preset, crf = PROXY_PRESET, PROXY_CRF
+
+    command = [ffmpeg_binary(), "-hide_banner", "-loglevel", "error", "-y", "-i", input_path]
+    for text_png_path in text_png_paths:
+        command += ["-i", text_png_path]
+    return command + [
+        "-filter_complex", build_filter_graph(layers, output_filters=output_filters),
+        "-map", "[v]",
+        "-map", "0:a?",
+        "-c:v", "libx264",
+        "-preset", preset,
+        "-crf", str(crf),
+        "-c:a", "copy",
+        "-movflags", "+faststart",
+        output_path,
+    ]
+
+
+def build_frame_command(input_path, text_png_paths, output_path, layers, timestamp, image_format):
+    """Composite `layers` (those visible at `timestamp`) onto the single frame at `timestamp`"""
+    pixel_format = "yuvj420p" if image_format == "jpeg" else "rgb24"
+    command = [ffmpeg_binary(), "-hide_banner", "-loglevel", "error", "-y", "-ss", str(timestamp), "-i", input_path]
+    for text_png_path in text_png_paths:
+        command += ["-i", text_png_path]
+    command += [
+        "-filter_complex", build_filter_graph(layers, timed=False, output_filters=f"format={pixel_format}"),
+        "-map", "[v]",
+        "-frames:v", "1",
+    ]
+    if image_format == "jpeg":
+        command += ["-q:v", "3"]
+    return command + [output_path]
+
+
+def run(command):
+    result = subprocess.run(command, capture_output=True, text=True, timeout=TIMEOUT_SEC)
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg exited with {result.returncode}: {result.stderr.strip()[-2000:]}")
+    return result
+
+
+_STREAM_SIZE = re.compile(r"Video:.*?, (\d{2,5})x(\d{2,5})")
+_DURATION = re.compile(r"Duration: (\d+):(\d{2}):(\d{2}(?:\.\d+)?)")
+
+
+def probe(input_path):
+    """{"width", "height", "duration", "audio"} of a video file (None where unknown)
+
+    Parsed from the stream list ffmpeg prints when run without outputs, so no
+    ffprobe binary is needed.
+    """
+    stderr = subprocess.run([ffmpeg_binary(), "-hide_banner", "-i", input_path], capture_output=True, text=True, timeout=30).stderr
+    size = _STREAM_SIZE.search(stderr)
+    duration = _DURATION.search(stderr)
+    return {
+        "width": int(size.group(1)) if size else None,
+        "height": int(size.group(2)) if size else None,
+        "duration": round(int(duration.group(1)) * 3600 + int(duration.group(2)) * 60 + float(duration.group(3)), 3) if duration else None,
+        "audio": "Audio:" in stderr,
+    }
+
+
+def has_audio(input_path):
+    return probe(input_path)["audio"]
+
+
+def write_text_pngs(workdir, layers):
+    text_png_paths = []
+    for index, layer in enumerate(layers):
+        text_png_path = os.path.join(workdir, f"layer{index}.png")
+        with open(text_png_path, "wb") as f:
+            f.write(render_text_png(layer))
+        text_png_paths.append(text_png_path)
+    return text_png_paths
+
+
+def render(input_path, output_path, layers, preview=None):
+    with tempfile.TemporaryDirectory(prefix="overlay-") as workdir:
+        if preview and preview["mode"] == "frame":
+            layers = [layer for layer in layers if is_active(layer, preview["time"])]
+            command = build_frame_command(
+                input_path, write_text_pngs(workdir, layers), output_path, layers, preview["time"], preview["format"]
+            )
+        else:
+            command = build_command(input_path, write_text_pngs(workdir, layers), output_path, layers, proxy=preview)
+
+        print(f"Rendering {len(layers)} overlay layer(s) with ffmpeg: {' '.join(command[1:])}")
+        run(command)
+        if not os.path.exists(output_path) or not os.path.getsize(output_path):
+            raise RuntimeError("ffmpeg produced no output (is the preview time past the end of the video?)")
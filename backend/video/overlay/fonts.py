@@ -0,0 +1,140 @@
+"""Font lookup for text overlays.
+
+The font directories are scanned once per instance, on the first lookup, into
+an index from normalised names to font files. Each file is indexed under its
+file name and, when Pillow can read it, under its family name and
+family + style (e.g. "DejaVu Sans" and "DejaVu Sans Bold"). Names are
+normalised by lower-casing and dropping spaces, "-" and "_", so "Arial-Bold",
+"arial bold" and "Arial_Bold" are the same key. Results, including misses,
+are memoised per requested name in an LRU of the LOOKUP_ENTRIES most recent
+names, since font names come from requests.
+
+Fonts in backend/video/fonts are deployed with the function, so that is the
+place for brand fonts; they take precedence over system fonts.
+
+Configuration (environment variables):
+    OVERLAY_FONT_DIRS  - extra font directories, separated by ":" (searched
+                         after the bundled directory)
+"""
+import os
+import threading
+from pathlib import Path
+
+from grokads.cache import LRUCache
+
+BUNDLED_FONT_DIR = str(Path(__file__).resolve().parent.parent / "fonts")
+
+FONT_DIRS = [
+    BUNDLED_FONT_DIR,
+    *[path for path in os.getenv("OVERLAY_FONT_DIRS", "").split(":") if path],
+    # Linux (Cloud Functions runtime, Docker images)
+    '/usr/share/fonts',
+    '/usr/local/share/fonts',
+    os.path.expanduser('~/.local/share/fonts'),
+    os.path.expanduser('~/.fonts'),
+    # macOS (local development)
+    '/System/Library/Fonts',
+    '/Library/Fonts',
+    os.path.expanduser('~/Library/Fonts'),
+]
+
+FONT_EXTENSIONS = ('.ttf', '.otf', '.ttc')
+
+# Styles that make a file the default for its family name
+REGULAR_STYLES = ('regular', 'book', 'normal', 'roman', 'medium')
+STYLE_SUFFIXES = ('-Bold', '-Regular', '-Italic')
+
+LOOKUP_ENTRIES = 512
+# Cached value of a name no font matches (LRUCache.get returns None on a miss)
+_NOT_FOUND = ""
+
+
+def normalize(name):
+    return "".join(ch for ch in name.lower() if ch not in " -_")
+
+
+class FontRegistry:
+    """Index of the fonts installed in `font_dirs`, built on first use"""
+
+    def __init__(self, font_dirs):
+        self.font_dirs = font_dirs
+        self._index = None
+        self._lookups = LRUCache(LOOKUP_ENTRIES)
+        self._lock = threading.Lock()
+
+    def _scan(self):
+        index = {}
+        regular_families = set()
+        for font_dir in self.font_dirs:
+            if not os.path.isdir(font_dir):
+                continue
+            for root, _, files in os.walk(font_dir):
+                for file in sorted(files):
+                    if not file.lower().endswith(FONT_EXTENSIONS):
+                        continue
+                    path = os.path.join(root, file)
+                    # Earlier directories win, so bundled fonts shadow system ones
+                    index.setdefault(normalize(os.path.splitext(file)[0]), path)
+
+                    family, style = _font_names(path)
+                    if not family:
+                        continue
+                    index.setdefault(normalize(f"{family}{style or ''}"), path)
+                    # The bare family name points at its regular style when there is one
+                    family_key = normalize(family)
+                    is_regular = (style or 'regular').lower() in REGULAR_STYLES
+                    if family_key not in index or (is_regular and family_key not in regular_families):
+                        index[family_key] = path
+                    if is_regular:
+                        regular_families.add(family_key)
+        print(f"Indexed {len(index)} font names from {len(self.font_dirs)} directories")
+        return index
+
+    def index(self):
+        if self._index is None:
+            with self._lock:
+                if self._index is None:
+                    self._index = self._scan()
+        return self._index
+
+    def find(self, font_name):
+        """Path of the font best matching `font_name`, or None"""
+        cached = self._lookups.get(font_name)
+        if cached is not None:
+            return cached or None
+
+        index = self.index()
+        key = normalize(font_name)
+        base_name = font_name
+        for suffix in STYLE_SUFFIXES:
+            base_name = base_name.replace(suffix, '')
+        base_key = normalize(base_name)
+
+        path = index.get(key) or index.get(base_key) or index.get(f"{base_key}bold")
+        if path is None:
+            # Partial names ("Dejavu" for "DejaVu Sans"); only reached once per name
+            path = next((index[name] for name in sorted(index) if key in name or base_key in name), None)
+
+        if path is None:
+            print(f"Font '{font_name}' not found, using default font")
+        self._lookups.set(font_name, path or _NOT_FOUND)
+        return path
+
+
+def _font_names(path):
+    """(family, style) from the font file's name table, or (None, None)"""
+    try:
+        from PIL import ImageFont
+        return ImageFont.truetype(path, 10).getname()
+    except Exception:
+        return None, None
+
+
+registry = FontRegistry(FONT_DIRS)
+
+
+def find_font(font_name):
+    """Try to find a valid font file, return None if not found (uses default)"""
+    if not font_name:
+        return None
+    return registry.find(font_name)
@@ -0,0 +1,90 @@
+"""MoviePy overlay engine: composites the text clip frame by frame in Python."""
+import tempfile
+
+from overlay.text import stroke_padding
+
+
+def text_clip(layer, video_duration):
+    """A positioned, timed TextClip for one layer"""
+    from moviepy import TextClip
+
+    start_time = layer["start_time"]
+    duration = layer["duration"]
+
+    # Calculate text duration (use video duration if not specified)
+    text_duration = duration if duration is not None else video_duration - start_time
+    text_duration = min(text_duration, video_duration - start_time)  # Don't exceed video length
+
+    # Calculate padding needed for stroke (stroke extends outward)
+    # Add generous padding to prevent any clipping
+    padding = stroke_padding(layer["stroke_width"])
+
+    # Build TextClip parameters
+    # Use 'label' method for single-line text positioning
+    text_clip_params = {
+        "text": layer["text"],
+        "font_size": layer["font_size"],
+        "color": layer["font_color"],
+        "stroke_color": layer["stroke_color"],
+        "stroke_width": layer["stroke_width"],
+        "method": 'label',
+        "text_align": layer["alignment"],
+        "margin": (padding, padding),  # Add margin to prevent clipping
+        "transparent": True  # Ensure transparent background
+    }
+
+    # Only add font parameter if we have a valid font path
+    if layer.get("font_path"):
+        text_clip_params["font"] = layer["font_path"]
+
+    # Create text clip with margin
+    txt_clip = TextClip(**text_clip_params)
+
+    print(f"Text clip size with margin: {txt_clip.w}x{txt_clip.h}")
+
+    # Position the text clip
+    return txt_clip.with_position((layer["position_x"], layer["position_y"])).with_start(start_time).with_duration(text_duration)
+
+
+def render(input_path, output_path, layers, preview=None):
+    # Imported lazily: MoviePy pulls in numpy/imageio and is only needed here
+    from moviepy import VideoFileClip, CompositeVideoClip
+
+    # Load video
+    print("Loading video with MoviePy...")
+    video = VideoFileClip(input_path)
+
+    txt_clips = [text_clip(layer, video.duration) for layer in layers]
+
+    # Composite video with all text overlays (later layers on top)
+    print(f"Compositing video with {len(txt_clips)} text overlay(s)...")
+    final_video = CompositeVideoClip([video, *txt_clips])
+
+    if preview and preview["mode"] == "frame":
+        # Single composited frame
+        print(f"Saving preview frame at {preview['time']}s to: {output_path}")
+        final_video.save_frame(output_path, t=preview["time"], with_mask=False)
+    else:
+        write_params = {}
+        if preview:
+            # Low-resolution proxy: scaled after compositing, so the layout matches the full render
+            final_video = final_video.resized(height=preview["height"])
+            write_params = {"fps": preview["fps"], "preset": "ultrafast"}
+
+        # Write output video
+        print(f"Writing output video to: {output_path}")
+        final_video.write_videofile(
+            output_path,
+            codec='libx264',
+            audio_codec='aac',
+            temp_audiofile=tempfile.mktemp(suffix='.m4a'),
+            remove_temp=True,
+            logger=None,
+            **write_params
+        )
+
+    # Clean up video objects to free memory
+    for txt_clip in txt_clips:
+        txt_clip.close()
+    final_video.close()
+    video.close()
@@ -0,0 +1,325 @@
+"""Multi-aspect renditions of an overlay render from one decode pass.
+
+The source is decoded once and the text layers are composited once (in
+source coordinates); a `split` filter then fans the composited video out to
+one branch per output, each cropped or padded to its aspect ratio, scaled,
+and encoded by its own libx264 encoder inside the same ffmpeg process.
+
+A rendition is an MP4 at one size, or (with `hls`) an HLS ladder: several
+sizes of the same aspect ratio, packaged with a master playlist. Segments
+and playlists are uploaded to media storage; playlists are rewritten to
+point at signed URLs, since signed URLs can't be resolved relatively.
+MP4 renditions are stored as content-addressed assets (grokads.assets).
+
+Renditions need the ffmpeg engine; there is no MoviePy fallback.
+
+Configuration (environment variables):
+    OVERLAY_MAX_RENDITIONS   - max encodes per request, ladder rungs included (default 6)
+    OVERLAY_HLS_SEGMENT_SEC  - HLS segment length in seconds (default 4)
+"""
+import os
+import re
+import tempfile
+import uuid
+
+from grokads import assets, storage
+from overlay import ffmpeg_engine
+
+MAX_RENDITIONS = int(os.getenv("OVERLAY_MAX_RENDITIONS", "6"))
+HLS_SEGMENT_SEC = int(os.getenv("OVERLAY_HLS_SEGMENT_SEC", "4"))
+
+FITS = ("crop", "pad")
+DEFAULT_HEIGHT = 1080
+MIN_HEIGHT, MAX_HEIGHT = 144, 2160
+# Default bitrate of an HLS rung per pixel of frame size (about 0.1 bits/pixel/frame
+# at 30 fps): players choose rungs by their advertised bandwidth, so every rung
+# needs one, and a CRF-only rung would advertise little more than its audio
+HLS_BITS_PER_PIXEL = 3
+
+_ASPECT = re.compile(r"^\s*(\d+)\s*[:x]\s*(\d+)\s*$")
+_BITRATE = re.compile(r"^(\d+(?:\.\d+)?)([kKmM]?)$")
+# Names become storage paths
+_NAME = re.compile(r"^[A-Za-z0-9_.-]{1,64}$")
+
+
+def _parse_bitrate(value):
+    """Bits per second from "2500k", "4M" or 800000"""
+    match = _BITRATE.match(str(value).strip())
+    if not match:
+        raise ValueError(f"Invalid 'video_bitrate' {value!r}, expected e.g. \"2500k\" or \"4M\"")
+    number, unit = match.groups()
+    return int(float(number) * {"": 1, "k": 1000, "m": 1000000}[unit.lower()])
+
+
+def _parse_height(value):
+    try:
+        height = int(value)
+    except (TypeError, ValueError):
+        raise ValueError("'height' must be a number")
+    if not MIN_HEIGHT <= height <= MAX_HEIGHT:
+        raise ValueError(f"'height' must be {MIN_HEIGHT}-{MAX_HEIGHT}")
+    return height - height % 2
+
+
+def _encode(aspect_w, aspect_h, height, bitrate):
+    # libx264 needs even dimensions
+    width = int(round(height * aspect_w / aspect_h / 2)) * 2
+    return {"width": width, "height": height, "video_bitrate": bitrate}
+
+
+def build_rendition(params):
+    """Validate one rendition target and fill in the defaults
+
+    {"aspect": "9:16", "fit": "crop" | "pad", "height": 1080,
+     "video_bitrate": "4M", "name": "story", "hls": [720, 480]}
+    Raises ValueError with a client-facing message.
+    """
+    if not isinstance(params, dict):
+        raise ValueError("Each rendition must be an object")
+
+    match = _ASPECT.match(str(params.get("aspect", "")))
+    if not match or not all(int(part) for part in match.groups()):
+        raise ValueError("Missing or invalid 'aspect', expected e.g. \"9:16\"")
+    aspect_w, aspect_h = (int(part) for part in match.groups())
+
+    fit = params.get("fit", "crop")
+    if fit not in FITS:
+        raise ValueError(f"Invalid 'fit', expected one of: {', '.join(FITS)}")
+
+    height = _parse_height(params.get("height", DEFAULT_HEIGHT))
+    bitrate = _parse_bitrate(params["video_bitrate"]) if params.get("video_bitrate") else None
+
+    ladder = params.get("hls")
+    if ladder:
+        if not isinstance(ladder, list):
+            raise ValueError("'hls' must be a list of heights or {height, video_bitrate} objects")
+        encodes = []
+        for rung in ladder:
+            rung = rung if isinstance(rung, dict) else {"height": rung}
+            encode = _encode(
+                aspect_w, aspect_h,
+                _parse_height(rung.get("height")),
+                _parse_bitrate(rung["video_bitrate"]) if rung.get("video_bitrate") else bitrate,
+            )
+            if encode["video_bitrate"] is None:
+                encode["video_bitrate"] = encode["width"] * encode["height"] * HLS_BITS_PER_PIXEL
+            encodes.append(encode)
+    else:
+        encodes = [_encode(aspect_w, aspect_h, height, bitrate)]
+
+    name = str(params.get("name") or f"{aspect_w}x{aspect_h}")
+    if not _NAME.match(name):
+        raise ValueError("'name' may only contain letters, digits, '_', '-' and '.'")
+
+    return {
+        "name": name,
+        "aspect": f"{aspect_w}:{aspect_h}",
+        "fit": fit,
+        "hls": bool(ladder),
+        "encodes": encodes,
+    }
+
+
+def build_renditions(params):
+    """Validate the `renditions` request parameter; returns None when absent"""
+    if params is None:
+        return None
+    if not isinstance(params, list) or not params:
+        raise ValueError("'renditions' must be a non-empty list")
+
+    renditions = []
+    for index, rendition_params in enumerate(params):
+        try:
+            renditions.append(build_rendition(rendition_params))
+        except ValueError as rendition_error:
+            raise ValueError(f"Rendition {index}: {str(rendition_error)}")
+
+    names = [rendition["name"] for rendition in renditions]
+    if len(set(names)) != len(names):
+        raise ValueError("Rendition names must be unique")
+    if sum(len(rendition["encodes"]) for rendition in renditions) > MAX_RENDITIONS:
+        raise ValueError(f"Too many renditions: at most {MAX_RENDITIONS} encodes (HLS rungs included) allowed")
+    return renditions
+
+
+def fit_filter(fit, width, height):
+    """Scale to width x height, cropping the overflow or padding the remainder (centered)"""
+    if fit == "pad":
+        return (
+            f"scale={width}:{height}:force_original_aspect_ratio=decrease,"
+            f"pad={width}:{height}:(ow-iw)/2:(oh-ih)/2:color=black,setsar=1"
+        )
+    return f"scale={width}:{height}:force_original_aspect_ratio=increase,crop={width}:{height},setsar=1"
+
+
+def _video_rate_args(encode, stream_specifier="v"):
+    bitrate = encode["video_bitrate"]
+    if bitrate is None:
+        return []
+    return [f"-b:{stream_specifier}", str(bitrate), f"-maxrate:{stream_specifier}", str(bitrate),
+            f"-bufsize:{stream_specifier}", str(bitrate * 2)]
+
+
+def build_command(input_path, text_png_paths, workdir, layers, renditions, audio):
+    """One ffmpeg command: composite once, split, and encode every rendition
+
+    Returns (command, outputs), where outputs[i] is the local path of
+    rendition i (an .mp4 file, or the directory of an HLS ladder).
+    """
+    branches = [
+        (rendition_index, encode_index, encode)
+        for rendition_index, rendition in enumerate(renditions)
+        for encode_index, encode in enumerate(rendition["encodes"])
+    ]
+    split_labels = "".join(f"[s{index}]" for index in range(len(branches)))
+    graph = [ffmpeg_engine.build_filter_graph(layers, output_filters=f"split={len(branches)}", outputs=split_labels)]
+    for index, (rendition_index, encode_index, encode) in enumerate(branches):
+        fit = fit_filter(renditions[rendition_index]["fit"], encode["width"], encode["height"])
+        graph.append(f"[s{index}]{fit},format=yuv420p[r{rendition_index}_{encode_index}]")
+
+    command = [ffmpeg_engine.ffmpeg_binary(), "-hide_banner", "-loglevel", "error", "-y", "-i", input_path]
+    for text_png_path in text_png_paths:
+        command += ["-i", text_png_path]
+    command += ["-filter_complex", ";".join(graph)]
+
+    outputs = []
+    for rendition_index, rendition in enumerate(renditions):
+        encodes = rendition["encodes"]
+        if not rendition["hls"]:
+            output_path = os.path.join(workdir, f"rendition{rendition_index}.mp4")
+            command += [
+                "-map", f"[r{rendition_index}_0]",
+                "-map", "0:a?",
+                "-c:v", "libx264",
+                "-preset", ffmpeg_engine.X264_PRESET,
+                "-crf", str(ffmpeg_engine.X264_CRF),
+                *_video_rate_args(encodes[0]),
+                "-c:a", "copy",
+                "-movflags", "+faststart",
+                output_path,
+            ]
+            outputs.append(output_path)
+            continue
+
+        ladder_dir = os.path.join(workdir, f"rendition{rendition_index}")
+        os.makedirs(ladder_dir)
+        for encode_index in range(len(encodes)):
+            command += ["-map", f"[r{rendition_index}_{encode_index}]"]
+        if audio:
+            command += ["-map", "0:a:0"] * len(encodes)
+        for encode_index, encode in enumerate(encodes):
+            command += _video_rate_args(encode, f"v:{encode_index}")
+        stream_map = " ".join(
+            f"v:{encode_index},a:{encode_index}" if audio else f"v:{encode_index}"
+            for encode_index in range(len(encodes))
+        )
+        command += [
+            "-c:v", "libx264",
+            "-preset", ffmpeg_engine.X264_PRESET,
+            "-crf", str(ffmpeg_engine.X264_CRF),
+            # Keyframes on segment boundaries so every rung can switch at every segment
+            "-force_key_frames", f"expr:gte(t,n_forced*{HLS_SEGMENT_SEC})",
+            "-c:a", "aac",
+            "-b:a", "128k",
+            "-f", "hls",
+            "-hls_time", str(HLS_SEGMENT_SEC),
+            "-hls_playlist_type", "vod",
+            "-hls_segment_filename", os.path.join(ladder_dir, "stream_%v_%03d.ts"),
+            "-master_pl_name", "master.m3u8",
+            "-var_stream_map", stream_map,
+            os.path.join(ladder_dir, "stream_%v.m3u8"),
+        ]
+        outputs.append(ladder_dir)
+    return command, outputs
+
+
+def _publish_hls(ladder_dir, storage_prefix):
+    """Upload an HLS ladder; returns (master playlist media info, total bytes)
+
+    Segments go first, then each variant playlist rewritten to the segments'
+    signed URLs, then the master playlist rewritten to the variants' URLs.
+    """
+    urls = {}
+    total_bytes = 0
+    files = sorted(os.listdir(ladder_dir))
+    for file in files:
+        if file.endswith(".ts"):
+            path = f"{storage_prefix}/{file}"
+            total_bytes += storage.save_file(path, os.path.join(ladder_dir, file), "video/mp2t")
+            urls[file] = storage.signed_url(path)
+
+    def publish_playlist(file):
+        with open(os.path.join(ladder_dir, file)) as f:
+            lines = [urls.get(line.strip(), line.rstrip("\n")) for line in f]
+        body = ("\n".join(lines) + "\n").encode("utf-8")
+        path = storage.put_bytes(f"{storage_prefix}/{file}", body, "application/vnd.apple.mpegurl")
+        return path, len(body)
+
+    for file in files:
+        if file.endswith(".m3u8") and file != "master.m3u8":
+            path, size_bytes = publish_playlist(file)
+            urls[file] = storage.signed_url(path)
+            total_bytes += size_bytes
+    path, size_bytes = publish_playlist("master.m3u8")
+    return storage.media_info(path, "application/vnd.apple.mpegurl", size_bytes), total_bytes + size_bytes
+
+
+def render_renditions(input_path, layers, renditions, parent_asset_id=None):
+    """Render and store every rendition; returns the rendition manifest (a list)"""
+    job_id = uuid.uuid4().hex
+    source = ffmpeg_engine.probe(input_path)
+    with tempfile.TemporaryDirectory(prefix="renditions-") as workdir:
+        text_png_paths = ffmpeg_engine.write_text_pngs(workdir, layers)
+        command, outputs = build_command(
+            input_path, text_png_paths, workdir, layers, renditions, audio=source["audio"]
+        )
+        print(f"Rendering {len(renditions)} rendition(s) with ffmpeg: {' '.join(command[1:])}")
+        ffmpeg_engine.run(command)
+
+        manifest = []
+        for rendition, output in zip(renditions, outputs):
+            entry = {
+                "name": rendition["name"],
+                "aspect": rendition["aspect"],
+                "fit": rendition["fit"],
+            }
+            if rendition["hls"]:
+                media, total_bytes = _publish_hls(output, f"renditions/{job_id}/{rendition['name']}")
+                entry.update({
+                    "format": "hls",
+                    "playlist_url": media["url"],
+                    "url_expires_at": media["url_expires_at"],
+                    "storage_path": media["storage_path"],
+                    "mime_type": media["mime_type"],
+                    "size_bytes": total_bytes,
+                    "variants": [
+                        {"width": encode["width"], "height": encode["height"], "video_bitrate": encode["video_bitrate"]}
+                        for encode in rendition["encodes"]
+                    ],
+                })
+            else:
+                encode = rendition["encodes"][0]
+                asset = assets.put_file(
+                    output,
+                    "video/mp4",
+                    producer="add_text_overlay",
+                    parent_asset_id=parent_asset_id,
+                    width=encode["width"],
+                    height=encode["height"],
+                    duration=source["duration"],
+                )
+                media = storage.media_info(asset["storage_path"], "video/mp4", asset["size_bytes"])
+                entry.update({
+                    "format": "mp4",
+                    "asset_id": asset["asset_id"],
+                    "video_url": media["url"],
+                    "url_expires_at": media["url_expires_at"],
+                    "storage_path": asset["storage_path"],
+                    "mime_type": "video/mp4",
+                    "size_bytes": asset["size_bytes"],
+                    "width": encode["width"],
+                    "height": encode["height"],
+                    "video_bitrate": encode["video_bitrate"],
+                })
+            manifest.append(entry)
+    return manifest
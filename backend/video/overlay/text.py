@@ -0,0 +1,113 @@
+"""Rasterise a text layer to a transparent image with Pillow.
+
+Follows MoviePy's TextClip (method="label") exactly: same margins, baseline
+anchoring, stroke offset and size computation. A PNG from here placed at
+(position_x, position_y) lands on the same pixels as the MoviePy engine.
+
+Encoded PNGs are kept in an in-process LRU cache keyed by everything that
+affects the raster (text, font, size, colors, stroke, alignment), so a
+caption that is rendered again skips both glyph rendering and PNG encoding.
+
+Configuration (environment variables):
+    OVERLAY_RASTER_CACHE_ENTRIES  - max cached rasters (default 256)
+    OVERLAY_RASTER_CACHE_MB       - max total size of cached PNGs (default 64)
+"""
+import io
+import os
+
+from PIL import Image, ImageDraw, ImageFont
+
+from grokads.cache import LRUCache
+
+# MoviePy's TextClip default line spacing
+INTERLINE = 4
+
+RASTER_CACHE_ENTRIES = int(os.getenv("OVERLAY_RASTER_CACHE_ENTRIES", "256"))
+RASTER_CACHE_BYTES = int(float(os.getenv("OVERLAY_RASTER_CACHE_MB", "64")) * 1024 * 1024)
+
+_rasters = LRUCache(RASTER_CACHE_ENTRIES, max_bytes=RASTER_CACHE_BYTES)
+
+
+def stroke_padding(stroke_width):
+    """Margin around the text so the stroke is never clipped"""
+    return max(stroke_width * 3, 20)
+
+
+def _load_font(font_path, font_size):
+    if font_path:
+        return ImageFont.truetype(font_path, font_size)
+    return ImageFont.load_default(font_size)
+
+
+def _text_size(draw, text, pil_font, stroke_width, align):
+    left, top, right, bottom = draw.multiline_textbbox(
+        (0, 0),
+        text,
+        font=pil_font,
+        spacing=INTERLINE,
+        align=align,
+        stroke_width=stroke_width,
+        anchor="ls",
+    )
+    try:
+        # Removed in recent Pillow versions; MoviePy falls back the same way
+        ascent, descent = pil_font.getmetrics()
+        line_height = draw._multiline_spacing(pil_font, INTERLINE, stroke_width)
+        height = int(text.count("\n") * line_height + ascent + descent + stroke_width * 2)
+    except AttributeError:
+        height = int(bottom - top)
+    return int(right - left), height
+
+
+def render_text_image(layer):
+    """Return an RGBA PIL image of the layer's text, including its margin"""
+    text = layer["text"]
+    font_size = layer["font_size"]
+    stroke_width = layer["stroke_width"]
+    align = layer["alignment"]
+    margin = stroke_padding(stroke_width)
+
+    pil_font = _load_font(layer.get("font_path"), font_size)
+    measure = ImageDraw.Draw(Image.new("RGB", (1, 1)))
+    text_width, text_height = _text_size(measure, text, pil_font, stroke_width, align)
+
+    image = Image.new("RGBA", (text_width + 2 * margin, text_height + 2 * margin), color=(0, 0, 0, 0))
+    draw = ImageDraw.Draw(image)
+
+    ascent, _ = pil_font.getmetrics()
+    draw.multiline_text(
+        xy=(margin + stroke_width, margin + ascent + stroke_width),
+        text=text,
+        fill=layer["font_color"],
+        font=pil_font,
+        spacing=INTERLINE,
+        align=align,
+        stroke_width=stroke_width,
+        stroke_fill=layer["stroke_color"],
+        anchor="ls",
+    )
+    return image
+
+
+def raster_key(layer):
+    return (
+        layer["text"],
+        layer.get("font_path"),
+        layer["font_size"],
+        str(layer["font_color"]),
+        str(layer["stroke_color"]),
+        layer["stroke_width"],
+        layer["alignment"],
+    )
+
+
+def render_text_png(layer):
+    """The layer's text as PNG bytes, from the raster cache when possible"""
+    key = raster_key(layer)
+    png = _rasters.get(key)
+    if png is None:
+        buffer = io.BytesIO()
+        render_text_image(layer).save(buffer, format="PNG")
+        png = buffer.getvalue()
+        _rasters.set(key, png)
+    return png
@@ -0,0 +1,186 @@
+"""Bounded-memory video input and output for add_text_overlay.
+
+The source video can arrive as:
+    raw body        - Content-Type video/* or application/octet-stream, with
+                      the parameters as JSON in the `params` query argument
+    multipart       - a `video` file part, with the parameters as JSON in a
+                      `params` form field
+    asset           - "asset_id": a stored asset, e.g. the asset_id returned
+                      by generate_ad (grokads.assets)
+    storage object  - "video_storage_path": a path in media storage
+    URL             - "video_url" (https, public hosts only), downloaded as a
+                      stream; for third-party videos, not our own media links
+    base64          - "video_base64" in the JSON body (legacy)
+
+Every source is copied to a temp file in CHUNK_SIZE pieces, so memory use
+is one chunk rather than a multiple of the video size. The result can be
+streamed back the same way (see wants_binary / file_response_body).
+
+Configuration (environment variables):
+    OVERLAY_MAX_UPLOAD_MB  - max input video size (default 512)
+"""
+import base64
+import binascii
+import json
+import os
+import re
+
+from grokads import assets, storage, upstream
+
+CHUNK_SIZE = 1024 * 1024
+MAX_UPLOAD_BYTES = int(os.getenv("OVERLAY_MAX_UPLOAD_MB", "512")) * 1024 * 1024
+
+RAW_CONTENT_TYPES = ("application/octet-stream",)
+# Storage prefixes that may be used as input (media written by this service)
+INPUT_PREFIXES = ("assets/", "videos/", "overlays/", "renditions/", "uploads/")
+BINARY_ACCEPT_TYPES = ("video/", "image/", "application/octet-stream")
+
+# base64 slice decoded at a time; a multiple of 4 so slices decode independently
+_BASE64_SLICE = CHUNK_SIZE * 4
+_WHITESPACE = re.compile(r"\s")
+
+
+class InputError(ValueError):
+    """The request's video input is missing or unusable (a 400)"""
+
+
+def _is_raw_upload(req):
+    return req.mimetype.startswith("video/") or req.mimetype in RAW_CONTENT_TYPES
+
+
+def read_params(req):
+    """The request parameters: the JSON body, or the `params` JSON of a raw or multipart upload"""
+    if _is_raw_upload(req):
+        raw_params = req.args.get("params")
+    elif req.mimetype == "multipart/form-data":
+        raw_params = req.form.get("params")
+    else:
+        return req.get_json(silent=True)
+
+    if not raw_params:
+        raise InputError("Missing 'params' (JSON) for the uploaded video")
+    try:
+        params = json.loads(raw_params)
+    except ValueError:
+        raise InputError("'params' must be a JSON object")
+    if not isinstance(params, dict):
+        raise InputError("'params' must be a JSON object")
+    return params
+
+
+def has_video_source(req, data):
+    if _is_raw_upload(req):
+        return True
+    if req.mimetype == "multipart/form-data":
+        return "video" in req.files
+    return any(data.get(key) for key in ("asset_id", "video_storage_path", "video_url", "video_base64"))
+
+
+def _copy_chunks(chunks, path):
+    size_bytes = 0
+    with open(path, "wb") as f:
+        for chunk in chunks:
+            size_bytes += len(chunk)
+            if size_bytes > MAX_UPLOAD_BYTES:
+                raise InputError(f"Video is larger than {MAX_UPLOAD_BYTES // (1024 * 1024)} MB")
+            f.write(chunk)
+    if not size_bytes:
+        raise InputError("The video is empty")
+    return size_bytes
+
+
+def _read_chunks(f):
+    while True:
+        chunk = f.read(CHUNK_SIZE)
+        if not chunk:
+            return
+        yield chunk
+
+
+def _base64_chunks(encoded):
+    try:
+        if _WHITESPACE.search(encoded):
+            # Wrapped base64 can't be sliced at fixed offsets; decode it in one go
+            yield base64.b64decode(encoded)
+            return
+        for start in range(0, len(encoded), _BASE64_SLICE):
+            yield base64.b64decode(encoded[start:start + _BASE64_SLICE])
+    except (TypeError, binascii.Error):
+        raise InputError("'video_base64' is not valid base64")
+
+
+def save_video(req, data, path):
+    """Copy the request's video to `path`; returns its size in bytes
+
+    Raises InputError for a client error (bad reference, failed download,
+    too large).
+    """
+    if _is_raw_upload(req):
+        print("Streaming raw video body to disk...")
+        return _copy_chunks(_read_chunks(req.stream), path)
+
+    if req.mimetype == "multipart/form-data":
+        print("Streaming multipart video upload to disk...")
+        return _copy_chunks(_read_chunks(req.files["video"].stream), path)
+
+    if data.get("asset_id"):
+        asset = assets.get(data["asset_id"])
+        if asset is None:
+            raise InputError(f"Unknown asset: {data['asset_id']}")
+        if not asset["content_type"].startswith("video/"):
+            raise InputError(f"Asset {data['asset_id']} is not a video")
+        print(f"Streaming video from asset: {data['asset_id']}")
+        with storage.open_read(asset["storage_path"]) as f:
+            return _copy_chunks(_read_chunks(f), path)
+
+    if data.get("video_storage_path"):
+        storage_path = data["video_storage_path"]
+        if ".." in storage_path or not storage_path.startswith(INPUT_PREFIXES):
+            raise InputError(f"'video_storage_path' must be under one of: {', '.join(INPUT_PREFIXES)}")
+        if storage.get_backend().size(storage_path) is None:
+            raise InputError(f"Video not found in storage: {storage_path}")
+        print(f"Streaming video from storage: {storage_path}")
+        with storage.open_read(storage_path) as f:
+            return _copy_chunks(_read_chunks(f), path)
+
+    if data.get("video_url"):
+        # Client-supplied: only public https hosts, on a connection of its own
+        url_error = upstream.public_url_error(data["video_url"])
+        if url_error:
+            raise InputError(f"'video_url' {url_error}")
+        print(f"Downloading video from URL: {data['video_url']}")
+        try:
+            return _copy_chunks(upstream.download_public_chunks(data["video_url"], timeout=60, chunk_size=CHUNK_SIZE), path)
+        except upstream.UpstreamError as download_error:
+            raise InputError(f"Failed to download video from URL: {download_error.status_code}")
+        except InputError:
+            raise
+        except ValueError as redirect_error:
+            raise InputError(f"'video_url' redirect rejected: {redirect_error}")
+
+    print("Decoding base64 video...")
+    return _copy_chunks(_base64_chunks(data["video_base64"]), path)
+
+
+def wants_binary(req, data):
+    """Whether to answer with the rendered file itself instead of JSON"""
+    if data.get("output") in ("binary", "json"):
+        return data["output"] == "binary"
+    accept = req.headers.get("Accept", "")
+    return any(content_type in accept for content_type in BINARY_ACCEPT_TYPES)
+
+
+def file_response_body(path):
+    """Yield the file at `path` in chunks
+
+    The file is opened before the response is returned, so the handler can
+    delete its temp files right away: on POSIX the open handle keeps the
+    data readable until the stream is done.
+    """
+    f = open(path, "rb")
+
+    def stream():
+        with f:
+            yield from _read_chunks(f)
+
+    return stream()
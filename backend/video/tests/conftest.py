@@ -0,0 +1,12 @@
+"""Run the tests from anywhere: `python -m pytest backend/video/tests`
+
+The shared grokads package is imported from the functions codebase, the
+source of the copy ../../sync-shared.sh makes, so the tests never run
+against a stale copy.
+"""
+import sys
+from pathlib import Path
+
+VIDEO_DIR = Path(__file__).resolve().parent.parent
+
+sys.path[:0] = [str(VIDEO_DIR.parent / "functions"), str(VIDEO_DIR)]
@@ -0,0 +1,65 @@
+import pytest
+
+from overlay import ffmpeg_engine
+from overlay.ffmpeg_engine import build_filter_graph, enable_expression, is_active
+
+
+def layer(x=10, y=20, start_time=0, duration=None):
+    return {"position_x": x, "position_y": y, "start_time": start_time, "duration": duration}
+
+
+def test_one_overlay_per_layer_in_order():
+    graph = build_filter_graph([layer(10, 20, 0, 2), layer(30.7, 40, 1.5)])
+    assert graph.split(";") == [
+        "[0:v][1:v]overlay=x=10:y=20:enable='gte(t,0.0)*lt(t,2.0)':format=auto[v1]",
+        "[v1][2:v]overlay=x=30:y=40:enable='gte(t,1.5)':format=auto[v2]",
+        "[v2]format=yuv420p[v]",
+    ]
+
+
+def test_no_layers_passes_the_video_through():
+    assert build_filter_graph([]) == "[0:v]format=yuv420p[v]"
+
+
+def test_enable_expression():
+    assert enable_expression(1, 2) == "gte(t,1.0)*lt(t,3.0)"
+    assert enable_expression("0.5", None) == "gte(t,0.5)"
+
+
+def test_build_command(monkeypatch):
+    monkeypatch.setattr(ffmpeg_engine, "ffmpeg_binary", lambda: "ffmpeg")
+    command = ffmpeg_engine.build_command("in.mp4", ["t1.png", "t2.png"], "out.mp4", [layer(), layer()])
+    assert command[:7] == ["ffmpeg", "-hide_banner", "-loglevel", "error", "-y", "-i", "in.mp4"]
+    assert command[7:11] == ["-i", "t1.png", "-i", "t2.png"]
+    assert command[command.index("-c:a") + 1] == "copy"
+    assert command[-1] == "out.mp4"
+
+
+def test_untimed_graph_for_frame_previews():
+    graph = build_filter_graph([layer(), layer()], timed=False, output_filters="format=rgb24")
+    assert "enable" not in graph
+    assert graph.endswith("[v2]format=rgb24[v]")
+
+
+@pytest.mark.parametrize("start_time, duration, timestamp, active", [
+    (1, 2, 0.99, False),
+    (1, 2, 1, True),
+    (1, 2, 2.99, True),
+    (1, 2, 3, False),
+    (1, None, 1000, True),
+])
+def test_is_active(start_time, duration, timestamp, active):
+    assert is_active(layer(start_time=start_time, duration=duration), timestamp) is active
+
+
+def test_proxy_scales_after_compositing(monkeypatch):
+    monkeypatch.setattr(ffmpeg_engine, "ffmpeg_binary", lambda: "ffmpeg")
+    command = ffmpeg_engine.build_command("in.mp4", ["t1.png"], "out.mp4", [layer()], proxy={"height": 360, "fps": 12})
+    graph = command[command.index("-filter_complex") + 1]
+    assert graph.endswith("[v1]scale=-2:360,fps=12,format=yuv420p[v]")
+    assert command[command.index("-preset") + 1] == ffmpeg_engine.PROXY_PRESET
+
+
+def test_custom_outputs_for_renditions():
+    graph = build_filter_graph([layer()], output_filters="split=2", outputs="[s0][s1]")
+    assert graph.endswith("[v1]split=2[s0][s1]")
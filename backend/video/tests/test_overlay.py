@@ -0,0 +1,54 @@
+import pytest
+
+import overlay
+from overlay import ffmpeg_engine, moviepy_engine
+
+
+@pytest.fixture
+def engines(monkeypatch):
+    used = []
+    monkeypatch.setattr(ffmpeg_engine, "probe", lambda path: {"width": 1280, "height": 720, "duration": 3.0, "audio": True})
+    monkeypatch.setattr(ffmpeg_engine, "render", lambda *args, **kwargs: used.append("ffmpeg"))
+    monkeypatch.setattr(moviepy_engine, "render", lambda *args, **kwargs: used.append("moviepy"))
+    return used
+
+
+def test_frame_preview_past_the_end_is_a_client_error(engines):
+    preview = overlay.build_preview({"mode": "frame", "time": 10})
+    with pytest.raises(ValueError, match="less than the video duration"):
+        overlay.render_overlay("in.mp4", "out.jpg", [], preview=preview)
+    assert engines == []
+
+
+def test_frame_preview_inside_the_clip(engines):
+    assert overlay.render_overlay("in.mp4", "out.jpg", [], preview=overlay.build_preview({"time": 2.5})) == "ffmpeg"
+
+
+def test_client_errors_do_not_fall_back_to_moviepy(engines, monkeypatch):
+    def render(*args, **kwargs):
+        raise ValueError("bad layer")
+
+    monkeypatch.setattr(ffmpeg_engine, "render", render)
+    with pytest.raises(ValueError, match="bad layer"):
+        overlay.render_overlay("in.mp4", "out.mp4", [])
+    assert engines == []
+
+
+def test_ffmpeg_failures_fall_back_to_moviepy(engines, monkeypatch):
+    def render(*args, **kwargs):
+        raise RuntimeError("no ffmpeg")
+
+    monkeypatch.setattr(ffmpeg_engine, "render", render)
+    assert overlay.render_overlay("in.mp4", "out.mp4", []) == "moviepy"
+
+
+@pytest.mark.parametrize("position, expected", [(100, 100), (12.5, 12.5), ("40", 40), (-10, -10)])
+def test_layer_positions_are_numbers(position, expected):
+    layer = overlay.build_layer({"text": "Hi", "position_x": position, "position_y": 0})
+    assert layer["position_x"] == expected
+
+
+@pytest.mark.parametrize("position", ["center", "", True, [1, 2], float("inf"), "nan"])
+def test_invalid_layer_positions_are_client_errors(position):
+    with pytest.raises(ValueError, match="must be numbers"):
+        overlay.build_layer({"text": "Hi", "position_x": 0, "position_y": position})
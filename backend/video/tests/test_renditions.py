@@ -0,0 +1,103 @@
+import os
+
+import pytest
+
+from overlay import ffmpeg_engine, renditions
+from overlay.renditions import build_command, build_renditions
+
+
+def test_absent_renditions():
+    assert build_renditions(None) is None
+
+
+def test_defaults():
+    assert build_renditions([{"aspect": "9:16"}]) == [{
+        "name": "9x16",
+        "aspect": "9:16",
+        "fit": "crop",
+        "hls": False,
+        "encodes": [{"width": 608, "height": 1080, "video_bitrate": None}],
+    }]
+
+
+def test_sizes_are_even_and_bitrates_parsed():
+    rendition, = build_renditions([{"aspect": "4x5", "height": 721, "video_bitrate": "2.5M", "fit": "pad", "name": "feed"}])
+    assert rendition["name"] == "feed"
+    assert rendition["fit"] == "pad"
+    assert rendition["encodes"] == [{"width": 576, "height": 720, "video_bitrate": 2500000}]
+
+
+def test_hls_ladder_gets_a_bitrate_per_rung():
+    rendition, = build_renditions([{"aspect": "16:9", "hls": [720, {"height": 360, "video_bitrate": "800k"}]}])
+    assert rendition["hls"]
+    assert rendition["encodes"] == [
+        {"width": 1280, "height": 720, "video_bitrate": 1280 * 720 * renditions.HLS_BITS_PER_PIXEL},
+        {"width": 640, "height": 360, "video_bitrate": 800000},
+    ]
+
+
+@pytest.mark.parametrize("params, message", [
+    ([], "non-empty list"),
+    ({"aspect": "9:16"}, "non-empty list"),
+    (["9:16"], "Rendition 0: Each rendition must be an object"),
+    ([{"aspect": "wide"}], "invalid 'aspect'"),
+    ([{"aspect": "0:1"}], "invalid 'aspect'"),
+    ([{"aspect": "1:1", "fit": "stretch"}], "Invalid 'fit'"),
+    ([{"aspect": "1:1", "height": 100}], "'height' must be"),
+    ([{"aspect": "1:1", "height": "tall"}], "'height' must be a number"),
+    ([{"aspect": "1:1", "video_bitrate": "fast"}], "Invalid 'video_bitrate'"),
+    ([{"aspect": "1:1", "name": "../x"}], "'name' may only contain"),
+    ([{"aspect": "1:1", "hls": 720}], "'hls' must be a list"),
+    ([{"aspect": "1:1"}, {"aspect": "1:1"}], "unique"),
+    ([{"aspect": "1:1", "hls": [720, 480, 360, 240]}, {"aspect": "9:16", "hls": [720, 480, 360]}], "Too many renditions"),
+])
+def test_invalid_renditions(params, message):
+    with pytest.raises(ValueError, match=message):
+        build_renditions(params)
+
+
+@pytest.fixture
+def ffmpeg(monkeypatch):
+    monkeypatch.setattr(ffmpeg_engine, "ffmpeg_binary", lambda: "ffmpeg")
+
+
+def layer():
+    return {"position_x": 0, "position_y": 0, "start_time": 0, "duration": None}
+
+
+def test_build_command_composites_once_and_splits(ffmpeg, tmp_path):
+    targets = build_renditions([{"aspect": "9:16", "video_bitrate": "4M"}, {"aspect": "1:1", "fit": "pad", "height": 720}])
+    command, outputs = build_command("in.mp4", ["t.png"], str(tmp_path), [layer()], targets, audio=True)
+
+    assert command.count("-filter_complex") == 1
+    graph = command[command.index("-filter_complex") + 1].split(";")
+    assert graph[0].count("overlay=") == 1
+    assert graph[1] == "[v1]split=2[s0][s1]"
+    assert graph[2].startswith("[s0]scale=608:1080:force_original_aspect_ratio=increase,crop=608:1080")
+    assert graph[3].startswith("[s1]scale=720:720:force_original_aspect_ratio=decrease,pad=720:720")
+
+    assert outputs == [os.path.join(str(tmp_path), "rendition0.mp4"), os.path.join(str(tmp_path), "rendition1.mp4")]
+    assert command[-1] == outputs[1]
+    first = command[command.index("[r0_0]") - 1:command.index(outputs[0]) + 1]
+    assert first[first.index("-b:v") + 1] == "4000000"
+    assert "-b:v" not in command[command.index("[r1_0]"):]
+
+
+def test_build_command_hls_ladder(ffmpeg, tmp_path):
+    targets = build_renditions([{"aspect": "16:9", "hls": [720, 360]}])
+    command, outputs = build_command("in.mp4", ["t.png"], str(tmp_path), [layer()], targets, audio=True)
+
+    ladder_dir = os.path.join(str(tmp_path), "rendition0")
+    assert outputs == [ladder_dir]
+    assert os.path.isdir(ladder_dir)
+    assert command[command.index("-var_stream_map") + 1] == "v:0,a:0 v:1,a:1"
+    assert command.count("0:a:0") == 2
+    assert "-b:v:1" in command
+    assert command[-1] == os.path.join(ladder_dir, "stream_%v.m3u8")
+
+
+def test_build_command_hls_without_audio(ffmpeg, tmp_path):
+    targets = build_renditions([{"aspect": "16:9", "hls": [720, 360]}])
+    command, _ = build_command("in.mp4", [], str(tmp_path), [], targets, audio=False)
+    assert command[command.index("-var_stream_map") + 1] == "v:0 v:1"
+    assert "0:a:0" not in command